@@ -1,47 +1,107 @@
 import logging
+import threading
+import time
 from os import environ as env
+from typing import List
 
 import redis
 from dotenv import find_dotenv, load_dotenv
 from walrus import Database
 
+from .data_definitions import RedisPoolStats
+
 load_dotenv(find_dotenv())
 
 logger = logging.getLogger("django")
 
 
-def get_redis():
-    # A method to get the redis instance and is used globally
-    redis_host = env.get("REDIS_HOST", "redis")
-    redis_port = env.get("REDIS_PORT", 6379)
-    redis_password = env.get("REDIS_PASSWORD", None)
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT_SECS = 20
+# The pool statistics are logged every this many connection checkouts
+REDIS_POOL_STATS_INTERVAL = 10000
+
+
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """A blocking connection pool that counts the checkouts of connections and the time they took.
+
+    Like every redis-py pool it discards the connections of the parent process after a fork, the statistics are reset with them.
+    """
+
+    def __init__(self, name: str, **kwargs):
+        self.name = name
+        super().__init__(**kwargs)
+
+    def reset(self):
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._wait_secs_total = 0.0
+        self._wait_secs_max = 0.0
+        super().reset()
+
+    def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        connection = super().get_connection(command_name, *keys, **options)
+        wait_secs = time.perf_counter() - start
+        with self._stats_lock:
+            self._checkouts += 1
+            self._wait_secs_total += wait_secs
+            self._wait_secs_max = max(self._wait_secs_max, wait_secs)
+            checkouts = self._checkouts
+        if checkouts % REDIS_POOL_STATS_INTERVAL == 0:
+            logger.info("Redis connection pool: %s" % self.get_stats())
+        return connection
+
+    def get_stats(self) -> RedisPoolStats:
+        idle = sum(1 for connection in list(self.pool.queue) if connection is not None)
+        created = len(self._connections)
+        with self._stats_lock:
+            return RedisPoolStats(
+                name=self.name,
+                in_use=created - idle,
+                idle=idle,
+                created=created,
+                max_connections=self.max_connections,
+                checkouts=self._checkouts,
+                wait_secs_total=self._wait_secs_total,
+                wait_secs_max=self._wait_secs_max,
+            )
 
+
+def _create_connection_pool(name: str, **kwargs) -> InstrumentedConnectionPool:
+    redis_password = env.get("REDIS_PASSWORD", None)
     if redis_password:
-        r = redis.Redis(
-            host=redis_host,
-            port=redis_port,
-            password=redis_password,
-            encoding="utf-8",
-            decode_responses=True,
-        )
-    else:
-        r = redis.Redis(
-            host=redis_host, port=redis_port, encoding="utf-8", decode_responses=True
-        )
+        kwargs["password"] = redis_password
+    return InstrumentedConnectionPool(
+        name=name,
+        host=env.get("REDIS_HOST", "redis"),
+        port=int(env.get("REDIS_PORT", 6379)),
+        max_connections=int(env.get("REDIS_MAX_CONNECTIONS", REDIS_MAX_CONNECTIONS)),
+        timeout=int(env.get("REDIS_POOL_TIMEOUT_SECS", REDIS_POOL_TIMEOUT_SECS)),
+        **kwargs,
+    )
+
+
+# The connection pools of the process, all the Redis and walrus clients share them
+redis_connection_pool = _create_connection_pool(
+    "redis", encoding="utf-8", decode_responses=True
+)
+walrus_connection_pool = _create_connection_pool("walrus")
+
 
-    return r
+def get_redis():
+    # A method to get the redis instance and is used globally
+    return redis.Redis(connection_pool=redis_connection_pool)
 
 
 def get_walrus_database():
-    redis_host = env.get("REDIS_HOST", "redis")
-    redis_port = env.get("REDIS_PORT", 6379)
-    redis_password = env.get("REDIS_PASSWORD", None)
+    return Database(connection_pool=walrus_connection_pool)
 
-    if redis_password:
-        db = Database(host=redis_host, port=redis_port, password=redis_password)
-    else:
-        db = Database(host=redis_host, port=redis_port)
-    return db
+
+def get_redis_pool_stats() -> List[RedisPoolStats]:
+    """The connections in use, created and the checkout wait times of the connection pools of this process"""
+    return [
+        pool.get_stats() for pool in [redis_connection_pool, walrus_connection_pool]
+    ]
 
 
 class RedisHelper:
@@ -52,23 +112,11 @@ class RedisHelper:
         self.redis_password = env.get("REDIS_PASSWORD", None)
 
     def flush_db(self) -> bool:
-        r = redis.Redis(
-            host=self.redis_host,
-            port=self.redis_port,
-            password=self.redis_password if self.redis_password else None,
-            charset="utf-8",
-            decode_responses=True,
-        )
+        r = get_redis()
         return r.flushdb()
 
     def delete_all_opints(self):
-        r = redis.Redis(
-            host=self.redis_host,
-            port=self.redis_port,
-            password=self.redis_password if self.redis_password else None,
-            charset="utf-8",
-            decode_responses=True,
-        )
+        r = get_redis()
 
         all_opints = r.keys(pattern="flight_opint.*")
         for opint in all_opints:
@@ -0,0 +1,36 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class VerifiedTokenCacheStats:
+    """The lookups of the verified token cache and the seconds of token verification that the hits saved"""
+
+    hits: int
+    misses: int
+    size: int
+    hit_rate: float
+    decode_secs_saved: float
+
+
+@dataclass
+class DSSToken:
+    """An access token for the DSS, the times are seconds since the epoch"""
+
+    credentials: dict
+    fetched_at: float
+    expires_at: float
+    last_used_at: float = 0.0
+
+
+@dataclass
+class RedisPoolStats:
+    """The connections of a Redis connection pool and the seconds that the checkouts of connections took"""
+
+    name: str
+    in_use: int
+    idle: int
+    created: int
+    max_connections: int
+    checkouts: int
+    wait_secs_total: float
+    wait_secs_max: float
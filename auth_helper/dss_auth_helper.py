@@ -1,12 +1,16 @@
 import json
 import logging
-from datetime import datetime, timedelta
+import threading
+import time
 from os import environ as env
+from typing import Callable, Dict, Optional, Tuple
 
 import requests
 from dotenv import find_dotenv, load_dotenv
 
 from auth_helper.common import get_redis
+from auth_helper.data_definitions import DSSToken
+from common.http_client import http_client
 
 load_dotenv(find_dotenv())
 
@@ -18,57 +22,176 @@ if ENV_FILE:
     load_dotenv(ENV_FILE)
 
 
-class AuthorityCredentialsGetter:
-    """All calls to the DSS require credentials from a authority, usually the CAA since they can provide access to the system"""
+# Seconds a token is used when the token endpoint does not return expires_in
+DSS_TOKEN_DEFAULT_LIFETIME_SECS = 58 * 60
+DSS_TOKEN_REFRESH_MARGIN_SECS = 300
+DSS_TOKEN_REFRESH_CHECK_SECS = 30
 
-    def __init__(self):
-        pass
 
-    def get_cached_credentials(self, audience: str, token_type: str):
-        r = get_redis()
+class DSSTokenManager:
+    """Keeps an in-process copy of the access token of each audience and token type and refreshes it in the background before it expires.
+
+    A token is fetched in the calling request only when there is no valid copy in this process or in Redis, and then only once for all the callers that are waiting for it. Tokens that are not used after they were fetched are not refreshed again.
+    """
 
-        now = datetime.now()
+    def __init__(
+        self,
+        fetch_credentials: Callable[[str, str], dict],
+        refresh_margin_secs: Optional[int] = None,
+        refresh_check_secs: float = DSS_TOKEN_REFRESH_CHECK_SECS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.fetch_credentials = fetch_credentials
+        self.refresh_margin_secs = (
+            refresh_margin_secs
+            if refresh_margin_secs is not None
+            else int(
+                env.get("DSS_TOKEN_REFRESH_MARGIN_SECS", DSS_TOKEN_REFRESH_MARGIN_SECS)
+            )
+        )
+        self.refresh_check_secs = refresh_check_secs
+        self.clock = clock
+        self._tokens: Dict[Tuple[str, str], DSSToken] = {}
+        self._fetch_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._refresher: Optional[threading.Thread] = None
+
+    def _get_redis(self):
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    @staticmethod
+    def _get_cache_key(audience: str, token_type: str) -> str:
         token_suffix = "_auth_rid_token" if token_type == "rid" else "_auth_scd_token"
-        cache_key = audience + token_suffix
-        token_details = r.get(cache_key)
-
-        if token_details:
-            token_details = json.loads(token_details)
-            created_at = token_details["created_at"]
-            set_date = datetime.strptime(created_at, "%Y-%m-%dT%H:%M:%S.%f")
-            if now < (set_date - timedelta(minutes=58)):
-                credentials = (
-                    self.get_rid_credentials(audience=audience)
-                    if token_type == "rid"
-                    else self.get_scd_credentials(audience=audience)
-                )
+        return audience + token_suffix
+
+    def _get_fetch_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._fetch_locks.setdefault(key, threading.Lock())
+
+    def _get_shared_token(self, key: Tuple[str, str]) -> Optional[DSSToken]:
+        """The token that another process stored in Redis"""
+        token_details = self._get_redis().get(self._get_cache_key(*key))
+        if not token_details:
+            return None
+        token_details = json.loads(token_details)
+        if "expires_at" not in token_details:
+            return None
+        return DSSToken(
+            credentials=token_details["credentials"],
+            fetched_at=token_details["fetched_at"],
+            expires_at=token_details["expires_at"],
+        )
+
+    def _fetch(self, key: Tuple[str, str]) -> dict:
+        now = self.clock()
+        credentials = self.fetch_credentials(*key)
+        if not credentials.get("access_token"):
+            # The error is returned to the caller but not kept
+            return credentials
+        lifetime = int(credentials.get("expires_in", DSS_TOKEN_DEFAULT_LIFETIME_SECS))
+        token = DSSToken(
+            credentials=credentials, fetched_at=now, expires_at=now + lifetime
+        )
+        self._get_redis().set(
+            self._get_cache_key(*key),
+            json.dumps(
+                {
+                    "credentials": credentials,
+                    "fetched_at": token.fetched_at,
+                    "expires_at": token.expires_at,
+                }
+            ),
+            ex=lifetime,
+        )
+        self._tokens[key] = token
+        return credentials
 
-                r.set(
-                    cache_key,
-                    json.dumps(
-                        {"credentials": credentials, "created_at": now.isoformat()}
-                    ),
+    def _is_valid(self, token: Optional[DSSToken]) -> bool:
+        return token is not None and self.clock() < token.expires_at
+
+    def _needs_refresh(self, token: DSSToken) -> bool:
+        return self.clock() >= token.expires_at - self.refresh_margin_secs
+
+    def refresh(self, key: Tuple[str, str], min_expires_at: float = 0):
+        """Refresh the token unless there is a copy, in this process or in Redis, that expires after min_expires_at"""
+        with self._get_fetch_lock(key):
+            token = self._tokens.get(key)
+            if token is not None and token.expires_at > min_expires_at:
+                return
+            shared_token = self._get_shared_token(key)
+            if shared_token is not None and shared_token.expires_at > min_expires_at:
+                self._tokens[key] = shared_token
+                return
+            self._fetch(key)
+
+    def _refresh_expiring_tokens(self):
+        for key, token in list(self._tokens.items()):
+            if token.last_used_at < token.fetched_at or not self._needs_refresh(token):
+                continue
+            try:
+                self.refresh(key, min_expires_at=token.expires_at)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(
+                    "Could not refresh the %s token of %s: %s" % (key[1], key[0], e)
                 )
-            else:
-                credentials = token_details["credentials"]
-        else:
-            credentials = (
-                self.get_rid_credentials(audience=audience)
-                if token_type == "rid"
-                else self.get_scd_credentials(audience=audience)
-            )
 
-            access_token = credentials.get("access_token")
-            if access_token:  # there is no error in the token
-                r.set(
-                    cache_key,
-                    json.dumps(
-                        {"credentials": credentials, "created_at": now.isoformat()}
-                    ),
+    def _refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_check_secs)
+            try:
+                self._refresh_expiring_tokens()
+            except Exception as e:
+                logger.error("Could not refresh the DSS tokens: %s" % e)
+
+    def _start_refresher(self):
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(
+                    target=self._refresh_periodically, daemon=True
                 )
-                r.expire(cache_key, timedelta(minutes=58))
+                self._refresher.start()
+
+    def get_credentials(self, audience: str, token_type: str) -> dict:
+        key = (audience, token_type)
+        token = self._tokens.get(key)
+        if not self._is_valid(token):
+            with self._get_fetch_lock(key):
+                # Another caller may have fetched the token while this one waited
+                token = self._tokens.get(key)
+                if not self._is_valid(token):
+                    token = self._get_shared_token(key)
+                    if self._is_valid(token):
+                        self._tokens[key] = token
+                    else:
+                        credentials = self._fetch(key)
+                        token = self._tokens.get(key)
+                        if not self._is_valid(token):
+                            return credentials
+        token.last_used_at = self.clock()
+        self._start_refresher()
+        return token.credentials
 
-        return credentials
+
+class AuthorityCredentialsGetter:
+    """All calls to the DSS require credentials from a authority, usually the CAA since they can provide access to the system"""
+
+    def __init__(self):
+        pass
+
+    def get_cached_credentials(self, audience: str, token_type: str):
+        return dss_token_manager.get_credentials(
+            audience=audience, token_type=token_type
+        )
+
+    def fetch_credentials(self, audience: str, token_type: str):
+        return (
+            self.get_rid_credentials(audience=audience)
+            if token_type == "rid"
+            else self.get_scd_credentials(audience=audience)
+        )
 
     def get_rid_credentials(self, audience: str):
         issuer = audience if audience == "localhost" else None
@@ -93,7 +216,7 @@ class AuthorityCredentialsGetter:
 
         url = env.get("DSS_AUTH_URL") + env.get("DSS_AUTH_TOKEN_ENDPOINT")
 
-        token_data = requests.get(url, params=payload)
+        token_data = http_client.get(url, params=payload)
         t_data = token_data.json()
         return t_data
 
@@ -120,7 +243,12 @@ class AuthorityCredentialsGetter:
 
         url = env.get("DSS_AUTH_URL") + env.get("DSS_AUTH_TOKEN_ENDPOINT")
 
-        token_data = requests.get(url, params=payload)
+        token_data = http_client.get(url, params=payload)
         t_data = token_data.json()
 
         return t_data
+
+
+dss_token_manager = DSSTokenManager(
+    fetch_credentials=AuthorityCredentialsGetter().fetch_credentials
+)
@@ -0,0 +1,145 @@
+"""
+A per-process cache of the public keys that access tokens are verified against, downloaded from the JWKS endpoint of Flight Passport.
+
+The keys are fresh for PASSPORT_JWKS_CACHE_TTL_SECS. For PASSPORT_JWKS_STALE_SECS after that they are still used while they are downloaded again in the background. A token with an unknown key id downloads the keys again at most once every PASSPORT_JWKS_MISS_REFRESH_SECS, and only one request downloads the keys at a time: the others wait for it and use its keys.
+"""
+
+import json
+import logging
+import threading
+import time
+from os import environ as env
+from typing import Callable, Dict, Optional
+
+import jwt
+import requests
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+PASSPORT_JWKS_CACHE_TTL_SECS = 300
+PASSPORT_JWKS_STALE_SECS = 3600
+PASSPORT_JWKS_MISS_REFRESH_SECS = 30
+
+
+class JWKSCache:
+    """The parsed public keys of a JWKS URL by key id"""
+
+    def __init__(
+        self,
+        jwks_url: str,
+        ttl_secs: Optional[int] = None,
+        stale_secs: Optional[int] = None,
+        miss_refresh_secs: Optional[int] = None,
+        monotonic: Callable[[], float] = time.monotonic,
+    ):
+        self.jwks_url = jwks_url
+        self.ttl_secs = (
+            ttl_secs
+            if ttl_secs is not None
+            else int(
+                env.get("PASSPORT_JWKS_CACHE_TTL_SECS", PASSPORT_JWKS_CACHE_TTL_SECS)
+            )
+        )
+        self.stale_secs = (
+            stale_secs
+            if stale_secs is not None
+            else int(env.get("PASSPORT_JWKS_STALE_SECS", PASSPORT_JWKS_STALE_SECS))
+        )
+        self.miss_refresh_secs = (
+            miss_refresh_secs
+            if miss_refresh_secs is not None
+            else int(
+                env.get(
+                    "PASSPORT_JWKS_MISS_REFRESH_SECS", PASSPORT_JWKS_MISS_REFRESH_SECS
+                )
+            )
+        )
+        self.monotonic = monotonic
+        self.session = requests.Session()
+        self._keys: Optional[Dict[str, object]] = None
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+        # Incremented by every download, a request that waited for a download does not start another one
+        self._generation = 0
+        self._fetch_lock = threading.Lock()
+        self._revalidating = False
+        self._state_lock = threading.Lock()
+
+    def _fetch(self) -> Dict[str, object]:
+        response = self.session.get(self.jwks_url, timeout=10)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            try:
+                keys[jwk["kid"]] = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+            except (jwt.exceptions.InvalidKeyError, ValueError, KeyError) as e:
+                logger.error("Could not parse a key of %s: %s" % (self.jwks_url, e))
+        return keys
+
+    def refresh(self, generation: Optional[int] = None):
+        """Download the keys, unless they were downloaded since the generation was read"""
+        with self._fetch_lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._attempted_at = self.monotonic()
+            try:
+                self._keys = self._fetch()
+                self._fetched_at = self.monotonic()
+            finally:
+                self._generation += 1
+
+    def _revalidate(self):
+        try:
+            self.refresh()
+        except requests.exceptions.RequestException as e:
+            logger.error("Could not download the keys from %s: %s" % (self.jwks_url, e))
+        finally:
+            with self._state_lock:
+                self._revalidating = False
+
+    def _revalidate_in_background(self):
+        with self._state_lock:
+            if self._revalidating:
+                return
+            self._revalidating = True
+        threading.Thread(target=self._revalidate, daemon=True).start()
+
+    def _is_expired(self) -> bool:
+        return self.monotonic() - self._fetched_at >= self.ttl_secs + self.stale_secs
+
+    def get_public_key(self, key_id: str):
+        """The public key with the key id, None if the JWKS has no such key. Raises a RequestException if the keys could not be downloaded"""
+        generation = self._generation
+        if self._keys is None or self._is_expired():
+            self.refresh(generation=generation)
+            if self._keys is None or self._is_expired():
+                # The download that this request waited for failed
+                raise requests.exceptions.ConnectionError(
+                    "The keys could not be downloaded from %s" % self.jwks_url
+                )
+        elif self.monotonic() - self._fetched_at >= self.ttl_secs:
+            self._revalidate_in_background()
+
+        public_key = self._keys.get(key_id)
+        if public_key is None and (
+            self.monotonic() - self._attempted_at >= self.miss_refresh_secs
+        ):
+            # The key may have been rotated since the keys were downloaded
+            self.refresh(generation=self._generation)
+            public_key = self._keys.get(key_id)
+        return public_key
+
+
+_jwks_caches: Dict[str, JWKSCache] = {}
+_jwks_caches_lock = threading.Lock()
+
+
+def get_jwks_cache(jwks_url: str) -> JWKSCache:
+    """The cache of the keys of the JWKS URL in this process"""
+    with _jwks_caches_lock:
+        if jwks_url not in _jwks_caches:
+            _jwks_caches[jwks_url] = JWKSCache(jwks_url=jwks_url)
+        return _jwks_caches[jwks_url]
@@ -0,0 +1,91 @@
+import os
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from jwcrypto import jwk
+from rest_framework import status
+
+from auth_helper import common, jwks_cache
+from auth_helper.test_jwks_cache import FakeJWKSResponse, make_public_jwk, make_token
+
+
+class RedisConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.pool = common._create_connection_pool(
+            "test", encoding="utf-8", decode_responses=True
+        )
+        self.addCleanup(self.pool.disconnect)
+
+    def test_clients_share_the_process_pools(self):
+        self.assertIs(
+            common.get_redis().connection_pool, common.get_redis().connection_pool
+        )
+        self.assertIs(
+            common.get_walrus_database().connection_pool,
+            common.walrus_connection_pool,
+        )
+        self.assertEqual(
+            [stats.name for stats in common.get_redis_pool_stats()],
+            ["redis", "walrus"],
+        )
+
+    def test_connections_are_reused(self):
+        r = common.redis.Redis(connection_pool=self.pool)
+        for _ in range(5):
+            r.ping()
+        with r.pipeline() as pipeline:
+            pipeline.ping()
+            pipeline.execute()
+
+        stats = self.pool.get_stats()
+        self.assertEqual((stats.created, stats.in_use, stats.idle), (1, 0, 1))
+        self.assertEqual(stats.checkouts, 6)
+        self.assertGreaterEqual(stats.wait_secs_total, stats.wait_secs_max)
+
+    def test_connections_are_not_shared_with_a_forked_process(self):
+        r = common.redis.Redis(connection_pool=self.pool)
+        r.ping()
+        # The pool of a forked process sees another pid
+        self.pool.pid = -1
+        r.ping()
+
+        stats = self.pool.get_stats()
+        self.assertEqual((stats.created, stats.checkouts), (1, 1))
+
+
+class RedisPoolStatsViewTests(TestCase):
+    def setUp(self):
+        self.private_key = jwk.JWK.generate(kty="RSA", size=2048)
+        for patcher in [
+            mock.patch.dict(jwks_cache._jwks_caches, clear=True),
+            mock.patch.object(
+                jwks_cache.requests.Session,
+                "get",
+                return_value=FakeJWKSResponse(
+                    [make_public_jwk(self.private_key, "passport-key")]
+                ),
+            ),
+            mock.patch.dict(
+                os.environ, {"PASSPORT_AUDIENCE": "testflight.flightblender.com"}
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_pool_stats_of_the_process_are_returned(self):
+        response = self.client.get(
+            reverse("redis_pool_stats"),
+            HTTP_AUTHORIZATION="Bearer " + make_token(self.private_key, "passport-key"),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_json = response.json()
+        self.assertEqual(response_json["pid"], os.getpid())
+        self.assertEqual(
+            [pool["name"] for pool in response_json["pools"]], ["redis", "walrus"]
+        )
+        self.assertIn("wait_secs_max", response_json["pools"][0])
+
+    def test_token_is_required(self):
+        response = self.client.get(reverse("redis_pool_stats"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
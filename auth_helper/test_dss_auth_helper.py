@@ -0,0 +1,107 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from auth_helper import dss_auth_helper
+
+AUDIENCE = "dss.test"
+
+
+class DSSTokenManagerTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.fetched = []
+        self.manager = dss_auth_helper.DSSTokenManager(
+            fetch_credentials=self._fetch_credentials,
+            refresh_margin_secs=300,
+            clock=lambda: self.now,
+        )
+        # The background refresh is not started in the tests
+        patcher = mock.patch.object(self.manager, "_start_refresher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        r = self.manager._get_redis()
+        for token_type in ["rid", "scd"]:
+            cache_key = self.manager._get_cache_key(AUDIENCE, token_type)
+            r.delete(cache_key)
+            self.addCleanup(r.delete, cache_key)
+
+    def _fetch_credentials(self, audience, token_type):
+        self.fetched.append((audience, token_type))
+        return {
+            "access_token": "%s-%s" % (token_type, len(self.fetched)),
+            "expires_in": 3600,
+        }
+
+    def test_token_is_fetched_once_for_concurrent_callers(self):
+        fetch_credentials = self.manager.fetch_credentials
+
+        def slow_fetch_credentials(audience, token_type):
+            time.sleep(0.2)
+            return fetch_credentials(audience, token_type)
+
+        self.manager.fetch_credentials = slow_fetch_credentials
+        credentials = []
+        threads = [
+            threading.Thread(
+                target=lambda: credentials.append(
+                    self.manager.get_credentials(AUDIENCE, "rid")
+                )
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.fetched, [(AUDIENCE, "rid")])
+        self.assertEqual({c["access_token"] for c in credentials}, {"rid-1"})
+
+    def test_used_token_is_refreshed_before_it_expires(self):
+        self.assertEqual(
+            self.manager.get_credentials(AUDIENCE, "scd")["access_token"], "scd-1"
+        )
+        self.now += 3000
+        self.manager._refresh_expiring_tokens()
+        self.assertEqual(len(self.fetched), 1)
+
+        self.now += 400
+        self.manager._refresh_expiring_tokens()
+        self.assertEqual(len(self.fetched), 2)
+        # The caller does not wait for the token endpoint
+        with mock.patch.object(self.manager, "fetch_credentials") as fetch:
+            self.assertEqual(
+                self.manager.get_credentials(AUDIENCE, "scd")["access_token"], "scd-2"
+            )
+        self.assertFalse(fetch.called)
+
+        self.now += 3400
+        self.manager._refresh_expiring_tokens()
+        self.assertEqual(len(self.fetched), 3)
+
+        # The last token was not used, it is left to expire
+        self.now += 3400
+        self.manager._refresh_expiring_tokens()
+        self.assertEqual(len(self.fetched), 3)
+
+    def test_token_is_shared_between_processes(self):
+        self.manager.get_credentials(AUDIENCE, "rid")
+        other_manager = dss_auth_helper.DSSTokenManager(
+            fetch_credentials=self._fetch_credentials, clock=lambda: self.now
+        )
+        with mock.patch.object(other_manager, "_start_refresher"):
+            credentials = other_manager.get_credentials(AUDIENCE, "rid")
+        self.assertEqual(credentials["access_token"], "rid-1")
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_error_is_not_kept(self):
+        self.manager.fetch_credentials = lambda audience, token_type: {
+            "error": "invalid_client"
+        }
+        self.assertEqual(
+            self.manager.get_credentials(AUDIENCE, "rid"), {"error": "invalid_client"}
+        )
+        self.assertEqual(self.manager._tokens, {})
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from unittest import mock
+
+import requests
+from django.test import TestCase
+from django.urls import reverse
+from jwcrypto import jwk, jwt
+from rest_framework import status
+
+from auth_helper import jwks_cache
+
+JWKS_URL = "http://passport.test/.well-known/jwks.json"
+
+
+class FakeJWKSResponse:
+    def __init__(self, keys):
+        self.keys = keys
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"keys": self.keys}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def make_public_jwk(private_key: jwk.JWK, kid: str) -> dict:
+    public_jwk = json.loads(private_key.export_public())
+    public_jwk["kid"] = kid
+    return public_jwk
+
+
+def make_token(private_key: jwk.JWK, kid: str) -> str:
+    timestamp = int((datetime.utcnow() - datetime.utcfromtimestamp(0)).total_seconds())
+    token = jwt.JWT(
+        header={"typ": "JWT", "alg": "RS256", "kid": kid},
+        claims={
+            "sub": "uss_noauth",
+            "scope": "blender.read",
+            "aud": "testflight.flightblender.com",
+            "nbf": timestamp - 1,
+            "exp": timestamp + 1000,
+            "jti": str(uuid.uuid4()),
+        },
+        algs=["RS256"],
+    )
+    token.make_signed_token(private_key)
+    return token.serialize()
+
+
+class JWKSCacheTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.public_jwk = make_public_jwk(jwk.JWK.generate(kty="RSA", size=2048), "1")
+        self.cache = jwks_cache.JWKSCache(
+            jwks_url=JWKS_URL,
+            ttl_secs=300,
+            stale_secs=3600,
+            miss_refresh_secs=30,
+            monotonic=self.clock.monotonic,
+        )
+        patcher = mock.patch.object(
+            self.cache.session,
+            "get",
+            return_value=FakeJWKSResponse([self.public_jwk]),
+        )
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keys_are_downloaded_once_for_concurrent_requests(self):
+        def slow_get(*args, **kwargs):
+            time.sleep(0.2)
+            return FakeJWKSResponse([self.public_jwk])
+
+        self.get.side_effect = slow_get
+        public_keys = []
+        threads = [
+            threading.Thread(
+                target=lambda: public_keys.append(self.cache.get_public_key("1"))
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.get.call_count, 1)
+        self.assertEqual(len(public_keys), 8)
+        self.assertTrue(all(public_key is not None for public_key in public_keys))
+
+    def test_unknown_key_id_refreshes_the_keys_once(self):
+        self.assertIsNotNone(self.cache.get_public_key("1"))
+        self.clock.now += 60
+        self.assertIsNone(self.cache.get_public_key("2"))
+        self.assertIsNone(self.cache.get_public_key("2"))
+        self.assertEqual(self.get.call_count, 2)
+
+        # A rotated key is found by the refresh
+        rotated_jwk = make_public_jwk(jwk.JWK.generate(kty="RSA", size=2048), "3")
+        self.get.return_value = FakeJWKSResponse([self.public_jwk, rotated_jwk])
+        self.clock.now += 60
+        self.assertIsNotNone(self.cache.get_public_key("3"))
+        self.assertEqual(self.get.call_count, 3)
+
+    def test_stale_keys_are_used_while_they_are_revalidated(self):
+        self.cache.get_public_key("1")
+        self.clock.now += 600
+        with mock.patch.object(jwks_cache.threading, "Thread") as thread:
+            self.assertIsNotNone(self.cache.get_public_key("1"))
+        self.assertEqual(self.get.call_count, 1)
+        thread.assert_called_once_with(target=self.cache._revalidate, daemon=True)
+
+        # Past the stale window the keys are downloaded before they are used
+        self.clock.now += 3600
+        self.get.side_effect = requests.exceptions.ConnectionError
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.cache.get_public_key("1")
+
+
+class RequiresScopesJWKSCacheTests(TestCase):
+    def setUp(self):
+        self.api_url = reverse("ping_auth")
+        self.private_key = jwk.JWK.generate(kty="RSA", size=2048)
+        self.kid = "passport-key"
+        patcher = mock.patch.dict(jwks_cache._jwks_caches, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+            jwks_cache.requests.Session,
+            "get",
+            return_value=FakeJWKSResponse(
+                [make_public_jwk(self.private_key, self.kid)]
+            ),
+        )
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_keys_are_reused_between_requests(self):
+        with mock.patch.dict(
+            os.environ, {"PASSPORT_AUDIENCE": "testflight.flightblender.com"}
+        ):
+            for _ in range(3):
+                response = self.client.get(
+                    self.api_url,
+                    HTTP_AUTHORIZATION="Bearer "
+                    + make_token(self.private_key, self.kid),
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.get(
+                self.api_url,
+                HTTP_AUTHORIZATION="Bearer " + make_token(self.private_key, "other"),
+            )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        # The keys were just downloaded, the unknown key id does not download them again
+        self.assertEqual(self.get.call_count, 1)
@@ -0,0 +1,93 @@
+import os
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from jwcrypto import jwk
+from rest_framework import status
+
+from auth_helper import jwks_cache, token_cache, utils
+from auth_helper.test_jwks_cache import FakeJWKSResponse, make_public_jwk, make_token
+
+AUDIENCE = "testflight.flightblender.com"
+
+
+class VerifiedTokenCacheTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = token_cache.VerifiedTokenCache(
+            max_size=2, max_age_secs=300, clock=lambda: self.now
+        )
+
+    def test_claims_are_kept_until_the_token_expires(self):
+        self.cache.put("token", AUDIENCE, {"exp": 1100, "scope": "a"}, decode_secs=1)
+        self.assertEqual(self.cache.get("token", AUDIENCE), {"exp": 1100, "scope": "a"})
+        self.assertIsNone(self.cache.get("token", "another audience"))
+
+        self.cache.put("token", AUDIENCE, {"exp": 1100, "scope": "a"}, decode_secs=1)
+        self.now = 1100
+        self.assertIsNone(self.cache.get("token", AUDIENCE))
+
+        stats = self.cache.get_stats()
+        self.assertEqual((stats.hits, stats.misses, stats.size), (1, 2, 0))
+        self.assertEqual(stats.decode_secs_saved, 1)
+
+    def test_claims_are_kept_at_most_the_configured_time(self):
+        self.cache.put("token", AUDIENCE, {"exp": 5000})
+        self.now = 1299
+        self.assertIsNotNone(self.cache.get("token", AUDIENCE))
+        self.now = 1300
+        self.assertIsNone(self.cache.get("token", AUDIENCE))
+
+    def test_least_recently_used_token_is_evicted(self):
+        for token in ["a", "b"]:
+            self.cache.put(token, AUDIENCE, {"exp": 5000})
+        self.cache.get("a", AUDIENCE)
+        self.cache.put("c", AUDIENCE, {"exp": 5000})
+        self.assertIsNotNone(self.cache.get("a", AUDIENCE))
+        self.assertIsNone(self.cache.get("b", AUDIENCE))
+
+
+class RequiresScopesTokenCacheTests(TestCase):
+    def setUp(self):
+        self.api_url = reverse("ping_auth")
+        self.private_key = jwk.JWK.generate(kty="RSA", size=2048)
+        self.verified_token_cache = token_cache.VerifiedTokenCache(
+            max_size=16, max_age_secs=300
+        )
+        for patcher in [
+            mock.patch.object(utils, "verified_token_cache", self.verified_token_cache),
+            mock.patch.dict(jwks_cache._jwks_caches, clear=True),
+            mock.patch.object(
+                jwks_cache.requests.Session,
+                "get",
+                return_value=FakeJWKSResponse(
+                    [make_public_jwk(self.private_key, "passport-key")]
+                ),
+            ),
+            mock.patch.dict(os.environ, {"PASSPORT_AUDIENCE": AUDIENCE}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reused_token_is_verified_once(self):
+        token = make_token(self.private_key, "passport-key")
+        with mock.patch.object(utils.jwt, "decode", wraps=utils.jwt.decode) as decode:
+            for _ in range(5):
+                response = self.client.get(
+                    self.api_url, HTTP_AUTHORIZATION="Bearer " + token
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(decode.call_count, 1)
+
+        stats = self.verified_token_cache.get_stats()
+        self.assertEqual((stats.hits, stats.misses), (4, 1))
+        self.assertEqual(stats.hit_rate, 0.8)
+
+    def test_scopes_are_checked_against_the_cached_claims(self):
+        token = make_token(self.private_key, "passport-key")
+        self.verified_token_cache.put(
+            token, AUDIENCE, {"scope": "blender.write", "exp": 2**32}
+        )
+        response = self.client.get(self.api_url, HTTP_AUTHORIZATION="Bearer " + token)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,113 @@
+"""
+A per-process LRU cache of the claims of verified access tokens, keyed by the SHA-256 digest of the token so that the tokens themselves are not kept.
+
+Clients reuse a bearer token for many requests, a cached token is not verified again until the earlier of its expiry and VERIFIED_TOKEN_CACHE_MAX_SECS after it was verified. VERIFIED_TOKEN_CACHE_SIZE tokens are kept, 0 disables the cache.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from os import environ as env
+from typing import Callable, Optional
+
+from dotenv import find_dotenv, load_dotenv
+
+from .data_definitions import VerifiedTokenCacheStats
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+VERIFIED_TOKEN_CACHE_SIZE = 1024
+VERIFIED_TOKEN_CACHE_MAX_SECS = 300
+# The statistics are logged every this many lookups
+VERIFIED_TOKEN_CACHE_STATS_INTERVAL = 10000
+
+
+class VerifiedTokenCache:
+    """The claims of verified tokens by token digest and audience, least recently used tokens are evicted first"""
+
+    def __init__(
+        self,
+        max_size: Optional[int] = None,
+        max_age_secs: Optional[int] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_size = (
+            max_size
+            if max_size is not None
+            else int(env.get("VERIFIED_TOKEN_CACHE_SIZE", VERIFIED_TOKEN_CACHE_SIZE))
+        )
+        self.max_age_secs = (
+            max_age_secs
+            if max_age_secs is not None
+            else int(
+                env.get("VERIFIED_TOKEN_CACHE_MAX_SECS", VERIFIED_TOKEN_CACHE_MAX_SECS)
+            )
+        )
+        self.clock = clock
+        # digest: (audience, claims, valid until, seconds the verification took)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._decode_secs_saved = 0.0
+
+    @staticmethod
+    def _get_digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str, audience: str) -> Optional[dict]:
+        """The claims of the token if it was verified for the audience and is still valid"""
+        if self.max_size <= 0:
+            return None
+        digest = self._get_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and (entry[0] != audience or entry[2] <= self.clock()):
+                del self._entries[digest]
+                entry = None
+            if entry is None:
+                self._misses += 1
+            else:
+                self._entries.move_to_end(digest)
+                self._hits += 1
+                self._decode_secs_saved += entry[3]
+            lookups = self._hits + self._misses
+        if lookups % VERIFIED_TOKEN_CACHE_STATS_INTERVAL == 0:
+            logger.info("Verified token cache: %s" % self.get_stats())
+        return entry[1] if entry else None
+
+    def put(self, token: str, audience: str, claims: dict, decode_secs: float = 0.0):
+        """Keep the claims of a verified token until its expiry, at most max_age_secs"""
+        if self.max_size <= 0 or self.max_age_secs <= 0:
+            return
+        valid_until = self.clock() + self.max_age_secs
+        if "exp" in claims:
+            valid_until = min(valid_until, float(claims["exp"]))
+        digest = self._get_digest(token)
+        with self._lock:
+            self._entries[digest] = (audience, claims, valid_until, decode_secs)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> VerifiedTokenCacheStats:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return VerifiedTokenCacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                size=len(self._entries),
+                hit_rate=self._hits / lookups if lookups else 0.0,
+                decode_secs_saved=self._decode_secs_saved,
+            )
+
+
+verified_token_cache = VerifiedTokenCache()
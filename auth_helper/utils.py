@@ -1,4 +1,4 @@
-import json
+import time
 from functools import wraps
 from os import environ as env
 
@@ -9,6 +9,9 @@ from django.http import JsonResponse
 from dotenv import find_dotenv, load_dotenv
 from rest_framework import status
 
+from .jwks_cache import get_jwks_cache
+from .token_cache import verified_token_cache
+
 load_dotenv(find_dotenv())
 
 
@@ -24,8 +27,6 @@ def requires_scopes(required_scopes):
         required_scopes (list): The scopes required to access the resource
     """
 
-    s = requests.Session()
-
     def require_scope(f):
         @wraps(f)
         def decorated(*args, **kwargs):
@@ -83,79 +84,72 @@ def requires_scopes(required_scopes):
                         status=status.HTTP_401_UNAUTHORIZED,
                     )
 
-            try:
-                jwks = s.get(PASSPORT_URL).json()
-            except requests.exceptions.RequestException:
-                return JsonResponse(
-                    {
-                        "detail": "Public Key Server to validate the token could not be reached"
-                    },
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-
-            public_keys = {}
-            for jwk in jwks["keys"]:
-                kid = jwk["kid"]
-                public_keys[kid] = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
-            try:
+            # The scopes of a token that was verified recently are checked against its cached claims
+            decoded = verified_token_cache.get(token, audience=API_IDENTIFIER)
+            if decoded is None:
                 kid = unverified_token_headers["kid"]
-            except (KeyError, ValueError):
-                return JsonResponse(
-                    {
-                        "detail": "Invalid public key details in token / token cannot be verified"
-                    },
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-            else:
                 try:
-                    assert kid in public_keys
-                except AssertionError:
+                    public_key = get_jwks_cache(PASSPORT_URL).get_public_key(kid)
+                except requests.exceptions.RequestException:
+                    return JsonResponse(
+                        {
+                            "detail": "Public Key Server to validate the token could not be reached"
+                        },
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+
+                if public_key is None:
                     return JsonResponse(
                         {
                             "detail": "Invalid public key details in token / token cannot be verified"
                         },
                         status=status.HTTP_401_UNAUTHORIZED,
                     )
-                else:
-                    public_key = public_keys[kid]
 
-            try:
-                decoded = jwt.decode(
-                    token, public_key, audience=API_IDENTIFIER, algorithms=["RS256"]
-                )
-            except jwt.ImmatureSignatureError:
-                return JsonResponse(
-                    {"detail": "Token Signature has is not valid"},
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-            except jwt.ExpiredSignatureError:
-                return JsonResponse(
-                    {"detail": "Token Signature has expired"},
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-            except jwt.InvalidAudienceError:
-                return JsonResponse(
-                    {"detail": "Invalid audience in token"},
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-            except jwt.InvalidIssuerError:
-                return JsonResponse(
-                    {"detail": "Invalid issuer for token"},
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-            except jwt.InvalidSignatureError:
-                return JsonResponse(
-                    {"detail": "Invalid signature in token"},
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-            except jwt.DecodeError:
-                return JsonResponse(
-                    {"detail": "Token cannot be decoded"},
-                    status=status.HTTP_401_UNAUTHORIZED,
-                )
-            except Exception:
-                return JsonResponse(
-                    {"detail": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
+                try:
+                    decode_started = time.perf_counter()
+                    decoded = jwt.decode(
+                        token, public_key, audience=API_IDENTIFIER, algorithms=["RS256"]
+                    )
+                except jwt.ImmatureSignatureError:
+                    return JsonResponse(
+                        {"detail": "Token Signature has is not valid"},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+                except jwt.ExpiredSignatureError:
+                    return JsonResponse(
+                        {"detail": "Token Signature has expired"},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+                except jwt.InvalidAudienceError:
+                    return JsonResponse(
+                        {"detail": "Invalid audience in token"},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+                except jwt.InvalidIssuerError:
+                    return JsonResponse(
+                        {"detail": "Invalid issuer for token"},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+                except jwt.InvalidSignatureError:
+                    return JsonResponse(
+                        {"detail": "Invalid signature in token"},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+                except jwt.DecodeError:
+                    return JsonResponse(
+                        {"detail": "Token cannot be decoded"},
+                        status=status.HTTP_401_UNAUTHORIZED,
+                    )
+                except Exception:
+                    return JsonResponse(
+                        {"detail": "Invalid token"}, status=status.HTTP_401_UNAUTHORIZED
+                    )
+                verified_token_cache.put(
+                    token,
+                    audience=API_IDENTIFIER,
+                    claims=decoded,
+                    decode_secs=time.perf_counter() - decode_started,
                 )
 
             if decoded.get("scope"):
@@ -1,4 +1,6 @@
+from dataclasses import dataclass
 from enum import Enum
+from typing import List
 
 from django.utils.translation import gettext_lazy as _
 
@@ -49,3 +51,26 @@ OPERATOR_EVENT_LOOKUP = {
     2: OperationEvent.OPERATOR_ACTIVATES,
     4: OperationEvent.OPERATOR_INITIATES_CONTINGENT,
 }
+
+
+@dataclass
+class HTTPEndpointStats:
+    """The requests to an endpoint (resource ids in the path are replaced by {id}) and the histogram of their latency, bucket_counts has one more bucket than bucket_bounds_ms for the slower requests"""
+
+    method: str
+    host: str
+    path: str
+    count: int
+    error_count: int
+    total_ms: float
+    bucket_bounds_ms: List[float]
+    bucket_counts: List[int]
+
+
+@dataclass
+class CircuitBreakerState:
+    """The circuit of a host: closed, open (requests are not sent) or half_open (a trial request is sent)"""
+
+    host: str
+    state: str
+    consecutive_failures: int
@@ -2,8 +2,8 @@ from flight_declaration_operations.models import (
     FlightDeclaration,
 )
 from conformance_monitoring_operations.models import TaskScheduler
-from typing import Tuple, List
-from uuid import uuid4
+from typing import Dict, Optional, Tuple, List
+from uuid import UUID, uuid4
 import arrow
 from django.db.utils import IntegrityError
 # from scd_operations.data_definitions import FlightDeclarationCreationPayload
@@ -13,6 +13,9 @@ from dataclasses import asdict
 import logging
 from scd_operations.data_definitions import PartialCreateOperationalIntentReference
 from dotenv import load_dotenv, find_dotenv
+from redis.exceptions import LockError, ResponseError
+from auth_helper.common import get_redis
+from flight_blender.celery import app
 
 logger = logging.getLogger("django")
 
@@ -23,6 +26,27 @@ ENV_FILE = find_dotenv()
 if ENV_FILE:
     load_dotenv(ENV_FILE)
 
+# The time of the latest telemetry of an operation is written to Redis on every telemetry submission and to the database in bulk (write-behind) at most every TELEMETRY_TIMESTAMP_FLUSH_INTERVAL_SECS
+LATEST_TELEMETRY_DATETIME_KEY = "latest_telemetry_datetime:{flight_declaration_id}"
+LATEST_TELEMETRY_DATETIME_TTL_SECS = 3600
+PENDING_TELEMETRY_DATETIMES_KEY = "pending_telemetry_datetimes"
+# The pending telemetry timestamps that a flush has claimed, deleted only after they are written to the database
+FLUSHING_TELEMETRY_DATETIMES_KEY = "flushing_telemetry_datetimes"
+# Only one flush runs at a time, so that a flush does not delete the timestamps that another one has claimed
+TELEMETRY_TIMESTAMP_FLUSH_LOCK_KEY = "telemetry_timestamp_flush_lock"
+TELEMETRY_TIMESTAMP_FLUSH_LOCK_SECS = 300
+TELEMETRY_TIMESTAMP_FLUSH_SCHEDULED_KEY = "telemetry_timestamp_flush_scheduled"
+TELEMETRY_TIMESTAMP_FLUSH_INTERVAL_SECS = 10
+
+
+def get_telemetry_timestamp_flush_interval() -> int:
+    return int(
+        os.getenv(
+            "TELEMETRY_TIMESTAMP_FLUSH_INTERVAL_SECS",
+            default=TELEMETRY_TIMESTAMP_FLUSH_INTERVAL_SECS,
+        )
+    )
+
 
 class BlenderDatabaseReader:
     """
@@ -69,6 +93,25 @@ class BlenderDatabaseReader:
         except TaskScheduler.DoesNotExist:
             return None
 
+    def get_latest_telemetry_datetime(
+        self, flight_declaration: FlightDeclaration
+    ) -> Optional[arrow.Arrow]:
+        """The time of the latest telemetry of an operation, from Redis if it has not been written to the database yet"""
+        r = get_redis()
+        recorded_datetime = r.get(
+            LATEST_TELEMETRY_DATETIME_KEY.format(
+                flight_declaration_id=flight_declaration.id
+            )
+        )
+        latest_telemetry_datetimes = []
+        if recorded_datetime:
+            latest_telemetry_datetimes.append(arrow.get(recorded_datetime))
+        if flight_declaration.latest_telemetry_datetime:
+            latest_telemetry_datetimes.append(
+                arrow.get(flight_declaration.latest_telemetry_datetime)
+            )
+        return max(latest_telemetry_datetimes) if latest_telemetry_datetimes else None
+
 
 class BlenderDatabaseWriter:
     def delete_flight_declaration(self, flight_declaration_id: str) -> bool:
@@ -100,15 +143,93 @@ class BlenderDatabaseWriter:
             return False
 
 
-    def update_telemetry_timestamp(self, flight_declaration_id: str) -> bool:
+    def update_telemetry_timestamp(self, flight_declaration_id: str) -> None:
+        """Record the time of the latest telemetry of an operation in Redis, it is written to the database by the flush_telemetry_timestamps task that is scheduled by the first update after a flush. Nothing is returned, a Redis error is raised"""
         now = arrow.now().isoformat()
+        flush_interval = get_telemetry_timestamp_flush_interval()
+        r = get_redis()
+        pipe = r.pipeline(transaction=False)
+        pipe.set(
+            LATEST_TELEMETRY_DATETIME_KEY.format(
+                flight_declaration_id=flight_declaration_id
+            ),
+            now,
+            ex=LATEST_TELEMETRY_DATETIME_TTL_SECS,
+        )
+        pipe.hset(PENDING_TELEMETRY_DATETIMES_KEY, flight_declaration_id, now)
+        pipe.set(
+            TELEMETRY_TIMESTAMP_FLUSH_SCHEDULED_KEY, now, nx=True, ex=flush_interval
+        )
+        flush_not_scheduled = pipe.execute()[2]
+        if flush_not_scheduled:
+            app.send_task("flush_telemetry_timestamps", countdown=flush_interval)
+
+    def flush_telemetry_timestamps(self) -> int:
+        """Write the telemetry timestamps recorded since the last flush to the database in a single update, returns the number of operations updated.
+        The pending timestamps are claimed by renaming them to the flushing key, which is deleted only after the database update. The timestamps of a flush that failed are written by the next flush, before the ones recorded since. Another flush is scheduled if this one fails or the lock is held by a running flush, so no timestamps are left behind if no more telemetry is received"""
+        r = get_redis()
+        flush_lock = r.lock(
+            TELEMETRY_TIMESTAMP_FLUSH_LOCK_KEY, timeout=TELEMETRY_TIMESTAMP_FLUSH_LOCK_SECS
+        )
+        if not flush_lock.acquire(blocking=False):
+            logger.info("Telemetry timestamps are already being flushed, another flush is scheduled")
+            self._schedule_telemetry_timestamp_flush()
+            return 0
+        updated_count = 0
         try:
-            flight_declaration = FlightDeclaration.objects.get(id=flight_declaration_id)
-            flight_declaration.latest_telemetry_datetime = now
-            flight_declaration.save()
-            return True
-        except FlightDeclaration.DoesNotExist:
-            return False
+            while True:
+                try:
+                    # False if a failed flush left its timestamps behind, they are written first
+                    claimed = r.renamenx(
+                        PENDING_TELEMETRY_DATETIMES_KEY, FLUSHING_TELEMETRY_DATETIMES_KEY
+                    )
+                except ResponseError:
+                    # Nothing was recorded since the last flush
+                    claimed = True
+                recorded_datetimes = r.hgetall(FLUSHING_TELEMETRY_DATETIMES_KEY)
+                if recorded_datetimes:
+                    try:
+                        updated_count += self._write_telemetry_datetimes(recorded_datetimes)
+                    except Exception:
+                        logger.error("Telemetry timestamps could not be written, another flush is scheduled")
+                        self._schedule_telemetry_timestamp_flush()
+                        raise
+                    r.delete(FLUSHING_TELEMETRY_DATETIMES_KEY)
+                if claimed:
+                    return updated_count
+        finally:
+            try:
+                flush_lock.release()
+            except LockError:
+                # The lock expired during a long flush
+                pass
+
+    def _schedule_telemetry_timestamp_flush(self) -> None:
+        app.send_task("flush_telemetry_timestamps", countdown=get_telemetry_timestamp_flush_interval())
+
+    def _write_telemetry_datetimes(self, recorded_datetimes: Dict[str, str]) -> int:
+        pending_telemetry_datetimes: Dict[str, str] = {}
+        for recorded_id, recorded_datetime in recorded_datetimes.items():
+            try:
+                # Telemetry can be submitted for ids that are not flight declarations
+                flight_declaration_id = str(UUID(recorded_id))
+            except ValueError:
+                continue
+            pending_telemetry_datetimes[flight_declaration_id] = recorded_datetime
+
+        flight_declarations = list(
+            FlightDeclaration.objects.filter(
+                id__in=pending_telemetry_datetimes.keys()
+            ).only("id", "latest_telemetry_datetime")
+        )
+        for flight_declaration in flight_declarations:
+            flight_declaration.latest_telemetry_datetime = arrow.get(
+                pending_telemetry_datetimes[str(flight_declaration.id)]
+            ).datetime
+        FlightDeclaration.objects.bulk_update(
+            flight_declarations, ["latest_telemetry_datetime"]
+        )
+        return len(flight_declarations)
 
     def update_flight_operation_operational_intent(
         self,
@@ -0,0 +1,318 @@
+"""
+The HTTP client for calls to the DSS, to peer USSs and to the DSS auth server.
+
+There is one requests session per process, so connections are pooled and kept alive per host. Every request has connect and read timeouts. Failed idempotent requests (GET, HEAD and OPTIONS, or any request sent with retry=True) are retried a bounded number of times with jittered exponential backoff. A host that keeps failing is short-circuited by a circuit breaker for DSS_HTTP_CIRCUIT_RESET_SECS, and the latency of every endpoint is recorded in a histogram.
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+from os import environ as env
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import find_dotenv, load_dotenv
+from requests.adapters import HTTPAdapter
+
+from .data_definitions import CircuitBreakerState, HTTPEndpointStats
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+DSS_HTTP_CONNECT_TIMEOUT_SECS = 3.05
+DSS_HTTP_READ_TIMEOUT_SECS = 10
+DSS_HTTP_MAX_RETRIES = 2
+DSS_HTTP_POOL_MAXSIZE = 10
+# The hosts that connections are kept for, the DSS, the auth server and the peer USSs
+HTTP_POOL_HOSTS = 50
+DSS_HTTP_CIRCUIT_FAILURE_THRESHOLD = 5
+DSS_HTTP_CIRCUIT_RESET_SECS = 30
+RETRY_BACKOFF_BASE_SECS = 0.2
+RETRY_BACKOFF_MAX_SECS = 2
+# The methods retried by default, other requests are retried only when the caller passes retry=True
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUS_CODES = {502, 503, 504}
+# The upper bounds of the latency histogram buckets in milliseconds, the last bucket has no bound
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Path segments that identify a resource (UUIDs, numbers, long tokens) are replaced so that an endpoint has one histogram
+ID_PATH_SEGMENT = re.compile(
+    r"^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+|[0-9a-fA-F]{16,})$"
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures of a host, after reset_secs one trial request is let through and closes it again if it succeeds"""
+
+    def __init__(self, failure_threshold: int, reset_secs: float):
+        self.failure_threshold = failure_threshold
+        self.reset_secs = reset_secs
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_secs:
+                return False
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def get_state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.reset_secs:
+                return "open"
+            return "half_open"
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.error_count = 0
+        self.total_ms = 0.0
+
+    def record(self, latency_ms: float, is_error: bool):
+        index = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS_MS) if latency_ms <= bound),
+            len(LATENCY_BUCKETS_MS),
+        )
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total_ms += latency_ms
+        if is_error:
+            self.error_count += 1
+
+
+def get_endpoint(url: str) -> Tuple[str, str]:
+    """The host and the path of a URL, with the resource ids of the path replaced by {id}"""
+    parts = urlsplit(url)
+    path = "/".join(
+        "{id}" if ID_PATH_SEGMENT.match(segment) else segment
+        for segment in parts.path.split("/")
+    )
+    return parts.netloc, path
+
+
+class InstrumentedHTTPClient:
+    """Sends requests with the pooled session of the process, with timeouts, retries and a circuit breaker per host"""
+
+    def __init__(
+        self,
+        connect_timeout_secs: Optional[float] = None,
+        read_timeout_secs: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        pool_maxsize: Optional[int] = None,
+        circuit_failure_threshold: Optional[int] = None,
+        circuit_reset_secs: Optional[float] = None,
+    ):
+        if connect_timeout_secs is None:
+            connect_timeout_secs = float(
+                env.get("DSS_HTTP_CONNECT_TIMEOUT_SECS", DSS_HTTP_CONNECT_TIMEOUT_SECS)
+            )
+        if read_timeout_secs is None:
+            read_timeout_secs = float(
+                env.get("DSS_HTTP_READ_TIMEOUT_SECS", DSS_HTTP_READ_TIMEOUT_SECS)
+            )
+        self.timeout = (connect_timeout_secs, read_timeout_secs)
+        self.max_retries = (
+            max_retries
+            if max_retries is not None
+            else int(env.get("DSS_HTTP_MAX_RETRIES", DSS_HTTP_MAX_RETRIES))
+        )
+        self.pool_maxsize = (
+            pool_maxsize
+            if pool_maxsize is not None
+            else int(env.get("DSS_HTTP_POOL_MAXSIZE", DSS_HTTP_POOL_MAXSIZE))
+        )
+        self.circuit_failure_threshold = (
+            circuit_failure_threshold
+            if circuit_failure_threshold is not None
+            else int(
+                env.get(
+                    "DSS_HTTP_CIRCUIT_FAILURE_THRESHOLD",
+                    DSS_HTTP_CIRCUIT_FAILURE_THRESHOLD,
+                )
+            )
+        )
+        self.circuit_reset_secs = (
+            circuit_reset_secs
+            if circuit_reset_secs is not None
+            else float(
+                env.get("DSS_HTTP_CIRCUIT_RESET_SECS", DSS_HTTP_CIRCUIT_RESET_SECS)
+            )
+        )
+        self._session: Optional[requests.Session] = None
+        self._pid: Optional[int] = None
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self._histograms: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def get_session(self) -> requests.Session:
+        # A forked process does not reuse the connections of its parent
+        if self._session is None or self._pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_HOSTS, pool_maxsize=self.pool_maxsize
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+            self._pid = os.getpid()
+        return self._session
+
+    def _get_circuit_breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self._circuit_breakers:
+                self._circuit_breakers[host] = CircuitBreaker(
+                    failure_threshold=self.circuit_failure_threshold,
+                    reset_secs=self.circuit_reset_secs,
+                )
+            return self._circuit_breakers[host]
+
+    def _record_latency(
+        self, method: str, host: str, path: str, latency_ms: float, is_error: bool
+    ):
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                (method, host, path), LatencyHistogram()
+            )
+            histogram.record(latency_ms, is_error=is_error)
+
+    def _should_retry(self, retry: bool, attempt: int, error, response) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            # The request was not sent, it can be retried whatever the method
+            return True
+        if not retry:
+            return False
+        if error is not None:
+            return isinstance(
+                error,
+                (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+            )
+        return response.status_code in RETRY_STATUS_CODES
+
+    def request(
+        self, method: str, url: str, retry: Optional[bool] = None, **kwargs
+    ) -> requests.Response:
+        """Send a request, pass retry=True only if the request is idempotent on the server and can safely be sent twice"""
+        method = method.upper()
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        host, path = get_endpoint(url)
+        circuit_breaker = self._get_circuit_breaker(host)
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            if not circuit_breaker.allow_request():
+                raise CircuitOpenError(
+                    "The circuit of %s is open after repeated failures" % host
+                )
+            error = None
+            response = None
+            start = time.perf_counter()
+            try:
+                response = self.get_session().request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+            is_failure = error is not None or response.status_code >= 500
+            self._record_latency(
+                method,
+                host,
+                path,
+                (time.perf_counter() - start) * 1000,
+                is_error=is_failure,
+            )
+            if is_failure:
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+
+            if not self._should_retry(retry, attempt, error, response):
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            # Full jitter, so that the workers do not retry at the same time
+            backoff_secs = random.uniform(
+                0, min(RETRY_BACKOFF_MAX_SECS, RETRY_BACKOFF_BASE_SECS * 2**attempt)
+            )
+            logger.info(
+                "Retrying %s %s in %.2f seconds: %s"
+                % (method, url, backoff_secs, error or response.status_code)
+            )
+            time.sleep(backoff_secs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", url, **kwargs)
+
+    def get_endpoint_stats(self) -> List[HTTPEndpointStats]:
+        with self._lock:
+            return [
+                HTTPEndpointStats(
+                    method=method,
+                    host=host,
+                    path=path,
+                    count=histogram.count,
+                    error_count=histogram.error_count,
+                    total_ms=histogram.total_ms,
+                    bucket_bounds_ms=LATENCY_BUCKETS_MS,
+                    bucket_counts=list(histogram.bucket_counts),
+                )
+                for (method, host, path), histogram in self._histograms.items()
+            ]
+
+    def get_circuit_states(self) -> List[CircuitBreakerState]:
+        with self._lock:
+            circuit_breakers = list(self._circuit_breakers.items())
+        return [
+            CircuitBreakerState(
+                host=host,
+                state=circuit_breaker.get_state(),
+                consecutive_failures=circuit_breaker.failures,
+            )
+            for host, circuit_breaker in circuit_breakers
+        ]
+
+
+http_client = InstrumentedHTTPClient()
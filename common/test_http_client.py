@@ -0,0 +1,168 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.test import TestCase
+from django.urls import reverse
+from jwcrypto import jwk
+from rest_framework import status
+
+from auth_helper import jwks_cache
+from auth_helper.test_jwks_cache import FakeJWKSResponse, make_public_jwk, make_token
+from common import http_client
+from flight_feed_operations import views as flight_feed_views
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self):
+        server = self.server
+        server.client_ports.add(self.client_address[1])
+        status = server.statuses.pop(0) if server.statuses else 200
+        body = b"{}"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+    do_PUT = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InstrumentedHTTPClientTests(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+        self.server.statuses = []
+        self.server.client_ports = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = "http://127.0.0.1:%s" % self.server.server_address[1]
+        self.client = http_client.InstrumentedHTTPClient(
+            connect_timeout_secs=1,
+            read_timeout_secs=1,
+            max_retries=2,
+            circuit_failure_threshold=3,
+            circuit_reset_secs=60,
+        )
+        # The retries are not delayed in the tests
+        patcher = mock.patch.object(http_client.time, "sleep")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connection_is_kept_alive(self):
+        for _ in range(5):
+            self.assertEqual(
+                self.client.get(self.base_url + "/v1/flights").status_code, 200
+            )
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_unavailable_server_is_retried(self):
+        self.server.statuses = [503, 503]
+        response = self.client.get(
+            self.base_url
+            + "/v1/dss/identification_service_areas/d50598bc-638a-4f52-bf3f-dd85595fb52e"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        [stats] = self.client.get_endpoint_stats()
+        self.assertEqual(stats.path, "/v1/dss/identification_service_areas/{id}")
+        self.assertEqual((stats.count, stats.error_count), (3, 2))
+        self.assertEqual(sum(stats.bucket_counts), 3)
+
+    def test_post_is_not_retried(self):
+        self.server.statuses = [503]
+        response = self.client.post(self.base_url + "/uss/v1/operational_intents")
+        self.assertEqual(response.status_code, 503)
+
+    def test_put_is_not_retried_by_default(self):
+        self.server.statuses = [503]
+        response = self.client.put(
+            self.base_url
+            + "/dss/v1/operational_intent_references/d50598bc-638a-4f52-bf3f-dd85595fb52e"
+        )
+        self.assertEqual(response.status_code, 503)
+
+    def test_post_is_retried_when_the_caller_opts_in(self):
+        self.server.statuses = [503]
+        response = self.client.post(
+            self.base_url + "/dss/v1/operational_intent_references/query", retry=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get_endpoint_stats()[0].count, 2)
+
+    def test_failing_host_is_short_circuited(self):
+        self.server.statuses = [500] * 3
+        for _ in range(3):
+            self.assertEqual(
+                self.client.get(self.base_url + "/v1/flights").status_code, 500
+            )
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.get(self.base_url + "/v1/flights")
+        [state] = self.client.get_circuit_states()
+        self.assertEqual(state.state, "open")
+        self.assertEqual(self.client.get_endpoint_stats()[0].count, 3)
+
+        # After the reset time a trial request closes the circuit again
+        circuit_breaker = self.client._get_circuit_breaker(state.host)
+        circuit_breaker.opened_at -= 60
+        self.assertEqual(
+            self.client.get(self.base_url + "/v1/flights").status_code, 200
+        )
+        self.assertEqual(self.client.get_circuit_states()[0].state, "closed")
+
+
+class DSSHTTPStatsViewTests(TestCase):
+    def setUp(self):
+        self.private_key = jwk.JWK.generate(kty="RSA", size=2048)
+        self.http_client = http_client.InstrumentedHTTPClient()
+        for patcher in [
+            mock.patch.dict(jwks_cache._jwks_caches, clear=True),
+            mock.patch.object(
+                jwks_cache.requests.Session,
+                "get",
+                return_value=FakeJWKSResponse(
+                    [make_public_jwk(self.private_key, "passport-key")]
+                ),
+            ),
+            mock.patch.dict(
+                os.environ, {"PASSPORT_AUDIENCE": "testflight.flightblender.com"}
+            ),
+            mock.patch.object(flight_feed_views, "http_client", self.http_client),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_endpoint_stats_and_circuits_are_returned(self):
+        self.http_client._record_latency(
+            "GET", "dss.example.com", "/rid/v2/dss/subscriptions/{id}", 42, False
+        )
+        self.http_client._get_circuit_breaker("dss.example.com")
+
+        response = self.client.get(
+            reverse("dss_http_stats"),
+            HTTP_AUTHORIZATION="Bearer " + make_token(self.private_key, "passport-key"),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_json = response.json()
+        self.assertEqual(response_json["pid"], os.getpid())
+        [endpoint] = response_json["endpoints"]
+        self.assertEqual(endpoint["path"], "/rid/v2/dss/subscriptions/{id}")
+        self.assertEqual(endpoint["count"], 1)
+        [circuit] = response_json["circuits"]
+        self.assertEqual(
+            (circuit["host"], circuit["state"]), ("dss.example.com", "closed")
+        )
+
+    def test_token_is_required(self):
+        response = self.client.get(reverse("dss_http_stats"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
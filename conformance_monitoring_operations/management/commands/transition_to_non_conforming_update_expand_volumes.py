@@ -161,10 +161,8 @@ class Command(BaseCommand):
                 )
 
                 ## Update / expand volume
-                stream_ops = flight_stream_helper.StreamHelperOps()
-                push_cg = stream_ops.push_cg()
                 obs_helper = flight_stream_helper.ObservationReadOperations()
-                all_flights_rid_data = obs_helper.get_observations(push_cg)
+                all_flights_rid_data = obs_helper.get_observations_snapshot()
                 # Get the last observation of the flight telemetry
                 unique_flights = []
                 # Keep only the latest message
@@ -64,46 +64,38 @@ def _check_operation_telemetry_conformance(
     # This method checks the conformance status for ongoing operations and sends notifications / via the notificaitons channel
     dry_run = True if dry_run == "1" else False
     conformance_ops = BlenderConformanceEngine()
-    # Get Telemetry
-    stream_ops = flight_stream_helper.StreamHelperOps()
-    read_cg = stream_ops.get_read_cg()
+    # Get the latest telemetry of every aircraft
     obs_helper = flight_stream_helper.ObservationReadOperations()
-    all_flights_rid_data = obs_helper.get_observations(read_cg)
-    # Get the latest telemetry
-    if all_flights_rid_data:
-        all_flights_rid_data.sort(key=lambda item: item["timestamp"], reverse=True)
-        distinct_messages = {
-            i["address"]: i for i in reversed(all_flights_rid_data)
-        }.values()
+    distinct_messages = obs_helper.get_latest_observations()
+    for message in distinct_messages:
+        metadata = message["metadata"]
+        flight_details = metadata.get("flight_details", {})
+        if flight_details.get("id") == flight_declaration_id:
+            lat_dd = message["msg_data"]["lat_dd"]
+            lon_dd = message["msg_data"]["lon_dd"]
+            altitude_m_wgs84 = message["msg_data"]["altitude_mm"]
+            aircraft_id = message["address"]
 
-        for message in list(distinct_messages):
-            metadata = message["metadata"]
-            if metadata["flight_details"]["id"] == flight_declaration_id:
-                lat_dd = message["msg_data"]["lat_dd"]
-                lon_dd = message["msg_data"]["lon_dd"]
-                altitude_m_wgs84 = message["msg_data"]["altitude_mm"]
-                aircraft_id = message["address"]
-
-                conformant_via_telemetry = (
-                    conformance_ops.is_operation_conformant_via_telemetry(
-                        flight_declaration_id=flight_declaration_id,
-                        aircraft_id=aircraft_id,
-                        telemetry_location=LatLngPoint(lat=lat_dd, lng=lon_dd),
-                        altitude_m_wgs_84=float(altitude_m_wgs84),
-                    )
+            conformant_via_telemetry = (
+                conformance_ops.is_operation_conformant_via_telemetry(
+                    flight_declaration_id=flight_declaration_id,
+                    aircraft_id=aircraft_id,
+                    telemetry_location=LatLngPoint(lat=lat_dd, lng=lon_dd),
+                    altitude_m_wgs_84=float(altitude_m_wgs84),
+                )
+            )
+            logger.info(
+                "Operation with {flight_operation_id} is not conformant via telemetry failed test {conformant_via_telemetry}...".format(
+                    flight_operation_id=flight_declaration_id,
+                    conformant_via_telemetry=conformant_via_telemetry,
                 )
-                logger.info(
-                    "Operation with {flight_operation_id} is not conformant via telemetry failed test {conformant_via_telemetry}...".format(
-                        flight_operation_id=flight_declaration_id,
-                        conformant_via_telemetry=conformant_via_telemetry,
-                    )
+            )
+            if conformant_via_telemetry:
+                pass
+            else:
+                custom_signals.telemetry_non_conformance_signal.send(
+                    sender="conformant_via_telemetry",
+                    non_conformance_state=conformant_via_telemetry,
+                    flight_declaration_id=flight_declaration_id,
                 )
-                if conformant_via_telemetry:
-                    pass
-                else:
-                    custom_signals.telemetry_non_conformance_signal.send(
-                        sender="conformant_via_telemetry",
-                        non_conformance_state=conformant_via_telemetry,
-                        flight_declaration_id=flight_declaration_id,
-                    )
-                break
+            break
@@ -1,3 +1,5 @@
+from unittest import mock
+
 import arrow
 import pytest
 from django.core import management
@@ -5,6 +7,7 @@ from django.core.exceptions import ValidationError
 from django.core.management.base import CommandError
 from django.test import TestCase
 
+from common import database_operations
 from common.data_definitions import OPERATION_STATES
 from flight_declaration_operations import models as fdo_models
 from scd_operations.data_definitions import LatLngPoint
@@ -262,6 +265,129 @@ class FlightAuthorizationConformantTests(TestCase):
         self.assertEqual(flight_authorization_conformant, True)
 
 
+class TelemetryTimestampWriteBehindTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(database_operations.app, "send_task")
+        self.send_task = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.r = database_operations.get_redis()
+        self.r.delete(
+            database_operations.PENDING_TELEMETRY_DATETIMES_KEY,
+            database_operations.FLUSHING_TELEMETRY_DATETIMES_KEY,
+            database_operations.TELEMETRY_TIMESTAMP_FLUSH_SCHEDULED_KEY,
+        )
+
+    def _delete_latest_telemetry_datetime(self, flight_declaration_id):
+        self.r.delete(
+            database_operations.LATEST_TELEMETRY_DATETIME_KEY.format(
+                flight_declaration_id=flight_declaration_id
+            )
+        )
+
+    @pytest.mark.usefixtures("submit_flight_plan_for_conformance_monitoring_with_auth")
+    def test_telemetry_timestamp_is_read_before_it_is_flushed(self):
+        fd = fdo_models.FlightDeclaration.objects.filter().first()
+        fd.state = OPERATION_STATES[2][0]  # Activate the flight
+        fd.save()
+        self.addCleanup(self._delete_latest_telemetry_datetime, fd.id)
+        database_operations.BlenderDatabaseWriter().update_telemetry_timestamp(
+            flight_declaration_id=str(fd.id)
+        )
+        # Only the first update schedules a flush
+        database_operations.BlenderDatabaseWriter().update_telemetry_timestamp(
+            flight_declaration_id=str(fd.id)
+        )
+        self.send_task.assert_called_once_with(
+            "flush_telemetry_timestamps",
+            countdown=database_operations.TELEMETRY_TIMESTAMP_FLUSH_INTERVAL_SECS,
+        )
+
+        fd.refresh_from_db()
+        self.assertIsNone(fd.latest_telemetry_datetime)
+        conformance_ops = utils.BlenderConformanceEngine()
+        flight_authorization_conformant = (
+            conformance_ops.check_flight_authorization_conformance(
+                flight_declaration_id=fd.id
+            )
+        )
+        self.assertEqual(flight_authorization_conformant, True)
+
+    @pytest.mark.usefixtures("submit_flight_plan_for_conformance_monitoring_with_auth")
+    def test_telemetry_timestamps_are_flushed_in_bulk(self):
+        fd = fdo_models.FlightDeclaration.objects.filter().first()
+        self.addCleanup(self._delete_latest_telemetry_datetime, fd.id)
+        self.addCleanup(self._delete_latest_telemetry_datetime, "not-a-declaration")
+        database_writer = database_operations.BlenderDatabaseWriter()
+        database_writer.update_telemetry_timestamp(flight_declaration_id=str(fd.id))
+        # Telemetry of aircraft without a flight declaration is not written
+        database_writer.update_telemetry_timestamp(
+            flight_declaration_id="not-a-declaration"
+        )
+
+        self.assertEqual(database_writer.flush_telemetry_timestamps(), 1)
+        fd.refresh_from_db()
+        self.assertEqual(
+            arrow.get(fd.latest_telemetry_datetime),
+            database_operations.BlenderDatabaseReader().get_latest_telemetry_datetime(
+                flight_declaration=fd
+            ),
+        )
+        # Nothing is pending after a flush
+        self.assertEqual(database_writer.flush_telemetry_timestamps(), 0)
+
+    @pytest.mark.usefixtures("submit_flight_plan_for_conformance_monitoring_with_auth")
+    def test_telemetry_timestamps_are_kept_when_a_flush_fails(self):
+        fd = fdo_models.FlightDeclaration.objects.filter().first()
+        self.addCleanup(self._delete_latest_telemetry_datetime, fd.id)
+        database_writer = database_operations.BlenderDatabaseWriter()
+        database_writer.update_telemetry_timestamp(flight_declaration_id=str(fd.id))
+
+        with mock.patch.object(
+            fdo_models.FlightDeclaration.objects,
+            "bulk_update",
+            side_effect=database_operations.IntegrityError,
+        ):
+            with self.assertRaises(database_operations.IntegrityError):
+                database_writer.flush_telemetry_timestamps()
+        fd.refresh_from_db()
+        self.assertIsNone(fd.latest_telemetry_datetime)
+        self.send_task.assert_called_with(
+            "flush_telemetry_timestamps",
+            countdown=database_operations.TELEMETRY_TIMESTAMP_FLUSH_INTERVAL_SECS,
+        )
+
+        # The next flush writes the timestamps of the failed flush
+        self.assertEqual(database_writer.flush_telemetry_timestamps(), 1)
+        fd.refresh_from_db()
+        self.assertIsNotNone(fd.latest_telemetry_datetime)
+        self.assertEqual(database_writer.flush_telemetry_timestamps(), 0)
+
+    @pytest.mark.usefixtures("submit_flight_plan_for_conformance_monitoring_with_auth")
+    def test_flush_is_rescheduled_when_the_lock_is_busy(self):
+        fd = fdo_models.FlightDeclaration.objects.filter().first()
+        self.addCleanup(self._delete_latest_telemetry_datetime, fd.id)
+        database_writer = database_operations.BlenderDatabaseWriter()
+        database_writer.update_telemetry_timestamp(flight_declaration_id=str(fd.id))
+        self.send_task.reset_mock()
+
+        flush_lock = self.r.lock(
+            database_operations.TELEMETRY_TIMESTAMP_FLUSH_LOCK_KEY, timeout=60
+        )
+        self.assertTrue(flush_lock.acquire(blocking=False))
+        self.addCleanup(
+            self.r.delete, database_operations.TELEMETRY_TIMESTAMP_FLUSH_LOCK_KEY
+        )
+        self.assertEqual(database_writer.flush_telemetry_timestamps(), 0)
+        self.send_task.assert_called_once_with(
+            "flush_telemetry_timestamps",
+            countdown=database_operations.TELEMETRY_TIMESTAMP_FLUSH_INTERVAL_SECS,
+        )
+        flush_lock.release()
+
+        # The rescheduled flush writes the timestamps
+        self.assertEqual(database_writer.flush_telemetry_timestamps(), 1)
+
+
 class FlightOperationConformantTests(TestCase):
     @pytest.mark.usefixtures("submit_flight_plan_for_conformance_monitoring_with_auth")
     def test_operation_conformance_invalid_aircraft_id(self):
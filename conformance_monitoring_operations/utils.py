@@ -8,6 +8,7 @@ from shapely.geometry import Point
 from shapely.geometry import Polygon as Plgn
 
 from common.data_definitions import OPERATION_STATES
+from common.database_operations import BlenderDatabaseReader
 from conformance_monitoring_operations import db_operations as db_ops
 from conformance_monitoring_operations.data_definitions import PolygonAltitude
 from flight_declaration_operations import models as fdo_models
@@ -168,8 +169,10 @@ class BlenderConformanceEngine:
             # if flight state is accepted, then change it to ended and delete from dss
             return ConformanceChecksList.C11
 
-        # The time the most recent telemetry was sent
-        latest_telemetry_datetime = fd.latest_telemetry_datetime
+        # The time the most recent telemetry was sent, it is written to the database periodically so it is read from Redis
+        latest_telemetry_datetime = (
+            BlenderDatabaseReader().get_latest_telemetry_datetime(flight_declaration=fd)
+        )
         # Check the current time is within the start / end date time +/- 15 seconds TODO: trim this window as it is to broad
         fifteen_seconds_before_now = now.shift(seconds=-15)
         fifteen_seconds_after_now = now.shift(seconds=15)
@@ -8,6 +8,6 @@
 echo "Apply database migrations"
 python manage.py migrate
 
-# Start server
+# Start server, the ASGI application also streams live air traffic
 echo "Starting server"
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+uvicorn flight_blender.asgi:application --host 0.0.0.0 --port 8000
\ No newline at end of file
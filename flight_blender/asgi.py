@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'flight_blender.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Live air traffic is pushed as server-sent events, every other request is handled by Django
+from flight_feed_operations.live_traffic import LiveTrafficApplication
+
+application = LiveTrafficApplication(django_application)
@@ -23,6 +23,8 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("ping", flight_feed_views.ping),
     path("ping_auth", flight_feed_views.ping_with_auth,name="ping_auth"),
+    path("redis_pool_stats", flight_feed_views.redis_pool_stats, name="redis_pool_stats"),
+    path("dss_http_stats", flight_feed_views.dss_http_stats, name="dss_http_stats"),
     path("signing_public_key", flight_feed_views.public_key_view),
     path("flight_stream/", include("flight_feed_operations.urls")),
     path("rid/", include("rid_operations.urls")),
@@ -11,6 +11,7 @@ from rest_framework import status
 
 from auth_helper.common import get_redis
 from common.data_definitions import OPERATION_STATES
+from common.database_operations import BlenderDatabaseWriter
 from conformance_monitoring_operations.conformance_checks_handler import (
     FlightOperationConformanceHelper,
 )
@@ -36,6 +37,14 @@ logger = logging.getLogger("django")
 load_dotenv(find_dotenv())
 
 
+@app.task(name="flush_telemetry_timestamps")
+def flush_telemetry_timestamps():
+    # Write the latest telemetry time of the operations that sent telemetry since the last flush to the database, scheduled by BlenderDatabaseWriter.update_telemetry_timestamp
+    my_database_writer = BlenderDatabaseWriter()
+    updated_count = my_database_writer.flush_telemetry_timestamps()
+    logger.debug("Updated the telemetry timestamp of %s operations" % updated_count)
+
+
 @app.task(name="_send_flight_approved_message")
 def _send_flight_approved_message(
     flight_declaration_id: str,
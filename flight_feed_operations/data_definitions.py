@@ -28,7 +28,40 @@ class SingleAirtrafficObservation():
     icao_address: str
     metadata: Optional[dict]
 
+@dataclass
+class ObservationStreamRetentionPolicy():
+    ''' How long and how many observations are kept in the observation stream: observations older than retention_secs are trimmed, except the last min_positions_per_aircraft positions of the aircraft seen within LATEST_OBSERVATIONS_MAX_AGE_SECS. max_length is a hard cap that wins over both, a stream longer than max_length is trimmed even past the recent positions of live aircraft '''
+    retention_secs: int
+    max_length: int
+    min_positions_per_aircraft: int
+
+@dataclass(frozen=True)
+class ObservationShardKeys():
+    ''' The keys of the stream and the latest state of the aircraft in a shard of the observations '''
+    stream: str
+    latest_observations: str
+    positions: str
+    last_seen: str
+    recent_stream_ids: str
+    retention_floor: str
+    recent_positions: str
+
 @dataclass 
 class FlightObservationsProcessingResponse():
     message:str
     status: int
+
+@dataclass
+class ReplayObservation():
+    ''' An observation to replay: the recorded time and the observation to write (a SingleAirtrafficObservation or SingleRIDObservation as a dictionary, with the metadata as a dictionary) '''
+    timestamp_ms: int
+    observation: dict
+
+@dataclass
+class ReplayStats():
+    ''' The outcome of a replay, durations are in seconds '''
+    observations: int
+    batches: int
+    recorded_duration_secs: float
+    replay_duration_secs: float
+    max_lag_secs: float
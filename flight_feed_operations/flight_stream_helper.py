@@ -1,11 +1,231 @@
 import json
+import logging
+import math
+import os
+import socket
+import time
+from datetime import datetime, timezone
+from itertools import zip_longest
+from os import environ as env
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import find_dotenv, load_dotenv
+from redis.exceptions import ResponseError
+from walrus.containers import ConsumerGroup
+from walrus.streams import id_to_datetime
 
 from auth_helper.common import get_walrus_database
-from itertools import zip_longest
-from dotenv import load_dotenv, find_dotenv
+
+from .data_definitions import ObservationShardKeys, ObservationStreamRetentionPolicy
+from .observation_encoding import (
+    ENCODED_OBSERVATION_FIELD,
+    ENCODING_VERSION_FIELD,
+    OBSERVATION_ENCODING_JSON,
+    decode_observation,
+    decode_stream_entry,
+    encode_observation,
+    get_observation_encoding,
+)
+from .observation_shards import (
+    AIRCRAFT_SHARDS_KEY,
+    OBSERVATION_SHARDS_KEY,
+    get_observation_sharding_enabled,
+    get_shard_cell_degrees,
+    get_shard_id,
+    get_shard_keys,
+    shard_in_view_port,
+)
 
 load_dotenv(find_dotenv())
 
+logger = logging.getLogger("django")
+
+# The default retention of the stream: observations are kept for a time, up to a hard (approximate) maximum length,
+# and at least the most recent positions of every live aircraft are kept even if they are older, unless the stream is longer than the maximum length
+OBSERVATION_STREAM_RETENTION_SECS = 120
+OBSERVATION_STREAM_MAX_LENGTH = 100000
+OBSERVATION_STREAM_MIN_POSITIONS_PER_AIRCRAFT = 10
+# A hash of aircraft id -> latest observation and its stream id
+LATEST_OBSERVATIONS_KEY = "latest_observations"
+# A geo index of the latest position of every aircraft and a sorted set of when each aircraft was last seen
+LIVE_AIRCRAFT_POSITIONS_KEY = "live_aircraft_positions"
+LIVE_AIRCRAFT_LAST_SEEN_KEY = "live_aircraft_last_seen"
+# For every stream, a hash of aircraft id -> stream ids of its most recent positions and a sorted set of aircraft id -> time of the oldest of these
+AIRCRAFT_RECENT_STREAM_IDS_KEY = "{stream_key}:aircraft_recent_stream_ids"
+AIRCRAFT_RETENTION_FLOOR_KEY = "{stream_key}:aircraft_retention_floor"
+# A hash of aircraft id -> its most recent positions, a ring buffer kept on ingest for the recent paths of RID
+AIRCRAFT_RECENT_POSITIONS_KEY = "aircraft_recent_positions"
+OBSERVATION_RECENT_POSITIONS_PER_AIRCRAFT = 10
+# Recent positions older than this are not returned (NetMaxRecentPositionsDuration in ASTM F3411)
+RECENT_POSITIONS_MAX_AGE_SECS = 60
+# The maximum number of stale aircraft removed from the geo index per write
+STALE_AIRCRAFT_EVICTION_BATCH_SIZE = 100
+# The maximum number of aircraft (oldest retention floor first) looked at per write for the retention floor of the stream
+RETENTION_FLOOR_SCAN_SIZE = 100
+KM_PER_DEGREE = 111.32
+# The consumer groups that are created on every shard stream
+OBSERVATION_CONSUMER_GROUPS = ["cg-pull", "cg-read"]
+# The default number of most recent observations in a snapshot of the stream(s)
+OBSERVATION_SNAPSHOT_COUNT = 1000
+# The default number of observations read or claimed at a time by a consumer and how long a delivered observation
+# can stay unacknowledged before another consumer of the group may claim it
+OBSERVATION_CONSUMER_READ_COUNT = 100
+OBSERVATION_CONSUMER_CLAIM_IDLE_MS = 60000
+
+# Adds every observation to the stream and updates the latest observation and position of the aircraft in the same atomic step
+# KEYS[1]: stream, KEYS[2]: latest observations hash, KEYS[3]: geo index of positions, KEYS[4]: last seen sorted set,
+# KEYS[5]: recent stream ids hash, KEYS[6]: retention floor sorted set, KEYS[7]: recent positions hash
+# ARGV[1]: the settings as JSON: stream max length, maximum age of the latest observations in seconds, eviction batch size, retention floor scan size,
+# stream retention in seconds, minimum number of positions kept per aircraft, the consumer groups to create on a new stream,
+# the time to live of the stream in seconds (0 to keep the stream), the number of recent positions kept per aircraft and
+# the recent positions to start from for aircraft that have none yet (e.g. that moved from another shard)
+# ARGV[2..]: six arguments per observation: aircraft id, latitude, longitude, altitude, encoding version and the encoded observation
+# JSON observations are added to the stream as string fields, other encodings as a version and the encoded observation.
+# The latest observation is stored as "<encoding version>|<stream id>|<encoded observation>" and the recent positions
+# as "<time in ms>,<latitude>,<longitude>,<altitude>" separated by ";", oldest first
+# The stream is trimmed (~) to the retention time, but never past the oldest of the recent positions of an aircraft seen within the
+# max age (of the first retention_floor_scan_size aircraft by retention floor), and then (~) to the max length. The max length
+# always wins: when the stream is longer, the recent positions of live aircraft are trimmed too
+WRITE_OBSERVATIONS_SCRIPT = """
+local settings = cjson.decode(ARGV[1])
+local time = redis.call('TIME')
+local now_ms = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local min_positions = settings['min_positions_per_aircraft']
+local max_recent_positions = settings['recent_positions_per_aircraft']
+local ids = {}
+local recent_ids = {}
+local recent_positions = {}
+if #settings['consumer_groups'] > 0 and redis.call('EXISTS', KEYS[1]) == 0 then
+    for _, group in ipairs(settings['consumer_groups']) do
+        redis.call('XGROUP', 'CREATE', KEYS[1], group, '0', 'MKSTREAM')
+    end
+end
+for i = 2, #ARGV, 6 do
+    local aircraft_id = ARGV[i]
+    local encoding = ARGV[i + 4]
+    local encoded_observation = ARGV[i + 5]
+    local id
+    if encoding == '%(json_encoding)s' then
+        local fields = {}
+        for field, value in pairs(cjson.decode(encoded_observation)) do
+            fields[#fields + 1] = field
+            fields[#fields + 1] = value
+        end
+        id = redis.call('XADD', KEYS[1], '*', unpack(fields))
+    else
+        id = redis.call('XADD', KEYS[1], '*', '%(version_field)s', encoding, '%(encoded_field)s', encoded_observation)
+    end
+    redis.call('HSET', KEYS[2], aircraft_id, encoding .. '|' .. id .. '|' .. encoded_observation)
+    local lat = tonumber(ARGV[i + 1])
+    local lng = tonumber(ARGV[i + 2])
+    if lat and lng and lat >= -85.05112878 and lat <= 85.05112878 and lng >= -180 and lng <= 180 then
+        redis.call('GEOADD', KEYS[3], lng, lat, aircraft_id)
+    end
+    if max_recent_positions > 0 and lat and lng then
+        local aircraft_positions = recent_positions[aircraft_id]
+        if not aircraft_positions then
+            aircraft_positions = {}
+            local stored_positions = redis.call('HGET', KEYS[7], aircraft_id) or settings['recent_positions_seed'][aircraft_id]
+            if stored_positions then
+                for position in string.gmatch(stored_positions, '[^;]+') do
+                    aircraft_positions[#aircraft_positions + 1] = position
+                end
+            end
+            recent_positions[aircraft_id] = aircraft_positions
+        end
+        aircraft_positions[#aircraft_positions + 1] = string.match(id, '^(%%d+)') .. ',' .. ARGV[i + 1] .. ',' .. ARGV[i + 2] .. ',' .. ARGV[i + 3]
+        while #aircraft_positions > max_recent_positions do
+            table.remove(aircraft_positions, 1)
+        end
+    end
+    redis.call('ZADD', KEYS[4], now_ms, aircraft_id)
+    if min_positions > 0 then
+        local aircraft_recent_ids = recent_ids[aircraft_id]
+        if not aircraft_recent_ids then
+            aircraft_recent_ids = {}
+            local stored_recent_ids = redis.call('HGET', KEYS[5], aircraft_id)
+            if stored_recent_ids then
+                for recent_id in string.gmatch(stored_recent_ids, '%%S+') do
+                    aircraft_recent_ids[#aircraft_recent_ids + 1] = recent_id
+                end
+            end
+            recent_ids[aircraft_id] = aircraft_recent_ids
+        end
+        aircraft_recent_ids[#aircraft_recent_ids + 1] = id
+        while #aircraft_recent_ids > min_positions do
+            table.remove(aircraft_recent_ids, 1)
+        end
+    end
+    ids[#ids + 1] = id
+end
+for aircraft_id, aircraft_recent_ids in pairs(recent_ids) do
+    redis.call('HSET', KEYS[5], aircraft_id, table.concat(aircraft_recent_ids, ' '))
+    redis.call('ZADD', KEYS[6], string.match(aircraft_recent_ids[1], '^(%%d+)'), aircraft_id)
+end
+for aircraft_id, aircraft_positions in pairs(recent_positions) do
+    redis.call('HSET', KEYS[7], aircraft_id, table.concat(aircraft_positions, ';'))
+end
+local stale = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', now_ms - settings['max_age_secs'] * 1000, 'LIMIT', 0, settings['eviction_batch_size'])
+if #stale > 0 then
+    redis.call('ZREM', KEYS[3], unpack(stale))
+    redis.call('ZREM', KEYS[4], unpack(stale))
+    redis.call('HDEL', KEYS[5], unpack(stale))
+    redis.call('ZREM', KEYS[6], unpack(stale))
+    redis.call('HDEL', KEYS[7], unpack(stale))
+end
+local min_id = now_ms - settings['retention_secs'] * 1000
+-- The oldest retention floor of an aircraft seen within the max age, the floors of stale aircraft that are not evicted yet are skipped
+local stale_before_ms = now_ms - settings['max_age_secs'] * 1000
+local retention_floors = redis.call('ZRANGE', KEYS[6], 0, settings['retention_floor_scan_size'] - 1, 'WITHSCORES')
+for j = 1, #retention_floors, 2 do
+    local floor_ms = tonumber(retention_floors[j + 1])
+    if floor_ms >= min_id then
+        break
+    end
+    local last_seen_ms = tonumber(redis.call('ZSCORE', KEYS[4], retention_floors[j]))
+    if last_seen_ms and last_seen_ms > stale_before_ms then
+        min_id = floor_ms
+        break
+    end
+end
+redis.call('XTRIM', KEYS[1], 'MINID', '~', string.format('%%d', min_id))
+redis.call('XTRIM', KEYS[1], 'MAXLEN', '~', settings['max_length'])
+for k = 2, 7 do
+    redis.call('EXPIRE', KEYS[k], settings['max_age_secs'])
+end
+if settings['stream_ttl_secs'] > 0 then
+    redis.call('EXPIRE', KEYS[1], settings['stream_ttl_secs'])
+end
+return ids
+""" % {
+    "json_encoding": OBSERVATION_ENCODING_JSON,
+    "version_field": ENCODING_VERSION_FIELD,
+    "encoded_field": ENCODED_OBSERVATION_FIELD,
+}
+
+# Removes an aircraft from the latest state of a shard after it has moved to another shard
+# KEYS: latest observations hash, geo index of positions, last seen sorted set, recent stream ids hash, retention floor sorted set,
+# recent positions hash
+# ARGV: the aircraft ids
+REMOVE_AIRCRAFT_SCRIPT = """
+redis.call('HDEL', KEYS[1], unpack(ARGV))
+redis.call('ZREM', KEYS[2], unpack(ARGV))
+redis.call('ZREM', KEYS[3], unpack(ARGV))
+redis.call('HDEL', KEYS[4], unpack(ARGV))
+redis.call('ZREM', KEYS[5], unpack(ARGV))
+redis.call('HDEL', KEYS[6], unpack(ARGV))
+return #ARGV
+"""
+
+# Removes the latest observation of an aircraft only if it has not been updated since it was read
+DELETE_STALE_OBSERVATION_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
 # iterate a list in batches of size n
 def batcher(iterable, n):
     args = [iter(iterable)] * n
@@ -15,18 +235,30 @@ def batcher(iterable, n):
 class StreamHelperOps:
     def __init__(self):
         self.db = get_walrus_database()
-        self.stream_keys = ["all_observations"]
+        self.sharded = get_observation_sharding_enabled()
+        if self.sharded:
+            # The streams of the shards written to recently, the consumer groups are created on a shard stream when it is created
+            self.stream_keys = [
+                keys.stream for keys in get_active_shard_keys(db=self.db)
+            ]
+        else:
+            self.stream_keys = ["all_observations"]
 
     def create_read_cg(self):
         self.get_read_cg(create=True)
 
+    def _create_cg(self, cg):
+        if not self.sharded:
+            for stream in self.stream_keys:
+                self.db.xadd(stream, {"data": ""})
+        # Shard streams are not given a placeholder entry, the group is created on the stream or on a new empty stream
+        cg.create(mkstream=True)
+        cg.set_id("$")
+
     def get_read_cg(self, create=False):
         cg = self.db.time_series("cg-read", self.stream_keys)
         if create:
-            for stream in self.stream_keys:
-                self.db.xadd(stream, {"data": ""})
-            cg.create()
-            cg.set_id("$")
+            self._create_cg(cg)
 
         return cg
 
@@ -36,27 +268,744 @@ class StreamHelperOps:
     def get_pull_cg(self, create=False):
         cg = self.db.time_series("cg-pull", self.stream_keys)
         if create:
-            for stream in self.stream_keys:
-                self.db.xadd(stream, {"data": ""})
-
-            cg.create()
-            cg.set_id("$")
+            self._create_cg(cg)
 
         return cg
 
+
+class ObservationWriteOperations:
+    """
+    A class to write air traffic observations to the stream. All the observations in a batch are written in a single atomic script that also updates the latest observation and the position of every aircraft, the stream is trimmed once per batch using an approximate (~) MAXLEN. Observations are encoded as set in OBSERVATION_STREAM_ENCODING.
+
+    If OBSERVATION_STREAM_SHARDING is enabled the observations are written to the shard of their traffic source and cell (one script per shard, in a single pipeline) instead of the stream_key.
+    """
+
+    def __init__(self, stream_key: str = "all_observations"):
+        self.db = get_walrus_database()
+        self.stream_key = stream_key
+        self.latest_observations_max_age = get_latest_observations_max_age()
+        self.retention_policy = get_stream_retention_policy()
+        self.recent_positions_per_aircraft = get_recent_positions_per_aircraft()
+        self.encoding = get_observation_encoding()
+        self.sharded = get_observation_sharding_enabled()
+        self.shard_cell_degrees = get_shard_cell_degrees()
+        self.write_observations_script = self.db.register_script(
+            WRITE_OBSERVATIONS_SCRIPT
+        )
+        self.remove_aircraft_script = self.db.register_script(REMOVE_AIRCRAFT_SCRIPT)
+
+    def _get_position(
+        self, observation: dict
+    ) -> Tuple[Optional[float], Optional[float]]:
+        position = []
+        for field in ["lat_dd", "lon_dd"]:
+            try:
+                position.append(float(observation[field]))
+            except (KeyError, TypeError, ValueError):
+                # Not a position, the aircraft is not added to the geo index
+                position.append(None)
+        return position[0], position[1]
+
+    def _serialize_observation(self, observation: dict) -> list:
+        """The script arguments of an observation: aircraft id, latitude, longitude, altitude, encoding version and the encoded observation"""
+        encoding, encoded_observation = encode_observation(
+            observation=observation, encoding=self.encoding
+        )
+        position = ["" if p is None else p for p in self._get_position(observation)]
+        try:
+            altitude = float(observation["altitude_mm"])
+        except (KeyError, TypeError, ValueError):
+            altitude = ""
+        return (
+            [str(observation["icao_address"])]
+            + position
+            + [altitude, encoding, encoded_observation]
+        )
+
+    def _get_script_settings(
+        self, sharded: bool, recent_positions_seed: Optional[Dict[str, str]] = None
+    ) -> str:
+        # Shard streams are created with the consumer groups and expire once nothing has been written to them for a while
+        return json.dumps(
+            {
+                "max_length": self.retention_policy.max_length,
+                "max_age_secs": self.latest_observations_max_age,
+                "eviction_batch_size": STALE_AIRCRAFT_EVICTION_BATCH_SIZE,
+                "retention_floor_scan_size": RETENTION_FLOOR_SCAN_SIZE,
+                "retention_secs": self.retention_policy.retention_secs,
+                "min_positions_per_aircraft": self.retention_policy.min_positions_per_aircraft,
+                "consumer_groups": OBSERVATION_CONSUMER_GROUPS if sharded else [],
+                "stream_ttl_secs": (
+                    2 * get_active_shard_window(self.retention_policy) if sharded else 0
+                ),
+                "recent_positions_per_aircraft": self.recent_positions_per_aircraft,
+                "recent_positions_seed": recent_positions_seed or {},
+            }
+        )
+
+    def _write_to_shard(
+        self,
+        keys: ObservationShardKeys,
+        observations: List[dict],
+        sharded: bool,
+        client=None,
+        recent_positions_seed: Optional[Dict[str, str]] = None,
+    ):
+        return self.write_observations_script(
+            keys=[
+                keys.stream,
+                keys.latest_observations,
+                keys.positions,
+                keys.last_seen,
+                keys.recent_stream_ids,
+                keys.retention_floor,
+                keys.recent_positions,
+            ],
+            args=[
+                self._get_script_settings(
+                    sharded=sharded, recent_positions_seed=recent_positions_seed
+                )
+            ]
+            + [
+                argument
+                for o in observations
+                for argument in self._serialize_observation(o)
+            ],
+            client=client,
+        )
+
+    def _write_sharded_observations(self, observations: List[dict]) -> List[bytes]:
+        shard_ids = [
+            get_shard_id(
+                o.get("traffic_source"), *self._get_position(o), self.shard_cell_degrees
+            )
+            for o in observations
+        ]
+        # The shard of the last observation of every aircraft in this batch and every other shard it was in before
+        aircraft_shard = {}
+        previous_shards = {}
+        for observation, shard_id in zip(observations, shard_ids):
+            aircraft_id = str(observation["icao_address"])
+            if aircraft_id in aircraft_shard:
+                previous_shards[aircraft_id].add(aircraft_shard[aircraft_id])
+            else:
+                previous_shards[aircraft_id] = set()
+            aircraft_shard[aircraft_id] = shard_id
+        stored_shards = self.db.hmget(AIRCRAFT_SHARDS_KEY, list(aircraft_shard.keys()))
+        # Aircraft that were in another shard before this batch by that shard
+        moved_from_shard: Dict[str, List[str]] = {}
+        for aircraft_id, stored_shard in zip(aircraft_shard.keys(), stored_shards):
+            if stored_shard is not None:
+                stored_shard = stored_shard.decode("utf-8")
+                previous_shards[aircraft_id].add(stored_shard)
+                if stored_shard != aircraft_shard[aircraft_id]:
+                    moved_from_shard.setdefault(stored_shard, []).append(aircraft_id)
+        # The recent positions of an aircraft that moved are carried to its new shard
+        recent_positions_seed: Dict[str, str] = {}
+        if moved_from_shard and self.recent_positions_per_aircraft > 0:
+            pipe = self.db.pipeline(transaction=False)
+            for shard_id, aircraft_ids in moved_from_shard.items():
+                pipe.hmget(get_shard_keys(shard_id).recent_positions, aircraft_ids)
+            for aircraft_ids, stored_positions in zip(
+                moved_from_shard.values(), pipe.execute()
+            ):
+                for aircraft_id, positions in zip(aircraft_ids, stored_positions):
+                    if positions is not None:
+                        recent_positions_seed[aircraft_id] = positions.decode("utf-8")
+
+        shard_observation_indices = {}
+        for index, shard_id in enumerate(shard_ids):
+            shard_observation_indices.setdefault(shard_id, []).append(index)
+
+        pipe = self.db.pipeline(transaction=False)
+        for shard_id, indices in shard_observation_indices.items():
+            shard_observations = [observations[index] for index in indices]
+            self._write_to_shard(
+                keys=get_shard_keys(shard_id),
+                observations=shard_observations,
+                sharded=True,
+                client=pipe,
+                recent_positions_seed={
+                    str(o["icao_address"]): recent_positions_seed[
+                        str(o["icao_address"])
+                    ]
+                    for o in shard_observations
+                    if str(o["icao_address"]) in recent_positions_seed
+                },
+            )
+        # Aircraft that moved to another shard are removed from the latest state of the shards they were in
+        moved_aircraft = {}
+        for aircraft_id, shards in previous_shards.items():
+            for shard_id in shards - {aircraft_shard[aircraft_id]}:
+                moved_aircraft.setdefault(shard_id, []).append(aircraft_id)
+        for shard_id, aircraft_ids in moved_aircraft.items():
+            keys = get_shard_keys(shard_id)
+            self.remove_aircraft_script(
+                keys=[
+                    keys.latest_observations,
+                    keys.positions,
+                    keys.last_seen,
+                    keys.recent_stream_ids,
+                    keys.retention_floor,
+                    keys.recent_positions,
+                ],
+                args=aircraft_ids,
+                client=pipe,
+            )
+        now_ms = int(time.time() * 1000)
+        active_shard_window = get_active_shard_window(self.retention_policy)
+        pipe.hset(AIRCRAFT_SHARDS_KEY, mapping=aircraft_shard)
+        pipe.expire(AIRCRAFT_SHARDS_KEY, self.latest_observations_max_age)
+        pipe.zadd(
+            OBSERVATION_SHARDS_KEY,
+            {shard_id: now_ms for shard_id in shard_observation_indices.keys()},
+        )
+        pipe.zremrangebyscore(
+            OBSERVATION_SHARDS_KEY, "-inf", now_ms - 2 * active_shard_window * 1000
+        )
+        results = pipe.execute()
+
+        message_ids = [None] * len(observations)
+        for shard_message_ids, indices in zip(
+            results, shard_observation_indices.values()
+        ):
+            for index, message_id in zip(indices, shard_message_ids):
+                message_ids[index] = message_id
+        return message_ids
+
+    def write_observations(self, observations: List[dict]) -> List[str]:
+        """Write a list of observations (as dictionaries) and return the ids of the stream entries in the same order"""
+        if not observations:
+            return []
+        if self.sharded:
+            message_ids = self._write_sharded_observations(observations)
+        else:
+            message_ids = self._write_to_shard(
+                keys=get_unsharded_keys(self.stream_key),
+                observations=observations,
+                sharded=False,
+            )
+        return [message_id.decode("utf-8") for message_id in message_ids]
+
+    def write_observation(self, observation: dict) -> str:
+        return self.write_observations([observation])[0]
+
+
+def get_latest_observations_max_age() -> int:
+    """Observations older than this (in seconds) are not considered current"""
+    return int(env.get("LATEST_OBSERVATIONS_MAX_AGE_SECS", 60))
+
+
+def get_recent_positions_per_aircraft() -> int:
+    """The number of recent positions kept for every aircraft (0 to keep none), set using OBSERVATION_RECENT_POSITIONS_PER_AIRCRAFT"""
+    return int(
+        env.get(
+            "OBSERVATION_RECENT_POSITIONS_PER_AIRCRAFT",
+            OBSERVATION_RECENT_POSITIONS_PER_AIRCRAFT,
+        )
+    )
+
+
+def get_stream_retention_policy() -> ObservationStreamRetentionPolicy:
+    """The retention of the observation stream, set using OBSERVATION_STREAM_RETENTION_SECS, OBSERVATION_STREAM_MAX_LENGTH and OBSERVATION_STREAM_MIN_POSITIONS_PER_AIRCRAFT"""
+    return ObservationStreamRetentionPolicy(
+        retention_secs=int(
+            env.get(
+                "OBSERVATION_STREAM_RETENTION_SECS", OBSERVATION_STREAM_RETENTION_SECS
+            )
+        ),
+        max_length=int(
+            env.get("OBSERVATION_STREAM_MAX_LENGTH", OBSERVATION_STREAM_MAX_LENGTH)
+        ),
+        min_positions_per_aircraft=int(
+            env.get(
+                "OBSERVATION_STREAM_MIN_POSITIONS_PER_AIRCRAFT",
+                OBSERVATION_STREAM_MIN_POSITIONS_PER_AIRCRAFT,
+            )
+        ),
+    )
+
+
+def get_active_shard_window(retention_policy: ObservationStreamRetentionPolicy) -> int:
+    """Shards written to within this time (in seconds) are read"""
+    return max(retention_policy.retention_secs, get_latest_observations_max_age())
+
+
+def get_unsharded_keys(stream_key: str = "all_observations") -> ObservationShardKeys:
+    return ObservationShardKeys(
+        stream=stream_key,
+        latest_observations=LATEST_OBSERVATIONS_KEY,
+        positions=LIVE_AIRCRAFT_POSITIONS_KEY,
+        last_seen=LIVE_AIRCRAFT_LAST_SEEN_KEY,
+        recent_stream_ids=AIRCRAFT_RECENT_STREAM_IDS_KEY.format(stream_key=stream_key),
+        retention_floor=AIRCRAFT_RETENTION_FLOOR_KEY.format(stream_key=stream_key),
+        recent_positions=AIRCRAFT_RECENT_POSITIONS_KEY,
+    )
+
+
+def get_active_shard_keys(
+    db, view_port: Optional[List[float]] = None
+) -> List[ObservationShardKeys]:
+    """The keys of the shards written to recently, only the shards that intersect the view port (lat1, lng1, lat2, lng2) if one is given"""
+    if not get_observation_sharding_enabled():
+        return [get_unsharded_keys()]
+    active_since_ms = (
+        time.time() - get_active_shard_window(get_stream_retention_policy())
+    ) * 1000
+    shard_ids = [
+        shard_id.decode("utf-8")
+        for shard_id in db.zrangebyscore(
+            OBSERVATION_SHARDS_KEY, active_since_ms, "+inf"
+        )
+    ]
+    if view_port is not None:
+        cell_degrees = get_shard_cell_degrees()
+        shard_ids = [
+            shard_id
+            for shard_id in shard_ids
+            if shard_in_view_port(shard_id, view_port, cell_degrees)
+        ]
+    return [get_shard_keys(shard_id) for shard_id in shard_ids]
+
+
+def split_latest_observation(latest_observation: bytes) -> Tuple[bytes, bytes, bytes]:
+    """Split a value of the latest observations hash in the encoding version, stream id and the encoded observation"""
+    encoding, stream_id, encoded_observation = latest_observation.split(b"|", 2)
+    return encoding, stream_id, encoded_observation
+
+
+def parse_recent_positions(
+    recent_positions: Optional[bytes],
+    max_age_secs: int = RECENT_POSITIONS_MAX_AGE_SECS,
+) -> List[dict]:
+    """Parse the recent positions of an aircraft (oldest first) in dictionaries with the time (RFC 3339), lat, lng and alt, positions older than max_age_secs are skipped"""
+    if not recent_positions:
+        return []
+    oldest_allowed_ms = (time.time() - max_age_secs) * 1000
+    positions = []
+    for recent_position in recent_positions.decode("utf-8").split(";"):
+        time_ms, lat, lng, alt = recent_position.split(",")
+        if int(time_ms) < oldest_allowed_ms:
+            continue
+        positions.append(
+            {
+                "time": datetime.fromtimestamp(
+                    int(time_ms) / 1000, tz=timezone.utc
+                ).isoformat(timespec="milliseconds"),
+                "lat": float(lat),
+                "lng": float(lng),
+                "alt": float(alt) if alt else None,
+            }
+        )
+    return positions
+
+
+def parse_stream_entries(stream_key: str, messages) -> List[dict]:
+    """Parse the raw (id, fields) entries of a stream, entries that are not observations are skipped"""
+    observations = []
+    for message_id, fields in messages:
+        if fields is None:
+            # An entry that was trimmed from the stream while it was pending (XAUTOCLAIM)
+            continue
+        observation = decode_stream_entry(fields)
+        if observation is None:
+            continue
+        timestamp, sequence = id_to_datetime(message_id)
+        observations.append(
+            {
+                "timestamp": timestamp,
+                "seq": sequence,
+                "msg_data": observation,
+                "address": observation["icao_address"],
+                "metadata": json.loads(observation["metadata"]),
+                "stream": stream_key,
+                "id": message_id.decode("utf-8"),
+            }
+        )
+    return observations
+
+
 class ObservationReadOperations:
+    def _parse_latest_observations(
+        self,
+        db,
+        latest_observations: List[Tuple[bytes, bytes]],
+        latest_observations_key: str = LATEST_OBSERVATIONS_KEY,
+    ) -> List[dict]:
+        """Parse (aircraft id, latest observation) pairs, stale observations are skipped and removed from the hash"""
+        oldest_allowed_ms = (time.time() - get_latest_observations_max_age()) * 1000
+        current_observations = []
+        stale_observations = []
+        for aircraft_id, latest_observation in latest_observations:
+            if latest_observation is None:
+                continue
+            encoding, stream_id, encoded_observation = split_latest_observation(
+                latest_observation
+            )
+            if int(stream_id.split(b"-")[0]) < oldest_allowed_ms:
+                stale_observations.append((aircraft_id, latest_observation))
+                continue
+            observation = decode_observation(
+                encoding.decode("utf-8"), encoded_observation
+            )
+            timestamp, sequence = id_to_datetime(stream_id)
+            current_observations.append(
+                {
+                    "timestamp": timestamp,
+                    "seq": sequence,
+                    "msg_data": observation,
+                    "address": observation["icao_address"],
+                    "metadata": json.loads(observation["metadata"]),
+                }
+            )
+
+        if stale_observations:
+            delete_stale_observation = db.register_script(
+                DELETE_STALE_OBSERVATION_SCRIPT
+            )
+            for aircraft_id, latest_observation in stale_observations:
+                delete_stale_observation(
+                    keys=[latest_observations_key],
+                    args=[aircraft_id, latest_observation],
+                )
+        # Most recent first
+        current_observations.sort(key=lambda item: item["timestamp"], reverse=True)
+        return current_observations
+
+    def _merge_latest_observations(
+        self, shard_observations: List[List[dict]]
+    ) -> List[dict]:
+        """Merge the latest observations of several shards, an aircraft that moved between shards is kept only once with its most recent observation"""
+        if len(shard_observations) == 1:
+            return shard_observations[0]
+        latest_by_address = {}
+        for observations in shard_observations:
+            for observation in observations:
+                current = latest_by_address.get(observation["address"])
+                if current is None or (observation["timestamp"], observation["seq"]) > (
+                    current["timestamp"],
+                    current["seq"],
+                ):
+                    latest_by_address[observation["address"]] = observation
+        return sorted(
+            latest_by_address.values(), key=lambda item: item["timestamp"], reverse=True
+        )
+
+    def get_latest_observations(self) -> List[dict]:
+        """
+        Get the latest observation of every aircraft that has reported within the maximum age, the cost of this read depends on the number of aircraft and not on the length of the stream
+        """
+        db = get_walrus_database()
+        all_shard_keys = get_active_shard_keys(db=db)
+        pipe = db.pipeline(transaction=False)
+        for keys in all_shard_keys:
+            pipe.hgetall(keys.latest_observations)
+        return self._merge_latest_observations(
+            [
+                self._parse_latest_observations(
+                    db=db,
+                    latest_observations=list(latest_observations.items()),
+                    latest_observations_key=keys.latest_observations,
+                )
+                for keys, latest_observations in zip(all_shard_keys, pipe.execute())
+            ]
+        )
+
+    def _search_view_port(
+        self, db, view_port: List[float], withcoord: bool = False
+    ) -> Tuple[List[ObservationShardKeys], list]:
+        """Search the geo index of every active shard that a view port (lat1, lng1, lat2, lng2) touches, the search box covers the view port and is larger than it"""
+        lat_min = min(view_port[0], view_port[2])
+        lat_max = max(view_port[0], view_port[2])
+        lng_min = min(view_port[1], view_port[3])
+        lng_max = max(view_port[1], view_port[3])
+        # The search box is centered on the view port and as wide as the view port is at the latitude closest to the equator so that it covers the whole view port
+        center_lat = (lat_min + lat_max) / 2
+        center_lng = (lng_min + lng_max) / 2
+        widest_lat = 0 if lat_min <= 0 <= lat_max else min(abs(lat_min), abs(lat_max))
+        height_km = (lat_max - lat_min) * KM_PER_DEGREE + 1
+        width_km = (lng_max - lng_min) * KM_PER_DEGREE * math.cos(
+            math.radians(widest_lat)
+        ) + 1
+
+        # Only the shards that the view port touches are searched
+        all_shard_keys = get_active_shard_keys(db=db, view_port=view_port)
+        pipe = db.pipeline(transaction=False)
+        for keys in all_shard_keys:
+            pipe.geosearch(
+                keys.positions,
+                longitude=max(min(center_lng, 180), -180),
+                latitude=max(min(center_lat, 85.05112878), -85.05112878),
+                width=width_km,
+                height=height_km,
+                unit="km",
+                withcoord=withcoord,
+            )
+        return all_shard_keys, pipe.execute()
+
+    def get_positions_in_view_port(
+        self, view_port: List[float]
+    ) -> Tuple[List[str], List[float], List[float]]:
+        """
+        Get the latest position of every current aircraft inside a view port (lat1, lng1, lat2, lng2) from the geo index only, the observations are not read. Returns the aircraft ids, latitudes and longitudes, use this to count or cluster the aircraft of large view ports
+        """
+        lat_min = min(view_port[0], view_port[2])
+        lat_max = max(view_port[0], view_port[2])
+        lng_min = min(view_port[1], view_port[3])
+        lng_max = max(view_port[1], view_port[3])
+        db = get_walrus_database()
+        all_shard_keys, shard_positions = self._search_view_port(
+            db=db, view_port=view_port, withcoord=True
+        )
+        shard_positions = [
+            (keys, positions)
+            for keys, positions in zip(all_shard_keys, shard_positions)
+            if positions
+        ]
+        if not shard_positions:
+            return [], [], []
+        # Aircraft that have not reported within the maximum age may still be in the geo index until they are evicted
+        pipe = db.pipeline(transaction=False)
+        for keys, positions in shard_positions:
+            pipe.zmscore(keys.last_seen, [aircraft_id for aircraft_id, _ in positions])
+        oldest_allowed_ms = (time.time() - get_latest_observations_max_age()) * 1000
+        # An aircraft that moved between shards is kept with the position it was last seen at
+        latest_positions: Dict[str, Tuple[float, float, float]] = {}
+        for (_, positions), last_seen in zip(shard_positions, pipe.execute()):
+            for (aircraft_id, (lng, lat)), seen_at in zip(positions, last_seen):
+                if seen_at is None or seen_at < oldest_allowed_ms:
+                    continue
+                if not (lat_min <= lat <= lat_max and lng_min <= lng <= lng_max):
+                    continue
+                aircraft_id = aircraft_id.decode("utf-8")
+                current = latest_positions.get(aircraft_id)
+                if current is None or seen_at > current[0]:
+                    latest_positions[aircraft_id] = (seen_at, lat, lng)
+        return (
+            list(latest_positions.keys()),
+            [lat for _, lat, _ in latest_positions.values()],
+            [lng for _, _, lng in latest_positions.values()],
+        )
+
+    def get_latest_observations_in_view_port(
+        self, view_port: List[float], include_recent_positions: bool = False
+    ) -> List[dict]:
+        """
+        Get the latest observation of every aircraft inside a view port (lat1, lng1, lat2, lng2), only the aircraft in the geo index around the view port are read. If include_recent_positions is set every observation has the recent positions of the aircraft (see parse_recent_positions) in recent_positions, they are read in the same round trip
+        """
+        lat_min = min(view_port[0], view_port[2])
+        lat_max = max(view_port[0], view_port[2])
+        lng_min = min(view_port[1], view_port[3])
+        lng_max = max(view_port[1], view_port[3])
+
+        db = get_walrus_database()
+        all_shard_keys, shard_aircraft_ids = self._search_view_port(
+            db=db, view_port=view_port
+        )
+        pipe = db.pipeline(transaction=False)
+        shard_aircraft_ids = [
+            (keys, aircraft_ids)
+            for keys, aircraft_ids in zip(all_shard_keys, shard_aircraft_ids)
+            if aircraft_ids
+        ]
+        if not shard_aircraft_ids:
+            return []
+        for keys, aircraft_ids in shard_aircraft_ids:
+            pipe.hmget(keys.latest_observations, aircraft_ids)
+            if include_recent_positions:
+                pipe.hmget(keys.recent_positions, aircraft_ids)
+        results = pipe.execute()
+        stride = 2 if include_recent_positions else 1
+        current_observations = self._merge_latest_observations(
+            [
+                self._parse_latest_observations(
+                    db=db,
+                    latest_observations=list(zip(aircraft_ids, latest_observations)),
+                    latest_observations_key=keys.latest_observations,
+                )
+                for (keys, aircraft_ids), latest_observations in zip(
+                    shard_aircraft_ids, results[::stride]
+                )
+            ]
+        )
+        if include_recent_positions:
+            # An aircraft that moved between shards keeps its positions in the shard it is in now, which has the most recent position
+            recent_positions = {}
+            for (_, aircraft_ids), stored_positions in zip(
+                shard_aircraft_ids, results[1::stride]
+            ):
+                for aircraft_id, positions in zip(aircraft_ids, stored_positions):
+                    positions = parse_recent_positions(positions)
+                    address = aircraft_id.decode("utf-8")
+                    if positions and (
+                        address not in recent_positions
+                        or positions[-1]["time"] > recent_positions[address][-1]["time"]
+                    ):
+                        recent_positions[address] = positions
+            for observation in current_observations:
+                observation["recent_positions"] = recent_positions.get(
+                    str(observation["address"]), []
+                )
+        # The geo search box is larger than the view port, keep only the observations inside it
+        return [
+            o
+            for o in current_observations
+            if lat_min <= float(o["msg_data"]["lat_dd"]) <= lat_max
+            and lng_min <= float(o["msg_data"]["lon_dd"]) <= lng_max
+        ]
+
+    def get_observations_snapshot(
+        self, count: int = OBSERVATION_SNAPSHOT_COUNT
+    ) -> List[dict]:
+        """
+        Get the most recent observations (up to count, most recent first) of the stream(s) without consuming them, every caller sees the same observations. Use this for display, get_latest_observations if only the latest observation of every aircraft is needed and an ObservationConsumer to process every observation once.
+        """
+        db = get_walrus_database()
+        all_shard_keys = get_active_shard_keys(db=db)
+        pipe = db.pipeline(transaction=False)
+        for keys in all_shard_keys:
+            pipe.xrevrange(keys.stream, count=count)
+        observations = []
+        for keys, messages in zip(all_shard_keys, pipe.execute()):
+            observations.extend(parse_stream_entries(keys.stream, messages))
+        observations.sort(
+            key=lambda item: (item["timestamp"], item["seq"]), reverse=True
+        )
+        return observations[:count]
+
     def get_observations(self, cg):
-        messages = cg.read()
+        """Read the new observations of a walrus consumer group, the observations are not acknowledged"""
+        if not cg.keys:
+            # No shard has been written to recently
+            return []
+        # Read the raw entries, observations in a binary encoding cannot be decoded as UTF-8 by walrus
+        streams = ConsumerGroup.read(cg)
         pending_messages = []
 
-        for message in messages:
-            pending_messages.append(
-                {
-                    "timestamp": message.timestamp,
-                    "seq": message.sequence,
-                    "msg_data": message.data,
-                    "address": message.data["icao_address"],
-                    "metadata": json.loads(message.data["metadata"]),
-                }
+        for stream, messages in streams:
+            pending_messages.extend(
+                parse_stream_entries(stream.decode("utf-8"), messages)
             )
         return pending_messages
+
+
+def get_default_consumer_name() -> str:
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+class ObservationConsumer:
+    """
+    A consumer of a consumer group of the observation stream(s) for processing pipelines: every observation is delivered to a single consumer of the group and stays pending until it is acknowledged. Observations delivered to a consumer that stopped before acknowledging them are claimed by another consumer after OBSERVATION_CONSUMER_CLAIM_IDLE_MS.
+
+    Every consumer of a group must have its own name, by default the host name and process id. If the observations are sharded, the streams of new shards are picked up on every read.
+    """
+
+    def __init__(self, group: str, consumer: Optional[str] = None):
+        self.db = get_walrus_database()
+        self.group = group
+        self.consumer = consumer or get_default_consumer_name()
+        self.sharded = get_observation_sharding_enabled()
+        self.stream_keys: List[str] = []
+        self.refresh_stream_keys()
+
+    def refresh_stream_keys(self):
+        if self.sharded:
+            stream_keys = [keys.stream for keys in get_active_shard_keys(db=self.db)]
+        else:
+            stream_keys = [get_unsharded_keys().stream]
+        for stream_key in stream_keys:
+            if stream_key not in self.stream_keys:
+                # A group created on a new shard starts from the beginning of the shard, otherwise from now
+                self._create_group(stream_key, start_id="0" if self.sharded else "$")
+        self.stream_keys = stream_keys
+
+    def _create_group(self, stream_key: str, start_id: str):
+        try:
+            self.db.xgroup_create(stream_key, self.group, id=start_id, mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read(
+        self, count: int = OBSERVATION_CONSUMER_READ_COUNT, block: Optional[int] = None
+    ) -> List[dict]:
+        """Read observations that have not been delivered to any consumer of the group, block is in ms"""
+        if self.sharded:
+            self.refresh_stream_keys()
+        if not self.stream_keys:
+            return []
+        streams = self.db.xreadgroup(
+            self.group,
+            self.consumer,
+            {stream_key: ">" for stream_key in self.stream_keys},
+            count=count,
+            block=block,
+        )
+        observations = []
+        for stream, messages in streams:
+            observations.extend(self._parse_entries(stream.decode("utf-8"), messages))
+        return observations
+
+    def _parse_entries(self, stream_key: str, messages) -> List[dict]:
+        stream_observations = parse_stream_entries(stream_key, messages)
+        # Entries that are not observations (e.g. added when a group was created, or trimmed while they were pending) are acknowledged right away
+        observation_ids = {o["id"] for o in stream_observations}
+        skipped = [
+            message_id
+            for message_id, _ in messages
+            if message_id.decode("utf-8") not in observation_ids
+        ]
+        if skipped:
+            self.db.xack(stream_key, self.group, *skipped)
+        return stream_observations
+
+    def ack(self, observations: List[dict]) -> int:
+        """Acknowledge processed observations, returns the number of observations acknowledged"""
+        ids_by_stream: Dict[str, List[str]] = {}
+        for observation in observations:
+            ids_by_stream.setdefault(observation["stream"], []).append(
+                observation["id"]
+            )
+        pipe = self.db.pipeline(transaction=False)
+        for stream_key, ids in ids_by_stream.items():
+            pipe.xack(stream_key, self.group, *ids)
+        return sum(pipe.execute())
+
+    def claim_stale(
+        self,
+        min_idle_ms: int = OBSERVATION_CONSUMER_CLAIM_IDLE_MS,
+        count: int = OBSERVATION_CONSUMER_READ_COUNT,
+    ) -> List[dict]:
+        """Claim (XAUTOCLAIM) up to count observations that have been pending with any consumer of the group for at least min_idle_ms, they are delivered to this consumer"""
+        observations = []
+        for stream_key in self.stream_keys:
+            start_id = "0-0"
+            while len(observations) < count:
+                response = self.db.xautoclaim(
+                    stream_key,
+                    self.group,
+                    self.consumer,
+                    min_idle_time=min_idle_ms,
+                    start_id=start_id,
+                    count=count - len(observations),
+                )
+                start_id, messages = response[0], response[1]
+                observations.extend(self._parse_entries(stream_key, messages))
+                if start_id in (b"0-0", "0-0"):
+                    break
+        return observations
+
+    def get_pending_counts(self) -> Dict[str, int]:
+        """The number of pending (delivered but not acknowledged) observations of every consumer of the group over all the streams"""
+        pipe = self.db.pipeline(transaction=False)
+        for stream_key in self.stream_keys:
+            pipe.xpending(stream_key, self.group)
+        pending_counts: Dict[str, int] = {}
+        for pending in pipe.execute(raise_on_error=False):
+            if isinstance(pending, ResponseError):
+                # The stream was trimmed away and deleted
+                continue
+            for consumer in pending["consumers"]:
+                name = consumer["name"].decode("utf-8")
+                pending_counts[name] = pending_counts.get(name, 0) + consumer["pending"]
+        return pending_counts
@@ -0,0 +1,359 @@
+"""
+Push of live air traffic to clients as server-sent events.
+
+A client subscribes with a view port and receives deltas: the observations of aircraft that are new or have changed in the view port and the addresses of aircraft that have left it or are no longer reporting. Every process runs a single reader (LiveTrafficHub) that tails the observation stream(s) and fans the changes out to all of its subscribers, a slow subscriber gets its pending changes coalesced instead of queued.
+
+The events are served by LiveTrafficApplication, which wraps the Django ASGI application in flight_blender/asgi.py.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import time
+from dataclasses import asdict
+from os import environ as env
+from typing import Dict, Iterable, List, Optional
+
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from dotenv import find_dotenv, load_dotenv
+
+from auth_helper.common import get_walrus_database
+
+from . import flight_stream_helper
+from .data_definitions import SingleAirtrafficObservation
+from .observation_encoding import decode_stream_entry
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+LIVE_AIR_TRAFFIC_PATH = "/flight_stream/live_air_traffic"
+# Maximum number of entries read from the streams at a time and how long a read blocks in ms
+LIVE_TRAFFIC_READ_COUNT = 1000
+LIVE_TRAFFIC_READ_BLOCK_MS = 1000
+# How often the shards to read are refreshed when the observations are sharded
+LIVE_TRAFFIC_SHARD_REFRESH_SECS = 5
+# A comment is sent to idle subscribers so that proxies keep the connection open
+LIVE_TRAFFIC_KEEPALIVE_SECS = 15
+
+
+def get_async_redis() -> redis.asyncio.Redis:
+    redis_host = env.get("REDIS_HOST", "redis")
+    redis_port = env.get("REDIS_PORT", 6379)
+    redis_password = env.get("REDIS_PASSWORD", None)
+
+    if redis_password:
+        return redis.asyncio.Redis(
+            host=redis_host, port=redis_port, password=redis_password
+        )
+    return redis.asyncio.Redis(host=redis_host, port=redis_port)
+
+
+class LiveAircraft:
+    """The latest observation of an aircraft as it is sent to subscribers"""
+
+    __slots__ = ("observation", "lat", "lng", "timestamp_ms")
+
+    def __init__(self, observation: dict, lat: float, lng: float, timestamp_ms: int):
+        self.observation = observation
+        self.lat = lat
+        self.lng = lng
+        self.timestamp_ms = timestamp_ms
+
+
+def get_live_aircraft(
+    observation: dict, metadata: dict, timestamp_ms: int
+) -> Optional[LiveAircraft]:
+    """Convert a decoded observation to the form of get_air_traffic, None if it has no position"""
+    try:
+        lat = float(observation["lat_dd"])
+        lng = float(observation["lon_dd"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    so = SingleAirtrafficObservation(
+        lat_dd=observation["lat_dd"],
+        lon_dd=observation["lon_dd"],
+        altitude_mm=observation["altitude_mm"],
+        traffic_source=observation["traffic_source"],
+        source_type=observation["source_type"],
+        icao_address=observation["icao_address"],
+        metadata=metadata,
+    )
+    return LiveAircraft(
+        observation=asdict(so), lat=lat, lng=lng, timestamp_ms=timestamp_ms
+    )
+
+
+class LiveTrafficSubscription:
+    """The view port of a subscriber, the aircraft it currently sees and the changes that have not been sent yet"""
+
+    def __init__(self, view_port: List[float]):
+        self.lat_min = min(view_port[0], view_port[2])
+        self.lat_max = max(view_port[0], view_port[2])
+        self.lng_min = min(view_port[1], view_port[3])
+        self.lng_max = max(view_port[1], view_port[3])
+        self.visible = set()
+        self.pending_updates: Dict[str, dict] = {}
+        self.pending_removals = set()
+        self.changed = asyncio.Event()
+
+    def contains(self, aircraft: LiveAircraft) -> bool:
+        return (
+            self.lat_min <= aircraft.lat <= self.lat_max
+            and self.lng_min <= aircraft.lng <= self.lng_max
+        )
+
+    def _remove(self, address: str):
+        if address in self.visible:
+            self.visible.discard(address)
+            self.pending_updates.pop(address, None)
+            self.pending_removals.add(address)
+
+    def push(self, updated: Dict[str, LiveAircraft], removed: Iterable[str]):
+        for address, aircraft in updated.items():
+            if self.contains(aircraft):
+                self.visible.add(address)
+                self.pending_updates[address] = aircraft.observation
+                self.pending_removals.discard(address)
+            else:
+                self._remove(address)
+        for address in removed:
+            self._remove(address)
+        if self.pending_updates or self.pending_removals:
+            self.changed.set()
+
+    def pop_delta(self) -> dict:
+        delta = {
+            "observations": list(self.pending_updates.values()),
+            "removed": sorted(self.pending_removals),
+        }
+        self.pending_updates = {}
+        self.pending_removals = set()
+        self.changed.clear()
+        return delta
+
+
+class LiveTrafficHub:
+    """A single reader of the observation stream(s) per process that pushes changes to every subscription"""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.aircraft: Dict[str, LiveAircraft] = {}
+        self.reader_task = None
+        self.loop = None
+        self.ready = None
+
+    async def subscribe(self, view_port: List[float]) -> LiveTrafficSubscription:
+        self._start()
+        await self.ready.wait()
+        subscription = LiveTrafficSubscription(view_port=view_port)
+        # The first delta is every aircraft currently in the view port
+        subscription.push(updated=self.aircraft, removed=[])
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LiveTrafficSubscription):
+        self.subscriptions.discard(subscription)
+
+    def _start(self):
+        if self.reader_task is not None and not self.reader_task.done():
+            return
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        self.reader_task = self.loop.create_task(self._read())
+
+    def _dispatch(self, updated: Dict[str, LiveAircraft], removed: List[str]):
+        if not updated and not removed:
+            return
+        for subscription in self.subscriptions:
+            subscription.push(updated=updated, removed=removed)
+
+    def _remove_stale_aircraft(self, max_age_secs: int) -> List[str]:
+        oldest_allowed_ms = (time.time() - max_age_secs) * 1000
+        stale = [
+            address
+            for address, aircraft in self.aircraft.items()
+            if aircraft.timestamp_ms < oldest_allowed_ms
+        ]
+        for address in stale:
+            del self.aircraft[address]
+        return stale
+
+    async def _load_latest_observations(self):
+        latest_observations = await sync_to_async(
+            flight_stream_helper.ObservationReadOperations().get_latest_observations,
+            thread_sensitive=False,
+        )()
+        for latest_observation in latest_observations:
+            aircraft = get_live_aircraft(
+                observation=latest_observation["msg_data"],
+                metadata=latest_observation["metadata"],
+                timestamp_ms=int(latest_observation["timestamp"].timestamp() * 1000),
+            )
+            if aircraft is not None:
+                self.aircraft[latest_observation["address"]] = aircraft
+
+    async def _get_stream_keys(self) -> List[str]:
+        db = get_walrus_database()
+        all_shard_keys = await sync_to_async(
+            flight_stream_helper.get_active_shard_keys, thread_sensitive=False
+        )(db=db)
+        return [keys.stream for keys in all_shard_keys]
+
+    async def _read(self):
+        db = get_async_redis()
+        max_age_secs = flight_stream_helper.get_latest_observations_max_age()
+        # Entries written while the latest observations are loaded are read again, applying them twice is harmless
+        start_id = "%d-0" % int(time.time() * 1000)
+        try:
+            await self._load_latest_observations()
+        except Exception as e:
+            logger.error("Could not load the latest observations %s" % e)
+        self.ready.set()
+
+        last_ids = {}
+        stream_keys_refreshed = 0
+        while True:
+            try:
+                if (
+                    time.monotonic() - stream_keys_refreshed
+                    > LIVE_TRAFFIC_SHARD_REFRESH_SECS
+                ):
+                    last_ids = {
+                        stream_key: last_ids.get(stream_key, start_id)
+                        for stream_key in await self._get_stream_keys()
+                    }
+                    stream_keys_refreshed = time.monotonic()
+                if last_ids:
+                    streams = await db.xread(
+                        last_ids,
+                        count=LIVE_TRAFFIC_READ_COUNT,
+                        block=LIVE_TRAFFIC_READ_BLOCK_MS,
+                    )
+                else:
+                    await asyncio.sleep(LIVE_TRAFFIC_READ_BLOCK_MS / 1000)
+                    streams = []
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error reading live traffic %s" % e)
+                await asyncio.sleep(LIVE_TRAFFIC_READ_BLOCK_MS / 1000)
+                continue
+
+            updated = {}
+            for stream_key, messages in streams:
+                for message_id, fields in messages:
+                    last_ids[stream_key.decode("utf-8")] = message_id.decode("utf-8")
+                    observation = decode_stream_entry(fields)
+                    if observation is None:
+                        continue
+                    aircraft = get_live_aircraft(
+                        observation=observation,
+                        metadata=json.loads(observation["metadata"]),
+                        timestamp_ms=int(message_id.split(b"-")[0]),
+                    )
+                    if aircraft is not None:
+                        updated[observation["icao_address"]] = aircraft
+            self.aircraft.update(updated)
+            removed = self._remove_stale_aircraft(max_age_secs=max_age_secs)
+            self._dispatch(updated=updated, removed=removed)
+
+
+_live_traffic_hub: Optional[LiveTrafficHub] = None
+
+
+def get_live_traffic_hub() -> LiveTrafficHub:
+    """The hub of this process (and event loop)"""
+    global _live_traffic_hub
+    running_loop = asyncio.get_running_loop()
+    if _live_traffic_hub is None or _live_traffic_hub.loop not in (None, running_loop):
+        _live_traffic_hub = LiveTrafficHub()
+    return _live_traffic_hub
+
+
+async def live_traffic_events(
+    subscription: LiveTrafficSubscription,
+    keepalive_secs: float = LIVE_TRAFFIC_KEEPALIVE_SECS,
+):
+    """Server-sent events of the deltas of a subscription"""
+    while True:
+        try:
+            await asyncio.wait_for(subscription.changed.wait(), timeout=keepalive_secs)
+        except asyncio.TimeoutError:
+            yield b": keepalive\n\n"
+            continue
+        yield (
+            "event: delta\ndata: %s\n\n" % json.dumps(subscription.pop_delta())
+        ).encode("utf-8")
+
+
+class LiveTrafficApplication:
+    """
+    An ASGI application that serves live air traffic at LIVE_AIR_TRAFFIC_PATH (?view=lat1,lng1,lat2,lng2) and passes every other request to the Django application. The request is authorized and validated by a Django view before the events are streamed until the client disconnects.
+    """
+
+    def __init__(self, django_application):
+        self.django_application = django_application
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != LIVE_AIR_TRAFFIC_PATH:
+            return await self.django_application(scope, receive, send)
+
+        from django.core.handlers.asgi import ASGIRequest
+
+        from flight_feed_operations.views import authorize_live_air_traffic
+
+        request = ASGIRequest(scope, io.BytesIO())
+        response = await sync_to_async(authorize_live_air_traffic)(request)
+        if response.status_code != 200:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": [
+                        (name.encode("latin-1"), value.encode("latin-1"))
+                        for name, value in response.items()
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": response.content})
+            return
+
+        hub = get_live_traffic_hub()
+        subscription = await hub.subscribe(
+            view_port=json.loads(response.content)["view_port"]
+        )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            }
+        )
+
+        async def stream_events():
+            async for event in live_traffic_events(subscription):
+                await send(
+                    {"type": "http.response.body", "body": event, "more_body": True}
+                )
+
+        async def wait_for_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        stream_task = asyncio.ensure_future(stream_events())
+        disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            await asyncio.wait(
+                [stream_task, disconnect_task], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            hub.unsubscribe(subscription)
+            for task in [stream_task, disconnect_task]:
+                task.cancel()
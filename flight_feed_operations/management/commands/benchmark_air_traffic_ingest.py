@@ -0,0 +1,88 @@
+import json
+import logging
+import time
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand
+from dotenv import find_dotenv, load_dotenv
+
+from flight_feed_operations import flight_stream_helper
+from flight_feed_operations.data_definitions import SingleAirtrafficObservation
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+
+class Command(BaseCommand):
+    help = "Measures the observations / second that can be written to the observation stream, one observation at a time versus a single pipelined batch per request"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--observations",
+            dest="observations",
+            type=int,
+            default=500,
+            help="Number of observations in a single request",
+        )
+        parser.add_argument(
+            "-r",
+            "--rounds",
+            dest="rounds",
+            type=int,
+            default=5,
+            help="Number of requests to simulate for each mode",
+        )
+
+    def generate_observations(self, observation_count: int):
+        all_observations = []
+        for i in range(observation_count):
+            so = SingleAirtrafficObservation(
+                lat_dd=46.97 + (i % 100) * 0.001,
+                lon_dd=7.47 + (i % 100) * 0.001,
+                altitude_mm=120000,
+                traffic_source=9,
+                source_type=0,
+                icao_address="benchmark-" + str(i % 50),
+                metadata=json.dumps({"aircraft_type": "Helicopter"}),
+            )
+            all_observations.append(asdict(so))
+        return all_observations
+
+    def write_one_at_a_time(self, observations):
+        # This is the per observation path: a new connection, one XADD and a trim for every observation
+        for observation in observations:
+            my_stream_ops = flight_stream_helper.StreamHelperOps()
+            cg = my_stream_ops.get_pull_cg()
+            cg.all_observations.add(observation)
+            cg.all_observations.trim(1000)
+
+    def write_bulk(self, observations):
+        my_observation_writer = flight_stream_helper.ObservationWriteOperations()
+        my_observation_writer.write_observations(observations)
+
+    def handle(self, *args, **options):
+        observation_count = options["observations"]
+        rounds = options["rounds"]
+        observations = self.generate_observations(observation_count)
+        self.stdout.write(
+            "{rounds} requests of {observation_count} observations".format(
+                rounds=rounds, observation_count=observation_count
+            )
+        )
+
+        for mode, writer in [
+            ("one observation at a time", self.write_one_at_a_time),
+            ("bulk pipeline", self.write_bulk),
+        ]:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                writer(observations)
+            elapsed = time.perf_counter() - start
+            observations_per_second = (observation_count * rounds) / elapsed
+            self.stdout.write(
+                "{mode}: {elapsed:.3f} s, {ops:.0f} observations / sec".format(
+                    mode=mode, elapsed=elapsed, ops=observations_per_second
+                )
+            )
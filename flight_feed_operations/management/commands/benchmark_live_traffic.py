@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand
+from dotenv import find_dotenv, load_dotenv
+
+from flight_feed_operations import flight_stream_helper
+from flight_feed_operations.data_definitions import SingleAirtrafficObservation
+from flight_feed_operations.live_traffic import LiveTrafficHub, live_traffic_events
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+
+class Command(BaseCommand):
+    help = "Measures how many concurrent live traffic subscribers a single process can serve: aircraft report once per second and every subscriber watches a random view port, the delay from writing an observation to a subscriber receiving it is reported"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--subscribers",
+            dest="subscribers",
+            type=str,
+            default="100,500,1000,2000",
+            help="Comma separated numbers of concurrent subscribers to test",
+        )
+        parser.add_argument(
+            "-a",
+            "--aircraft",
+            dest="aircraft",
+            type=int,
+            default=300,
+            help="Number of aircraft reporting once per second",
+        )
+        parser.add_argument(
+            "-d",
+            "--duration",
+            dest="duration",
+            type=int,
+            default=10,
+            help="Duration of each test in seconds",
+        )
+
+    def generate_observations(self, aircraft_count: int):
+        sent_at = time.time()
+        all_observations = []
+        for i in range(aircraft_count):
+            so = SingleAirtrafficObservation(
+                lat_dd=46.5 + random.random(),
+                lon_dd=7.0 + random.random(),
+                altitude_mm=120000,
+                traffic_source=9,
+                source_type=0,
+                icao_address="benchmark-" + str(i),
+                metadata=json.dumps({"sent_at": sent_at}),
+            )
+            all_observations.append(asdict(so))
+        return all_observations
+
+    def percentile(self, values, percentile: float) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentile))]
+
+    async def subscriber(self, hub: LiveTrafficHub, delays: list):
+        lat = 46.5 + random.random() * 0.8
+        lng = 7.0 + random.random() * 0.8
+        subscription = await hub.subscribe(view_port=[lat, lng, lat + 0.2, lng + 0.2])
+        try:
+            async for event in live_traffic_events(subscription):
+                received_at = time.time()
+                delta = json.loads(event.decode("utf-8").split("data: ", 1)[1])
+                for observation in delta["observations"]:
+                    delays.append(received_at - observation["metadata"]["sent_at"])
+        finally:
+            hub.unsubscribe(subscription)
+
+    async def run(self, subscriber_count: int, aircraft_count: int, duration: int):
+        hub = LiveTrafficHub()
+        delays = []
+        subscribers = [
+            asyncio.ensure_future(self.subscriber(hub, delays))
+            for _ in range(subscriber_count)
+        ]
+        # Skip the first delta with the aircraft already in the view port
+        await asyncio.sleep(1)
+        delays.clear()
+
+        my_observation_writer = flight_stream_helper.ObservationWriteOperations()
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            tick_start = time.perf_counter()
+            observations = self.generate_observations(aircraft_count)
+            await loop.run_in_executor(
+                None, my_observation_writer.write_observations, observations
+            )
+            await asyncio.sleep(max(0, 1 - (time.perf_counter() - tick_start)))
+
+        for subscriber in subscribers:
+            subscriber.cancel()
+        hub.reader_task.cancel()
+        return delays
+
+    def handle(self, *args, **options):
+        aircraft_count = options["aircraft"]
+        duration = options["duration"]
+        for subscriber_count in [int(s) for s in options["subscribers"].split(",")]:
+            delays = asyncio.run(self.run(subscriber_count, aircraft_count, duration))
+            if not delays:
+                self.stdout.write(
+                    "{subscriber_count} subscribers: no observations received".format(
+                        subscriber_count=subscriber_count
+                    )
+                )
+                continue
+            self.stdout.write(
+                "{subscriber_count} subscribers: {deliveries} observations delivered, delay p50 {p50:.0f} ms, p99 {p99:.0f} ms".format(
+                    subscriber_count=subscriber_count,
+                    deliveries=len(delays),
+                    p50=self.percentile(delays, 0.5) * 1000,
+                    p99=self.percentile(delays, 0.99) * 1000,
+                )
+            )
@@ -0,0 +1,113 @@
+import json
+import logging
+import time
+from dataclasses import asdict
+from os.path import abspath, dirname, join
+
+from django.core.management.base import BaseCommand
+from dotenv import find_dotenv, load_dotenv
+
+from flight_feed_operations import flight_stream_helper
+from flight_feed_operations.data_definitions import SingleRIDObservation
+from flight_feed_operations.observation_encoding import (
+    OBSERVATION_ENCODINGS,
+    decode_stream_entry,
+    encode_observation,
+)
+from rid_operations.data_definitions import SignedUnsignedTelemetryObservation
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+RID_SAMPLE_PATH = join(
+    dirname(dirname(dirname(dirname(abspath(__file__))))),
+    "importers",
+    "rid_samples",
+    "flight_1_rid_aircraft_state.json",
+)
+
+
+class Command(BaseCommand):
+    help = "Measures the bytes per stream entry and the time to decode an entry for every observation stream encoding using sample RID telemetry"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--observations",
+            dest="observations",
+            type=int,
+            default=1000,
+            help="Number of observations to write and decode for each encoding",
+        )
+
+    def generate_observations(self, observation_count: int):
+        with open(RID_SAMPLE_PATH, "r") as rid_sample_file:
+            rid_sample = json.load(rid_sample_file)
+        flight_details = rid_sample["flight_details"]["rid_details"]
+        current_states = rid_sample["current_states"]
+
+        all_observations = []
+        for i in range(observation_count):
+            current_state = current_states[i % len(current_states)]
+            observation_and_metadata = SignedUnsignedTelemetryObservation(
+                current_state=current_state, flight_details=flight_details
+            )
+            so = SingleRIDObservation(
+                lat_dd=current_state["position"]["lat"],
+                lon_dd=current_state["position"]["lng"],
+                altitude_mm=current_state["position"]["alt"],
+                traffic_source=11,
+                source_type=0,
+                icao_address="benchmark-" + str(i % 50),
+                metadata=json.dumps(asdict(observation_and_metadata)),
+            )
+            all_observations.append(asdict(so))
+        return all_observations
+
+    def handle(self, *args, **options):
+        observation_count = options["observations"]
+        observations = self.generate_observations(observation_count)
+        self.stdout.write(
+            "{observation_count} RID observations per encoding".format(
+                observation_count=observation_count
+            )
+        )
+
+        for encoding_name, encoding in OBSERVATION_ENCODINGS.items():
+            stream_key = "benchmark_observations_" + encoding_name
+            my_observation_writer = flight_stream_helper.ObservationWriteOperations(
+                stream_key=stream_key
+            )
+            my_observation_writer.encoding = encoding
+            db = my_observation_writer.db
+            db.delete(stream_key)
+            # Write in batches smaller than the stream length so that all the observations are kept
+            for batch_start in range(0, observation_count, 100):
+                my_observation_writer.write_observations(
+                    observations[batch_start : batch_start + 100]
+                )
+
+            encoded_bytes = sum(
+                len(encode_observation(observation=o, encoding=encoding)[1])
+                for o in observations
+            )
+            stream_length = db.xlen(stream_key)
+            stream_bytes = db.memory_usage(stream_key, samples=0)
+            entries = db.xrange(stream_key)
+
+            start = time.perf_counter()
+            for _, fields in entries:
+                observation = decode_stream_entry(fields)
+                json.loads(observation["metadata"])
+            decode_elapsed = time.perf_counter() - start
+            db.delete(stream_key)
+
+            self.stdout.write(
+                "{encoding_name}: {encoded:.0f} bytes / observation encoded, {stored:.0f} bytes / entry in the stream, {decode:.1f} us / entry to decode".format(
+                    encoding_name=encoding_name,
+                    encoded=encoded_bytes / observation_count,
+                    stored=stream_bytes / stream_length,
+                    decode=decode_elapsed / len(entries) * 1e6,
+                )
+            )
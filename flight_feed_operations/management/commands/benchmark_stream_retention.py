@@ -0,0 +1,143 @@
+import json
+import logging
+import time
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand
+from dotenv import find_dotenv, load_dotenv
+
+from flight_feed_operations import flight_stream_helper
+from flight_feed_operations.data_definitions import SingleAirtrafficObservation
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+
+class Command(BaseCommand):
+    help = "Writes a sustained load of observations (every aircraft reports once per tick) and reports the stream length, memory and write latency under the configured retention policy"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-a",
+            "--aircraft",
+            dest="aircraft",
+            type=int,
+            default=300,
+            help="Number of aircraft reporting",
+        )
+        parser.add_argument(
+            "-t",
+            "--tick",
+            dest="tick",
+            type=float,
+            default=1.0,
+            help="Seconds between two reports of an aircraft",
+        )
+        parser.add_argument(
+            "-d",
+            "--duration",
+            dest="duration",
+            type=int,
+            default=60,
+            help="Duration of the load test in seconds",
+        )
+        parser.add_argument(
+            "-s",
+            "--stream",
+            dest="stream_key",
+            type=str,
+            default="benchmark_observations",
+            help="The stream to write to, it is deleted before and after the test",
+        )
+
+    def generate_observations(self, aircraft_count: int, tick_count: int):
+        all_observations = []
+        for i in range(aircraft_count):
+            so = SingleAirtrafficObservation(
+                lat_dd=46.97 + (i % 100) * 0.001 + tick_count * 0.0001,
+                lon_dd=7.47 + (i // 100) * 0.001,
+                altitude_mm=120000,
+                traffic_source=9,
+                source_type=0,
+                icao_address="benchmark-" + str(i),
+                metadata=json.dumps({"aircraft_type": "Helicopter"}),
+            )
+            all_observations.append(asdict(so))
+        return all_observations
+
+    def percentile(self, values, percentile: float) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentile))]
+
+    def handle(self, *args, **options):
+        aircraft_count = options["aircraft"]
+        tick = options["tick"]
+        duration = options["duration"]
+        stream_key = options["stream_key"]
+
+        my_observation_writer = flight_stream_helper.ObservationWriteOperations(
+            stream_key=stream_key
+        )
+        # The retention is measured on a single stream
+        my_observation_writer.sharded = False
+        db = my_observation_writer.db
+        benchmark_keys = [
+            stream_key,
+            flight_stream_helper.AIRCRAFT_RECENT_STREAM_IDS_KEY.format(
+                stream_key=stream_key
+            ),
+            flight_stream_helper.AIRCRAFT_RETENTION_FLOOR_KEY.format(
+                stream_key=stream_key
+            ),
+        ]
+        db.delete(*benchmark_keys)
+        self.stdout.write(
+            "{aircraft_count} aircraft every {tick} s for {duration} s, retention: {policy}".format(
+                aircraft_count=aircraft_count,
+                tick=tick,
+                duration=duration,
+                policy=asdict(my_observation_writer.retention_policy),
+            )
+        )
+
+        write_latencies = []
+        tick_count = 0
+        start = time.perf_counter()
+        next_report = start
+        while time.perf_counter() - start < duration:
+            tick_start = time.perf_counter()
+            observations = self.generate_observations(aircraft_count, tick_count)
+            write_start = time.perf_counter()
+            my_observation_writer.write_observations(observations)
+            write_latencies.append((time.perf_counter() - write_start) * 1000)
+            tick_count += 1
+
+            if tick_start >= next_report:
+                self.stdout.write(
+                    "{elapsed:.0f} s: {length} entries, {memory:.1f} MB stream, {used_memory} used by Redis".format(
+                        elapsed=tick_start - start,
+                        length=db.xlen(stream_key),
+                        memory=db.memory_usage(stream_key, samples=0) / 1e6,
+                        used_memory=db.info("memory")["used_memory_human"],
+                    )
+                )
+                next_report += 10
+            time.sleep(max(0, tick - (time.perf_counter() - tick_start)))
+
+        self.stdout.write(
+            "{writes} batch writes of {aircraft_count} observations, latency p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {max:.2f} ms".format(
+                writes=len(write_latencies),
+                aircraft_count=aircraft_count,
+                p50=self.percentile(write_latencies, 0.5),
+                p99=self.percentile(write_latencies, 0.99),
+                max=max(write_latencies),
+            )
+        )
+        self.stdout.write(
+            "final: {length} entries, {memory:.1f} MB stream".format(
+                length=db.xlen(stream_key),
+                memory=db.memory_usage(stream_key, samples=0) / 1e6,
+            )
+        )
+        db.delete(*benchmark_keys)
@@ -0,0 +1,160 @@
+import io
+import json
+import logging
+import time
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand
+from dotenv import find_dotenv, load_dotenv
+from rest_framework.parsers import JSONParser
+
+from encoders import DateTimeEncoder
+from flight_feed_operations.rid_telemetry_helper import (
+    NestedDict,
+    current_state_json_to_object,
+    flight_detail_json_to_object,
+)
+from flight_feed_operations.serializers import TelemetryRequestSerializer
+from flight_feed_operations.telemetry_decoder import decode_telemetry_request
+from rid_operations.data_definitions import SignedUnSignedTelemetryObservations
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+
+class Command(BaseCommand):
+    help = "Measures the time to parse and validate a telemetry request (set_telemetry) per observation, with the serializer and JSON round-trips and with the single pass decoder"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-n",
+            "--observations",
+            dest="observations",
+            type=int,
+            default=100,
+            help="Number of observations in a request",
+        )
+        parser.add_argument(
+            "-r",
+            "--rounds",
+            dest="rounds",
+            type=int,
+            default=20,
+            help="Number of requests to parse",
+        )
+
+    def generate_request_body(self, observation_count: int) -> bytes:
+        observations = []
+        for i in range(observation_count):
+            observations.append(
+                {
+                    "current_states": [
+                        {
+                            "timestamp": {
+                                "value": "2023-04-12T23:20:%02d.52Z" % (i % 60),
+                                "format": "RFC3339",
+                            },
+                            "timestamp_accuracy": 0,
+                            "operational_status": "Airborne",
+                            "position": {
+                                "lat": 46.97 + i * 0.0001,
+                                "lng": 7.47,
+                                "alt": 1321.2,
+                                "accuracy_h": "HAUnknown",
+                                "accuracy_v": "VAUnknown",
+                                "extrapolated": False,
+                                "pressure_altitude": 0,
+                            },
+                            "track": 0,
+                            "speed": 1.9,
+                            "speed_accuracy": "SAUnknown",
+                            "vertical_speed": 0.2,
+                            "height": {"distance": 0, "reference": "TakeoffLocation"},
+                        }
+                    ],
+                    "flight_details": {
+                        "rid_details": {
+                            "id": "a3423b-213401-0023",
+                            "operator_id": "N.OP123456",
+                            "operation_description": "Survey",
+                        },
+                        "eu_classification": {
+                            "category": "EUCategoryUndefined",
+                            "class": "EUClassUndefined",
+                        },
+                        "uas_id": {
+                            "serial_number": "INTCJ123-4567-890",
+                            "registration_id": "N.123456",
+                            "utm_id": "ae1fa066-6d68-4018-8274-af867966978e",
+                        },
+                        "operator_location": {
+                            "position": {"lng": 7.47, "lat": 46.97},
+                            "altitude": 19.5,
+                            "altitude_type": "Takeoff",
+                        },
+                        "auth_data": {"format": "string", "data": 34},
+                        "serial_number": "INTCJ123-4567-890",
+                        "registration_number": "FA12345897",
+                    },
+                }
+            )
+        return json.dumps({"observations": observations}).encode("utf-8")
+
+    def parse_with_serializer(self, body: bytes):
+        # The previous path of set_telemetry
+        json_payload = JSONParser().parse(io.BytesIO(body))
+        serializer = TelemetryRequestSerializer(data=json_payload)
+        serializer.is_valid()
+        telemetry_request = serializer.create(serializer.validated_data)
+        all_observations = []
+        for observation in telemetry_request.observations:
+            flight_details = flight_detail_json_to_object(
+                json.loads(json.dumps(observation["flight_details"]))
+            )
+            current_states = [
+                current_state_json_to_object(state)
+                for state in json.loads(
+                    json.dumps(observation["current_states"], cls=DateTimeEncoder)
+                )
+            ]
+            all_observations.append(
+                asdict(
+                    SignedUnSignedTelemetryObservations(
+                        current_states=current_states, flight_details=flight_details
+                    ),
+                    dict_factory=NestedDict,
+                )
+            )
+        return all_observations
+
+    def parse_with_decoder(self, body: bytes):
+        observations, _ = decode_telemetry_request(body)
+        return [asdict(o, dict_factory=NestedDict) for o in observations]
+
+    def handle(self, *args, **options):
+        observation_count = options["observations"]
+        rounds = options["rounds"]
+        body = self.generate_request_body(observation_count)
+        self.stdout.write(
+            "{rounds} requests of {observation_count} observations".format(
+                rounds=rounds, observation_count=observation_count
+            )
+        )
+        results = {}
+        for mode, parse in [
+            ("serializer", self.parse_with_serializer),
+            ("single pass decoder", self.parse_with_decoder),
+        ]:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                results[mode] = parse(body)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                "{mode}: {per_observation:.1f} us per observation".format(
+                    mode=mode,
+                    per_observation=elapsed / (rounds * observation_count) * 1e6,
+                )
+            )
+        if results["serializer"] != results["single pass decoder"]:
+            self.stdout.write("The decoded observations differ")
@@ -0,0 +1,393 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from dotenv import find_dotenv, load_dotenv
+
+from auth_helper.dummy_oauth_infrastructure.dummy_oauth import NoAuth
+from flight_feed_operations import flight_stream_helper
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+ENDPOINTS = ["set_telemetry", "set_air_traffic"]
+RID_SAMPLE_PATH = os.path.join(
+    "importers", "rid_samples", "flight_1_rid_aircraft_state.json"
+)
+AIR_TRAFFIC_SAMPLE_PATH = os.path.join(
+    "importers", "air_traffic_samples", "micro_flight_data.json"
+)
+# Every aircraft replays a sample track moved by this many degrees of latitude from the previous one
+AIRCRAFT_LAT_OFFSET_DD = 0.001
+
+
+def get_position_key(address: str, lat_dd) -> Tuple[str, float]:
+    # Positions are sent with six decimals so that they can be matched in the stream whatever the encoding
+    return address, round(float(lat_dd), 6)
+
+
+class Command(BaseCommand):
+    help = "Replays the sample RID telemetry and air traffic against set_telemetry and set_air_traffic of a running instance at a fixed rate of requests, using a NoAuth token, and reports the ingest (request) latency, the delay from a request to its observations being written to the observation stream and from the stream write to a consumer reading them, and the throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-u",
+            "--url",
+            dest="url",
+            type=str,
+            default="http://localhost:8000",
+            help="Base URL of the instance",
+        )
+        parser.add_argument(
+            "-e",
+            "--endpoints",
+            dest="endpoints",
+            type=str,
+            default=",".join(ENDPOINTS),
+            help="Comma separated endpoints to send requests to, in turn",
+        )
+        parser.add_argument(
+            "-a",
+            "--aircraft",
+            dest="aircraft",
+            type=int,
+            default=20,
+            help="Number of aircraft reporting on every endpoint",
+        )
+        parser.add_argument(
+            "-b",
+            "--batch",
+            dest="batch",
+            type=int,
+            default=1,
+            help="Number of observations (of different aircraft) in a request",
+        )
+        parser.add_argument(
+            "-r",
+            "--rate",
+            dest="rate",
+            type=float,
+            default=10,
+            help="Requests per second",
+        )
+        parser.add_argument(
+            "-d",
+            "--duration",
+            dest="duration",
+            type=int,
+            default=30,
+            help="Duration of the test in seconds",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            dest="workers",
+            type=int,
+            default=16,
+            help="Number of requests in flight at the same time",
+        )
+        parser.add_argument(
+            "--drain",
+            dest="drain",
+            type=int,
+            default=10,
+            help="Seconds to wait for observations to appear in the stream after the last request",
+        )
+        parser.add_argument(
+            "--audience",
+            dest="audience",
+            type=str,
+            default="testflight.flightblender.com",
+            help="Audience of the NoAuth token",
+        )
+
+    def load_sample(self, path: str):
+        with open(os.path.join(settings.BASE_DIR, path), "r") as sample_file:
+            return json.load(sample_file)
+
+    def load_tracks(self):
+        """The sample RID states and the sample air traffic positions grouped by aircraft"""
+        rid_sample = self.load_sample(RID_SAMPLE_PATH)
+        air_traffic_tracks: Dict[str, list] = {}
+        for reading in sorted(
+            self.load_sample(AIR_TRAFFIC_SAMPLE_PATH), key=lambda r: r["timestamp"]
+        ):
+            air_traffic_tracks.setdefault(reading["icao_address"], []).append(reading)
+        return rid_sample, list(air_traffic_tracks.values())
+
+    def get_rid_flight_details(self, rid_sample: dict, aircraft: int) -> dict:
+        # The sample has the details of an older version of the API, they are sent in the current shape
+        rid_details = rid_sample["flight_details"]["rid_details"]
+        serial_number = "load-test-rid-{aircraft}".format(aircraft=aircraft)
+        return {
+            "rid_details": {
+                "id": str(uuid.uuid5(uuid.NAMESPACE_URL, serial_number)),
+                "operator_id": rid_details["operator_id"],
+                "operation_description": rid_details["operation_description"],
+            },
+            "eu_classification": rid_details["eu_classification"],
+            "uas_id": dict(rid_details["uas_id"], serial_number=serial_number),
+            "operator_location": {
+                "position": rid_details["operator_location"]["position"],
+                "altitude": 0,
+                "altitude_type": "Takeoff",
+            },
+            "auth_data": {"format": "string", "data": 0},
+            "serial_number": serial_number,
+            "registration_number": rid_details["uas_id"]["registration_id"],
+        }
+
+    def get_rid_observation(self, rid_sample: dict, aircraft: int, step: int):
+        states = rid_sample["current_states"]
+        state = json.loads(json.dumps(states[step % len(states)]))
+        state["timestamp"]["value"] = datetime.now(timezone.utc).isoformat()
+        state["position"]["lat"] = round(
+            state["position"]["lat"] + aircraft * AIRCRAFT_LAT_OFFSET_DD, 6
+        )
+        flight_details = self.get_rid_flight_details(rid_sample, aircraft)
+        observation = {"current_states": [state], "flight_details": flight_details}
+        return observation, get_position_key(
+            flight_details["uas_id"]["serial_number"], state["position"]["lat"]
+        )
+
+    def get_air_traffic_observation(self, tracks: list, aircraft: int, step: int):
+        track = tracks[aircraft % len(tracks)]
+        reading = track[step % len(track)]
+        observation = {
+            "icao_address": "load-test-{aircraft}".format(aircraft=aircraft),
+            "traffic_source": reading["traffic_source"],
+            "source_type": reading["source_type"],
+            "lat_dd": round(reading["lat_dd"] + aircraft * AIRCRAFT_LAT_OFFSET_DD, 6),
+            "lon_dd": reading["lon_dd"],
+            "time_stamp": int(time.time() * 1000),
+            "altitude_mm": reading["altitude_mm"],
+            "metadata": reading["metadata"],
+        }
+        return observation, get_position_key(
+            observation["icao_address"], observation["lat_dd"]
+        )
+
+    def percentile(self, values, percentile: float) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentile))]
+
+    def format_latencies(self, values: List[float]) -> str:
+        if not values:
+            return "no samples"
+        return "p50 {p50:.1f} ms, p99 {p99:.1f} ms, max {max:.1f} ms".format(
+            p50=self.percentile(values, 0.5) * 1000,
+            p99=self.percentile(values, 0.99) * 1000,
+            max=max(values) * 1000,
+        )
+
+    def send(self, endpoint: str, payload: dict, position_keys: list, scheduled_at):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        with self.lock:
+            # Registered before the request, a consumer can read the observations before the response arrives
+            for position_key in position_keys:
+                self.pending.setdefault(position_key, deque()).append(scheduled_at)
+        try:
+            response = session.request(
+                "PUT" if endpoint == "set_telemetry" else "POST",
+                self.url + "/flight_stream/" + endpoint,
+                data=json.dumps(payload),
+                headers=self.headers,
+                timeout=30,
+            )
+            accepted = response.status_code in (200, 201)
+            if not accepted:
+                logger.error(
+                    "%s returned %s: %s"
+                    % (endpoint, response.status_code, response.text[:200])
+                )
+        except requests.exceptions.RequestException as re:
+            logger.error("Error sending request to %s %s" % (endpoint, re))
+            accepted = False
+        # The latency is measured from the time the request was due, so a slow server is not hidden by requests waiting for a worker
+        latency = time.time() - scheduled_at
+        with self.lock:
+            self.request_latencies[endpoint].append(latency)
+            if accepted:
+                self.accepted_observations[endpoint] += len(position_keys)
+            else:
+                self.failed_requests[endpoint] += 1
+                for position_key in position_keys:
+                    sent_times = self.pending.get(position_key)
+                    if sent_times:
+                        sent_times.remove(scheduled_at)
+
+    def watch_stream(self, consumer: flight_stream_helper.ObservationConsumer):
+        """Read the observation stream and match the observations to the requests that sent them"""
+        while True:
+            with self.lock:
+                pending = sum(len(sent_times) for sent_times in self.pending.values())
+            if self.stop_watching.is_set() and (
+                pending == 0 or time.time() > self.drain_deadline
+            ):
+                return
+            observations = consumer.read(count=1000, block=200)
+            read_at = time.time()
+            if not observations:
+                continue
+            consumer.ack(observations)
+            with self.lock:
+                for observation in observations:
+                    position_key = get_position_key(
+                        observation["address"], observation["msg_data"]["lat_dd"]
+                    )
+                    sent_times = self.pending.get(position_key)
+                    if not sent_times:
+                        continue
+                    sent_at = sent_times.popleft()
+                    # Stream entry ids are the time (in ms) of the write on the Redis server
+                    written_at = int(observation["id"].split("-")[0]) / 1000
+                    self.request_to_write.append(written_at - sent_at)
+                    self.write_to_visible.append(read_at - written_at)
+                    self.visible_at.append(read_at)
+
+    def handle(self, *args, **options):
+        endpoints = options["endpoints"].split(",")
+        for endpoint in endpoints:
+            if endpoint not in ENDPOINTS:
+                raise CommandError(
+                    "Unknown endpoint {endpoint}, use one or more of {endpoints}".format(
+                        endpoint=endpoint, endpoints=",".join(ENDPOINTS)
+                    )
+                )
+        aircraft_count = options["aircraft"]
+        batch = min(options["batch"], aircraft_count)
+        rate = options["rate"]
+        duration = options["duration"]
+
+        self.url = options["url"].rstrip("/")
+        token = NoAuth().issue_token(options["audience"], ["blender.write"])
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + token,
+        }
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending: Dict[Tuple[str, float], deque] = {}
+        self.request_latencies: Dict[str, List[float]] = {e: [] for e in endpoints}
+        self.accepted_observations = {e: 0 for e in endpoints}
+        self.failed_requests = {e: 0 for e in endpoints}
+        self.request_to_write: List[float] = []
+        self.write_to_visible: List[float] = []
+        self.visible_at: List[float] = []
+        self.stop_watching = threading.Event()
+        self.drain_deadline = float("inf")
+
+        rid_sample, air_traffic_tracks = self.load_tracks()
+        # A consumer group of its own, it starts at the end of the stream(s)
+        consumer = flight_stream_helper.ObservationConsumer(
+            group="load-test-" + uuid.uuid4().hex[:8]
+        )
+        watcher = threading.Thread(target=self.watch_stream, args=(consumer,))
+        watcher.start()
+
+        self.stdout.write(
+            "{rate} requests / sec of {batch} observations for {duration} s to {endpoints}, {aircraft_count} aircraft per endpoint".format(
+                rate=rate,
+                batch=batch,
+                duration=duration,
+                endpoints=", ".join(endpoints),
+                aircraft_count=aircraft_count,
+            )
+        )
+        start = time.time()
+        end = start + duration
+        # The next aircraft and the number of positions sent per endpoint
+        next_aircraft = {e: 0 for e in endpoints}
+        steps = {e: 0 for e in endpoints}
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                request_number = 0
+                while True:
+                    scheduled_at = start + request_number / rate
+                    if scheduled_at >= end:
+                        break
+                    time.sleep(max(0, scheduled_at - time.time()))
+                    endpoint = endpoints[request_number % len(endpoints)]
+                    request_number += 1
+
+                    observations = []
+                    position_keys = []
+                    for _ in range(batch):
+                        aircraft = next_aircraft[endpoint]
+                        step = steps[endpoint] // aircraft_count
+                        if endpoint == "set_telemetry":
+                            observation, position_key = self.get_rid_observation(
+                                rid_sample, aircraft, step
+                            )
+                        else:
+                            observation, position_key = (
+                                self.get_air_traffic_observation(
+                                    air_traffic_tracks, aircraft, step
+                                )
+                            )
+                        observations.append(observation)
+                        position_keys.append(position_key)
+                        next_aircraft[endpoint] = (aircraft + 1) % aircraft_count
+                        steps[endpoint] += 1
+                    executor.submit(
+                        self.send,
+                        endpoint,
+                        {"observations": observations},
+                        position_keys,
+                        scheduled_at,
+                    )
+            sent_until = time.time()
+        finally:
+            self.drain_deadline = time.time() + options["drain"]
+            self.stop_watching.set()
+            watcher.join()
+            for stream_key in consumer.stream_keys:
+                consumer.db.xgroup_destroy(stream_key, consumer.group)
+
+        for endpoint in endpoints:
+            latencies = self.request_latencies[endpoint]
+            self.stdout.write(
+                "{endpoint}: {requests} requests, {failed} failed, {accepted} observations accepted, latency {latencies}".format(
+                    endpoint=endpoint,
+                    requests=len(latencies),
+                    failed=self.failed_requests[endpoint],
+                    accepted=self.accepted_observations[endpoint],
+                    latencies=self.format_latencies(latencies),
+                )
+            )
+        self.stdout.write(
+            "request to stream write: " + self.format_latencies(self.request_to_write)
+        )
+        self.stdout.write(
+            "stream write to consumer: " + self.format_latencies(self.write_to_visible)
+        )
+        requests_sent = sum(len(l) for l in self.request_latencies.values())
+        accepted = sum(self.accepted_observations.values())
+        visible_until = max(self.visible_at, default=sent_until)
+        self.stdout.write(
+            "throughput: {requests:.1f} requests / sec, {accepted:.1f} observations / sec accepted, {visible:.1f} observations / sec in the stream".format(
+                requests=requests_sent / (sent_until - start),
+                accepted=accepted / (sent_until - start),
+                visible=len(self.visible_at) / (max(visible_until, sent_until) - start),
+            )
+        )
+        not_visible = sum(len(sent_times) for sent_times in self.pending.values())
+        if not_visible:
+            self.stdout.write(
+                "{not_visible} accepted observations were not in the stream {drain} s after the last request".format(
+                    not_visible=not_visible, drain=options["drain"]
+                )
+            )
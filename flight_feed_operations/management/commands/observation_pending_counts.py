@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from flight_feed_operations import flight_stream_helper
+
+
+class Command(BaseCommand):
+    help = "Show the number of pending (delivered but not acknowledged) observations of every consumer of the observation consumer groups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-g",
+            "--groups",
+            dest="groups",
+            type=str,
+            default=",".join(flight_stream_helper.OBSERVATION_CONSUMER_GROUPS),
+            help="Comma separated names of the consumer groups",
+        )
+
+    def handle(self, *args, **options):
+        for group in options["groups"].split(","):
+            consumer = flight_stream_helper.ObservationConsumer(group=group)
+            pending_counts = consumer.get_pending_counts()
+            self.stdout.write(
+                "{group}: {pending} pending".format(
+                    group=group, pending=sum(pending_counts.values())
+                )
+            )
+            for name, pending in sorted(pending_counts.items()):
+                self.stdout.write(
+                    "  {name}: {pending}".format(name=name, pending=pending)
+                )
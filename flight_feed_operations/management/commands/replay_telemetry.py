@@ -0,0 +1,118 @@
+import arrow
+from django.core.management.base import BaseCommand, CommandError
+
+from flight_feed_operations.telemetry_replay import (
+    REPLAY_TICK_SECS,
+    TelemetryReplayer,
+    load_archive_observations,
+    load_replay_file,
+    repeat_observations,
+)
+
+
+class Command(BaseCommand):
+    help = "Replays a recording of telemetry (a file of air traffic observations or a RID test injection, or a window of the telemetry archive) through the ingest path at a multiple of the recorded speed, with the timestamps of the telemetry set to the time they are written"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-f",
+            "--file",
+            dest="file",
+            type=str,
+            help="Path of a JSON file with a list of air traffic observations or a RID test injection",
+        )
+        parser.add_argument(
+            "--archive-start",
+            dest="archive_start",
+            type=str,
+            help="Replay the archived observations from this time (ISO 8601)",
+        )
+        parser.add_argument(
+            "--archive-end",
+            dest="archive_end",
+            type=str,
+            help="Replay the archived observations until this time (ISO 8601)",
+        )
+        parser.add_argument(
+            "--view-port",
+            dest="view_port",
+            type=str,
+            help="Replay only the archived observations in this view port: lat1,lng1,lat2,lng2",
+        )
+        parser.add_argument(
+            "-x",
+            "--speed",
+            dest="speed",
+            type=float,
+            default=1,
+            help="Multiple of the recorded speed, e.g. 10 or 100",
+        )
+        parser.add_argument(
+            "-r",
+            "--repeat",
+            dest="repeat",
+            type=int,
+            default=1,
+            help="Number of times the recording is replayed back to back",
+        )
+        parser.add_argument(
+            "-t",
+            "--tick",
+            dest="tick",
+            type=float,
+            default=REPLAY_TICK_SECS,
+            help="Seconds (of the wall clock) between writes",
+        )
+        parser.add_argument(
+            "--in-process",
+            dest="in_process",
+            action="store_true",
+            help="Write the observations in this process instead of sending them to the task queue",
+        )
+
+    def handle(self, *args, **options):
+        if options["speed"] <= 0:
+            raise CommandError("The speed must be greater than zero")
+        if options["file"]:
+            observations = load_replay_file(options["file"])
+        elif options["archive_start"] and options["archive_end"]:
+            view_port = None
+            if options["view_port"]:
+                try:
+                    view_port = [float(i) for i in options["view_port"].split(",")]
+                    assert len(view_port) == 4
+                except (ValueError, AssertionError):
+                    raise CommandError(
+                        "The view port must be four numbers: lat1,lng1,lat2,lng2"
+                    )
+            observations = load_archive_observations(
+                start=arrow.get(options["archive_start"]).datetime,
+                end=arrow.get(options["archive_end"]).datetime,
+                view_port=view_port,
+            )
+        else:
+            raise CommandError(
+                "Either a file or the start and end of the archived observations is required"
+            )
+
+        observations = repeat_observations(observations, options["repeat"])
+        self.stdout.write(
+            "Replaying {count} observations at {speed:g}x".format(
+                count=len(observations), speed=options["speed"]
+            )
+        )
+        stats = TelemetryReplayer(
+            observations,
+            speed=options["speed"],
+            tick_secs=options["tick"],
+            use_task_queue=not options["in_process"],
+        ).replay()
+        self.stdout.write(
+            "Replayed {observations} observations ({recorded:.0f} s recorded) in {replayed:.1f} s with {batches} writes, the most an observation was written late: {lag:.2f} s".format(
+                observations=stats.observations,
+                recorded=stats.recorded_duration_secs,
+                replayed=stats.replay_duration_secs,
+                batches=stats.batches,
+                lag=stats.max_lag_secs,
+            )
+        )
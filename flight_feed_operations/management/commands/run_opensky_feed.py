@@ -0,0 +1,12 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from flight_feed_operations.opensky_feed import OpenSkyFeedManager
+
+
+class Command(BaseCommand):
+    help = "Run the OpenSky Network feed poller in its own process, view ports requested via start_opensky_feed are then polled here instead of in a Celery worker"
+
+    def handle(self, *args, **options):
+        asyncio.run(OpenSkyFeedManager().run())
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from flight_feed_operations.telemetry_archive import (
+    TELEMETRY_ARCHIVE_BATCH_SIZE,
+    TELEMETRY_ARCHIVE_CONSUMER_GROUP,
+    TELEMETRY_ARCHIVE_FLUSH_INTERVAL_SECS,
+    TelemetryArchiver,
+)
+
+
+class Command(BaseCommand):
+    help = "Archive the observations of the stream to columnar files (in TELEMETRY_ARCHIVE_DIR) partitioned by hour and region, run one or more archivers as separate processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-g",
+            "--group",
+            dest="group",
+            type=str,
+            default=TELEMETRY_ARCHIVE_CONSUMER_GROUP,
+            help="Name of the consumer group of the archivers",
+        )
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            dest="batch_size",
+            type=int,
+            default=TELEMETRY_ARCHIVE_BATCH_SIZE,
+            help="Maximum number of observations written at a time",
+        )
+        parser.add_argument(
+            "-i",
+            "--flush-interval",
+            dest="flush_interval",
+            type=float,
+            default=TELEMETRY_ARCHIVE_FLUSH_INTERVAL_SECS,
+            help="Seconds after which a batch is written even if it is not full",
+        )
+
+    def handle(self, *args, **options):
+        TelemetryArchiver(
+            group=options["group"],
+            batch_size=options["batch_size"],
+            flush_interval_secs=options["flush_interval"],
+        ).run()
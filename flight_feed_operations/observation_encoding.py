@@ -0,0 +1,174 @@
+"""
+Encodings of air traffic observations in the observation stream and the latest observations hash.
+
+Observations are written either as JSON (version 1, string fields, the same as the original stream entries) or in a compact binary layout (version 2). Every entry records its encoding version so that entries written with an older encoding stay readable after the setting is changed.
+"""
+
+import json
+import logging
+import struct
+import zlib
+from os import environ as env
+from typing import Dict, Optional, Tuple
+
+from dotenv import find_dotenv, load_dotenv
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+OBSERVATION_ENCODING_JSON = "1"
+OBSERVATION_ENCODING_COMPACT = "2"
+# The setting value -> the encoding version
+OBSERVATION_ENCODINGS = {
+    "json": OBSERVATION_ENCODING_JSON,
+    "compact": OBSERVATION_ENCODING_COMPACT,
+}
+# Stream fields of an encoded (non JSON) observation
+ENCODING_VERSION_FIELD = "v"
+ENCODED_OBSERVATION_FIELD = "d"
+
+# Version 2 header: lat_dd, lon_dd, altitude_mm (float64), traffic_source, source_type (uint8), which of lat_dd, lon_dd and
+# altitude_mm are integers (uint8 bit flags), length of icao_address (uint16) followed by the icao_address (UTF-8) and the
+# metadata as zlib compressed JSON
+COMPACT_OBSERVATION_HEADER = struct.Struct("<dddBBBH")
+COMPACT_FLOAT_FIELDS = ("lat_dd", "lon_dd", "altitude_mm")
+COMPACT_METADATA_COMPRESSION_LEVEL = 1
+OBSERVATION_FIELDS = (
+    "lat_dd",
+    "lon_dd",
+    "altitude_mm",
+    "traffic_source",
+    "source_type",
+    "icao_address",
+    "metadata",
+)
+
+
+def get_observation_encoding() -> str:
+    """
+    The encoding version used to write new observations, set using OBSERVATION_STREAM_ENCODING (json or compact). json is the default: compact entries take about half the memory in the stream but are slower to decode (the metadata is decompressed), so compact only pays off when the stream memory matters more than the read path
+    """
+    encoding = env.get("OBSERVATION_STREAM_ENCODING", "json")
+    if encoding not in OBSERVATION_ENCODINGS:
+        logger.warning("Unknown observation stream encoding %s, using json" % encoding)
+        encoding = "json"
+    return OBSERVATION_ENCODINGS[encoding]
+
+
+def _to_string(value) -> str:
+    # Stream values are stored as strings, convert them the same way the Redis client does
+    return value if isinstance(value, str) else str(value)
+
+
+def encode_observation_json(observation: dict) -> bytes:
+    return json.dumps(
+        {field: _to_string(value) for field, value in observation.items()}
+    ).encode("utf-8")
+
+
+def _pack_number(value) -> Tuple[float, bool]:
+    """The float to pack and whether it is formatted as an integer, so that it decodes to the same string as in JSON"""
+    value_string = _to_string(value)
+    number = float(value)
+    if number.is_integer() and str(int(number)) == value_string:
+        return number, True
+    if str(number) != value_string:
+        raise ValueError("%s is not formatted as a float" % value_string)
+    return number, False
+
+
+def encode_observation_compact(observation: dict) -> Optional[bytes]:
+    """Pack an observation in the version 2 layout, None if the observation does not fit the layout or would not decode to the same strings as in JSON"""
+    if set(observation.keys()) != set(OBSERVATION_FIELDS):
+        return None
+    try:
+        numbers = []
+        integer_flags = 0
+        for bit, field in enumerate(COMPACT_FLOAT_FIELDS):
+            number, is_integer = _pack_number(observation[field])
+            numbers.append(number)
+            integer_flags |= is_integer << bit
+        small_integers = [
+            int(observation["traffic_source"]),
+            int(observation["source_type"]),
+        ]
+        if [str(i) for i in small_integers] != [
+            _to_string(observation["traffic_source"]),
+            _to_string(observation["source_type"]),
+        ]:
+            return None
+        header = COMPACT_OBSERVATION_HEADER.pack(
+            *numbers,
+            *small_integers,
+            integer_flags,
+            len(_to_string(observation["icao_address"]).encode("utf-8")),
+        )
+    except (TypeError, ValueError, OverflowError, struct.error):
+        return None
+    metadata = observation["metadata"]
+    if not isinstance(metadata, str):
+        metadata = json.dumps(metadata)
+    return (
+        header
+        + _to_string(observation["icao_address"]).encode("utf-8")
+        + zlib.compress(metadata.encode("utf-8"), COMPACT_METADATA_COMPRESSION_LEVEL)
+    )
+
+
+def encode_observation(observation: dict, encoding: str) -> Tuple[str, bytes]:
+    """Encode an observation, returns the encoding version actually used and the encoded observation. Observations that cannot be packed in the compact layout (e.g. a non numeric altitude) are written as JSON"""
+    if encoding == OBSERVATION_ENCODING_COMPACT:
+        encoded_observation = encode_observation_compact(observation)
+        if encoded_observation is not None:
+            return OBSERVATION_ENCODING_COMPACT, encoded_observation
+    return OBSERVATION_ENCODING_JSON, encode_observation_json(observation)
+
+
+def decode_observation(encoding: str, encoded_observation: bytes) -> dict:
+    """Decode an observation to a dictionary of string fields, the same as an observation written as JSON"""
+    if encoding == OBSERVATION_ENCODING_JSON:
+        return json.loads(encoded_observation)
+    if encoding == OBSERVATION_ENCODING_COMPACT:
+        (
+            lat_dd,
+            lon_dd,
+            altitude_mm,
+            traffic_source,
+            source_type,
+            integer_flags,
+            icao_address_length,
+        ) = COMPACT_OBSERVATION_HEADER.unpack_from(encoded_observation)
+        icao_address_end = COMPACT_OBSERVATION_HEADER.size + icao_address_length
+        # Numbers are formatted the same as in JSON, integers without a fraction
+        return {
+            "lat_dd": str(int(lat_dd) if integer_flags & 1 else lat_dd),
+            "lon_dd": str(int(lon_dd) if integer_flags & 2 else lon_dd),
+            "altitude_mm": str(int(altitude_mm) if integer_flags & 4 else altitude_mm),
+            "traffic_source": str(traffic_source),
+            "source_type": str(source_type),
+            "icao_address": encoded_observation[
+                COMPACT_OBSERVATION_HEADER.size : icao_address_end
+            ].decode("utf-8"),
+            "metadata": zlib.decompress(encoded_observation[icao_address_end:]).decode(
+                "utf-8"
+            ),
+        }
+    raise ValueError("Unknown observation encoding %s" % encoding)
+
+
+def decode_stream_entry(fields: Dict[bytes, bytes]) -> Optional[dict]:
+    """Decode the fields of a stream entry in any encoding, None if the entry is not an observation (e.g. the entry added when a consumer group is created)"""
+    encoding = fields.get(ENCODING_VERSION_FIELD.encode("utf-8"))
+    if encoding is not None:
+        return decode_observation(
+            encoding.decode("utf-8"),
+            fields[ENCODED_OBSERVATION_FIELD.encode("utf-8")],
+        )
+    # Entries written as JSON are stored as string fields
+    observation = {
+        field.decode("utf-8"): value.decode("utf-8") for field, value in fields.items()
+    }
+    if "icao_address" not in observation:
+        return None
+    return observation
@@ -0,0 +1,84 @@
+"""
+Sharding of the observations by traffic source and a coarse spatial cell.
+
+Every key of a shard carries the same Redis Cluster hash tag ({observations:<traffic source>:<lat cell>:<lng cell>}) so that a shard lives on a single node and the write script can update all of it atomically. A registry of the shards written to recently lets readers fan in only the shards that a view port touches.
+"""
+
+import math
+import re
+from os import environ as env
+from typing import List, Optional
+
+from dotenv import find_dotenv, load_dotenv
+
+from .data_definitions import ObservationShardKeys
+
+load_dotenv(find_dotenv())
+
+# A sorted set of shard id -> time of the last write in ms
+OBSERVATION_SHARDS_KEY = "observation_shards"
+# A hash of aircraft id -> the shard of its latest observation
+AIRCRAFT_SHARDS_KEY = "aircraft_observation_shards"
+# The default size of a cell in degrees
+OBSERVATION_SHARD_CELL_DEGREES = 1.0
+# The cell of observations without a valid position
+NO_POSITION_CELL = "none"
+
+
+def get_observation_sharding_enabled() -> bool:
+    """Observations are sharded if OBSERVATION_STREAM_SHARDING is set to 1"""
+    return bool(int(env.get("OBSERVATION_STREAM_SHARDING", 0)))
+
+
+def get_shard_cell_degrees() -> float:
+    return float(
+        env.get("OBSERVATION_SHARD_CELL_DEGREES", OBSERVATION_SHARD_CELL_DEGREES)
+    )
+
+
+def get_shard_id(
+    traffic_source,
+    lat_dd: Optional[float],
+    lon_dd: Optional[float],
+    cell_degrees: float,
+) -> str:
+    """The shard of an observation: <traffic source>:<lat cell>:<lng cell>"""
+    # The traffic source is part of a hash tag, keep only characters that cannot end or split it
+    traffic_source = re.sub(r"[^0-9A-Za-z_-]", "_", str(traffic_source))
+    if lat_dd is None or lon_dd is None:
+        return "%s:%s" % (traffic_source, NO_POSITION_CELL)
+    return "%s:%d:%d" % (
+        traffic_source,
+        math.floor(lat_dd / cell_degrees),
+        math.floor(lon_dd / cell_degrees),
+    )
+
+
+def get_shard_keys(shard_id: str) -> ObservationShardKeys:
+    tag = "{observations:%s}" % shard_id
+    return ObservationShardKeys(
+        stream=tag + ":stream",
+        latest_observations=tag + ":latest",
+        positions=tag + ":positions",
+        last_seen=tag + ":last_seen",
+        recent_stream_ids=tag + ":recent_stream_ids",
+        retention_floor=tag + ":retention_floor",
+        recent_positions=tag + ":recent_positions",
+    )
+
+
+def shard_in_view_port(
+    shard_id: str, view_port: List[float], cell_degrees: float
+) -> bool:
+    """Check if the cell of a shard intersects a view port (lat1, lng1, lat2, lng2)"""
+    lat_cell, lng_cell = shard_id.split(":")[-2:]
+    if NO_POSITION_CELL in (lat_cell, lng_cell):
+        return False
+    cell_lat_min = int(lat_cell) * cell_degrees
+    cell_lng_min = int(lng_cell) * cell_degrees
+    return (
+        cell_lat_min <= max(view_port[0], view_port[2])
+        and cell_lat_min + cell_degrees >= min(view_port[0], view_port[2])
+        and cell_lng_min <= max(view_port[1], view_port[3])
+        and cell_lng_min + cell_degrees >= min(view_port[1], view_port[3])
+    )
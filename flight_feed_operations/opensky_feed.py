@@ -0,0 +1,281 @@
+"""
+A feed of air traffic from the OpenSky Network shared by everyone who requests it.
+
+Requests for a view port are recorded in Redis with an expiry, requesting a view port again extends its lifetime. A single poller (OpenSkyFeedManager.run) merges the active view ports into one covering query per interval, keeps the aircraft inside the requested view ports and writes them to the stream in one batch. The poller runs on asyncio, either in its own process (python manage.py run_opensky_feed) or, if no poller is running, in a Celery task that ends once no view port is active.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from dataclasses import asdict
+from functools import partial
+from os import environ as env
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import requests
+from dotenv import find_dotenv, load_dotenv
+
+from auth_helper.common import get_redis
+
+from . import flight_stream_helper
+from .data_definitions import SingleAirtrafficObservation
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+OPENSKY_STATES_URL = "https://opensky-network.org/api/states/all"
+# The columns of an OpenSky state vector
+OPENSKY_STATE_COLUMNS = [
+    "icao24",
+    "callsign",
+    "origin_country",
+    "time_position",
+    "last_contact",
+    "long",
+    "lat",
+    "baro_altitude",
+    "on_ground",
+    "velocity",
+    "true_track",
+    "vertical_rate",
+    "sensors",
+    "geo_altitude",
+    "squawk",
+    "spi",
+    "position_source",
+]
+# An aircraft whose values in these columns have not changed since the previous response is not written again until its observation is about to age out
+OPENSKY_CHANGE_COLUMNS = ["long", "lat", "baro_altitude", "velocity"]
+
+# A sorted set of requested view port -> time the request expires in ms
+OPENSKY_FEED_VIEW_PORTS_KEY = "opensky_feed_view_ports"
+# Held by the running poller, it expires if the poller stops without releasing it
+OPENSKY_FEED_POLLER_KEY = "opensky_feed_poller"
+OPENSKY_FEED_POLLER_TTL_SECS = 30
+# How long a view port is polled after it was last requested
+OPENSKY_FEED_DURATION_SECS = 60
+OPENSKY_REQUEST_TIMEOUT_SECS = 10
+
+_opensky_session = None
+
+
+def get_opensky_session() -> requests.Session:
+    """A HTTP session per process so that the connection to OpenSky is reused between requests"""
+    global _opensky_session
+    if _opensky_session is None:
+        _opensky_session = requests.Session()
+        _opensky_session.auth = (
+            env.get("OPENSKY_NETWORK_USERNAME"),
+            env.get("OPENSKY_NETWORK_PASSWORD"),
+        )
+    return _opensky_session
+
+
+def get_covering_view_port(view_ports: List[List[float]]) -> List[float]:
+    """The smallest view port (lat_min, lng_min, lat_max, lng_max) that covers all the view ports (lat1, lng1, lat2, lng2)"""
+    view_ports = np.asarray(view_ports, dtype=float)
+    lats = view_ports[:, [0, 2]]
+    lngs = view_ports[:, [1, 3]]
+    return [
+        float(lats.min()),
+        float(lngs.min()),
+        float(lats.max()),
+        float(lngs.max()),
+    ]
+
+
+def get_opensky_observations(
+    states: list,
+    previous_flight_df: Optional[pd.DataFrame] = None,
+    view_ports: Optional[List[List[float]]] = None,
+    now: Optional[float] = None,
+    rewrite_after_secs: Optional[float] = None,
+) -> Tuple[List[dict], pd.DataFrame]:
+    """
+    Convert the state vectors of an OpenSky response to observations, column by column. Aircraft outside all the view ports and aircraft whose state has not changed since the previous response are dropped, unless they were last written rewrite_after_secs ago (by default half of LATEST_OBSERVATIONS_MAX_AGE_SECS) so that a hovering or parked aircraft stays current. Returns the observations and the states, with the time they were last written, to compare the next response with
+    """
+    if now is None:
+        now = time.time()
+    if rewrite_after_secs is None:
+        rewrite_after_secs = flight_stream_helper.get_latest_observations_max_age() / 2
+    flight_df = pd.DataFrame(states, columns=OPENSKY_STATE_COLUMNS)[
+        ["icao24"] + OPENSKY_CHANGE_COLUMNS
+    ]
+    if view_ports:
+        lats = pd.to_numeric(flight_df["lat"], errors="coerce").to_numpy()
+        lngs = pd.to_numeric(flight_df["long"], errors="coerce").to_numpy()
+        in_view_ports = np.zeros(len(flight_df), dtype=bool)
+        for lat1, lng1, lat2, lng2 in view_ports:
+            in_view_ports |= (
+                (lats >= min(lat1, lat2))
+                & (lats <= max(lat1, lat2))
+                & (lngs >= min(lng1, lng2))
+                & (lngs <= max(lng1, lng2))
+            )
+        flight_df = flight_df[in_view_ports]
+    flight_df = (
+        flight_df.astype(object)
+        .where(flight_df.notna(), "No Data")
+        .drop_duplicates(subset="icao24", keep="last")
+    )
+
+    changed_df = flight_df
+    written_at = np.full(len(flight_df), now, dtype=float)
+    if previous_flight_df is not None:
+        merged_df = flight_df.merge(
+            previous_flight_df,
+            on="icao24",
+            how="left",
+            suffixes=("", "_previous"),
+            indicator=True,
+        )
+        changed = (merged_df["_merge"] == "left_only").to_numpy()
+        for column in OPENSKY_CHANGE_COLUMNS:
+            changed = (
+                changed
+                | (merged_df[column] != merged_df[column + "_previous"]).to_numpy()
+            )
+        previous_written_at = merged_df["written_at"].to_numpy(dtype=float)
+        # An aircraft that is not in the previous states has no written_at (NaN) and is already changed
+        changed = changed | (now - previous_written_at >= rewrite_after_secs)
+        changed_df = flight_df[changed]
+        written_at = np.where(changed, now, previous_written_at)
+
+    observations = [
+        asdict(
+            SingleAirtrafficObservation(
+                lat_dd=lat_dd,
+                lon_dd=lon_dd,
+                altitude_mm=altitude_mm,
+                traffic_source=2,
+                source_type=1,
+                icao_address=icao_address,
+                metadata=json.dumps({"velocity": velocity}),
+            )
+        )
+        for icao_address, lon_dd, lat_dd, altitude_mm, velocity in zip(
+            changed_df["icao24"].tolist(),
+            changed_df["long"].tolist(),
+            changed_df["lat"].tolist(),
+            changed_df["baro_altitude"].tolist(),
+            changed_df["velocity"].tolist(),
+        )
+    ]
+    return observations, flight_df.assign(written_at=written_at)
+
+
+class OpenSkyFeedManager:
+    """Records the view ports requested from the OpenSky feed and polls OpenSky once per interval for all of them"""
+
+    def __init__(self, duration_secs: int = OPENSKY_FEED_DURATION_SECS):
+        self.r = get_redis()
+        self.duration_secs = duration_secs
+        self.heartbeat = int(env.get("HEARTBEAT_RATE_SECS", 2))
+        self.poller_id = str(uuid.uuid4())
+
+    def request_feed(self, view_port: List[float]) -> bool:
+        """Add a view port (lat1, lng1, lat2, lng2) to the feed or extend its lifetime, returns True if a poller is running"""
+        expires_at_ms = int((time.time() + self.duration_secs) * 1000)
+        view_port_key = json.dumps([round(float(c), 6) for c in view_port])
+        pipe = self.r.pipeline()
+        pipe.zadd(OPENSKY_FEED_VIEW_PORTS_KEY, {view_port_key: expires_at_ms}, gt=True)
+        pipe.expire(OPENSKY_FEED_VIEW_PORTS_KEY, self.duration_secs)
+        pipe.exists(OPENSKY_FEED_POLLER_KEY)
+        return bool(pipe.execute()[-1])
+
+    def get_active_view_ports(self) -> List[List[float]]:
+        now_ms = int(time.time() * 1000)
+        pipe = self.r.pipeline()
+        pipe.zremrangebyscore(OPENSKY_FEED_VIEW_PORTS_KEY, "-inf", now_ms)
+        pipe.zrange(OPENSKY_FEED_VIEW_PORTS_KEY, 0, -1)
+        return [json.loads(view_port) for view_port in pipe.execute()[-1]]
+
+    def acquire_poller(self) -> bool:
+        """Become (or stay) the only running poller"""
+        if self.r.set(
+            OPENSKY_FEED_POLLER_KEY,
+            self.poller_id,
+            nx=True,
+            ex=OPENSKY_FEED_POLLER_TTL_SECS,
+        ):
+            return True
+        if self.r.get(OPENSKY_FEED_POLLER_KEY) == self.poller_id:
+            self.r.expire(OPENSKY_FEED_POLLER_KEY, OPENSKY_FEED_POLLER_TTL_SECS)
+            return True
+        return False
+
+    def release_poller(self):
+        if self.r.get(OPENSKY_FEED_POLLER_KEY) == self.poller_id:
+            self.r.delete(OPENSKY_FEED_POLLER_KEY)
+
+    async def run(self, until_idle: bool = False):
+        """Poll OpenSky for the active view ports every HEARTBEAT_RATE_SECS. If until_idle is set, return once no view port is active or another poller is running"""
+        loop = asyncio.get_running_loop()
+        session = get_opensky_session()
+        my_observation_writer = flight_stream_helper.ObservationWriteOperations()
+        previous_flight_df = None
+        try:
+            while True:
+                tick_start = time.monotonic()
+                view_ports = (
+                    self.get_active_view_ports() if self.acquire_poller() else None
+                )
+                if not view_ports:
+                    if until_idle:
+                        return
+                    previous_flight_df = None
+                    await asyncio.sleep(self.heartbeat)
+                    continue
+
+                lat_min, lng_min, lat_max, lng_max = get_covering_view_port(view_ports)
+                try:
+                    response = await loop.run_in_executor(
+                        None,
+                        partial(
+                            session.get,
+                            OPENSKY_STATES_URL,
+                            params={
+                                "lamin": lat_min,
+                                "lomin": lng_min,
+                                "lamax": lat_max,
+                                "lomax": lng_max,
+                            },
+                            timeout=OPENSKY_REQUEST_TIMEOUT_SECS,
+                        ),
+                    )
+                except requests.exceptions.RequestException as re:
+                    logger.error("Error querying OpenSky Network %s" % re)
+                    response = None
+
+                if response is not None and response.status_code == 200:
+                    states = response.json()["states"]
+                    if states is not None:
+                        observations, previous_flight_df = get_opensky_observations(
+                            states, previous_flight_df, view_ports=view_ports
+                        )
+                        # The whole snapshot is written in a single pipelined batch
+                        if observations:
+                            await loop.run_in_executor(
+                                None,
+                                my_observation_writer.write_observations,
+                                observations,
+                            )
+                        logger.debug(
+                            "Wrote %s changed of %s aircraft for %s view ports.."
+                            % (len(observations), len(states), len(view_ports))
+                        )
+                elif response is not None:
+                    logger.error(
+                        "Error querying OpenSky Network %s" % response.status_code
+                    )
+
+                await asyncio.sleep(
+                    max(0, self.heartbeat - (time.monotonic() - tick_start))
+                )
+        finally:
+            self.release_poller()
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List
+from typing import Dict, List
 
 from dacite import from_dict
 
@@ -51,6 +51,26 @@ def generate_unsigned_rid_telemetry_objects(
 
     return all_rid_data
 
+def get_aircraft_id_from_flight_details(flight_details: dict) -> str:
+    """The aircraft is identified by the serial number of the UAS, if it is not set the id of the flight details is used"""
+    uas_id = flight_details.get("uas_id") or {}
+    serial_number = uas_id.get("serial_number")
+    return serial_number if serial_number else flight_details["id"]
+
+
+def partition_telemetry_observations_by_aircraft(
+    telemetry_observations: List[dict],
+) -> Dict[str, List[dict]]:
+    """Split a batch of telemetry observations (flight details and current states) into one batch per aircraft, the order of observations for each aircraft is preserved"""
+    partitions: Dict[str, List[dict]] = {}
+    for observation in telemetry_observations:
+        aircraft_id = get_aircraft_id_from_flight_details(
+            flight_details=observation["flight_details"]
+        )
+        partitions.setdefault(aircraft_id, []).append(observation)
+    return partitions
+
+
 #TODO: Delete the usage of this
 class BlenderTelemetryValidator:
     def parse_validate_current_state(self, current_state) -> RIDAircraftState:
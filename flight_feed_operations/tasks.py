@@ -1,12 +1,8 @@
+import asyncio
 import json
 import logging
-from .data_definitions import SingleAirtrafficObservation
-from dataclasses import asdict
-import requests
-import time
-import arrow
-import pandas as pd
 from . import flight_stream_helper
+from .opensky_feed import OpenSkyFeedManager
 from flight_blender.celery import app
 from os import environ as env
 from dotenv import load_dotenv, find_dotenv
@@ -21,67 +17,31 @@ logger = logging.getLogger('django')
 #### Air traffic Endpoint
 
 @app.task(name='write_incoming_air_traffic_data')
-def write_incoming_air_traffic_data(observation):         
-    obs = json.loads(observation)    
+def write_incoming_air_traffic_data(observation):
+    obs = json.loads(observation)
     logging.debug("Writing observation..")
-    
-    my_stream_ops = flight_stream_helper.StreamHelperOps()   
-    cg = my_stream_ops.get_pull_cg()     
-    msg_id = cg.all_observations.add(obs)      
-    cg.all_observations.trim(1000)
-    return msg_id
-
-@app.task(name='start_openskies_stream')
-def start_openskies_stream(view_port:str):   
-    view_port = json.loads(view_port)
-    
-    # submit task to write to the flight stream
-    lng_min = min(view_port[0], view_port[2])
-    lng_max = max(view_port[0], view_port[2])
-    lat_min = min(view_port[1], view_port[3])
-    lat_max = max(view_port[1], view_port[3])
 
-    heartbeat = env.get('HEARTBEAT_RATE_SECS', 2)
-    heartbeat = int(heartbeat)
-    now = arrow.now()
-    two_minutes_from_now = now.shift(seconds = 60)
-
-    logger.info("Querying OpenSkies Network for one minute.. ")
+    my_observation_writer = flight_stream_helper.ObservationWriteOperations()
+    msg_id = my_observation_writer.write_observation(obs)
+    return msg_id
 
+@app.task(name='write_incoming_air_traffic_data_bulk')
+def write_incoming_air_traffic_data_bulk(observations):
+    # Write a batch of observations to the stream in a single pipeline
+    all_observations = json.loads(observations)
+    logging.debug("Writing %s observations.." % len(all_observations))
 
-    while arrow.now() < two_minutes_from_now:
-        url_data='https://opensky-network.org/api/states/all?'+'lamin='+str(lat_min)+'&lomin='+str(lng_min)+'&lamax='+str(lat_max)+'&lomax='+str(lng_max)
-        openskies_username = env.get('OPENSKY_NETWORK_USERNAME')
-        openskies_password = env.get('OPENSKY_NETWORK_PASSWORD')
-        response= requests.get(url_data, auth=(openskies_username, openskies_password))
-        logger.info(url_data)
-        #LOAD TO PANDAS DATAFRAME
-        col_name=['icao24','callsign','origin_country','time_position','last_contact','long','lat','baro_altitude','on_ground','velocity',       
-        'true_track','vertical_rate','sensors','geo_altitude','squawk','spi','position_source']
-        
-        response_data = response.json()
-        logger.debug(response_data)
-        
-        if response.status_code == 200:
-            
-            if response_data['states'] is not None:
-                flight_df=pd.DataFrame(response_data['states'],columns=col_name)
-                flight_df=flight_df.fillna('No Data') 
-                
-                all_observations = []
-                for index, row in flight_df.iterrows():
-                    metadata = {'velocity':row['velocity']}
-                    
-                    lat_dd =  row['lat']
-                    lon_dd = row['long']
-                    altitude_mm =  row['baro_altitude']
-                    traffic_source = 2
-                    source_type = 1 
-                    icao_address = row['icao24']                
+    my_observation_writer = flight_stream_helper.ObservationWriteOperations()
+    msg_ids = my_observation_writer.write_observations(all_observations)
+    return msg_ids
 
-                    so = SingleAirtrafficObservation(lat_dd= lat_dd, lon_dd=lon_dd, altitude_mm=altitude_mm, traffic_source= traffic_source, source_type= source_type, icao_address=icao_address, metadata= json.dumps(metadata))    
+@app.task(name='start_openskies_stream')
+def start_openskies_stream(view_port:str):
+    # Request the view port (lat1,lng1,lat2,lng2) from the OpenSky feed, if no poller is running this task polls until no view port has been requested for a minute
+    view_port = json.loads(view_port)
 
+    my_feed_manager = OpenSkyFeedManager()
+    my_feed_manager.request_feed(view_port=view_port)
 
-                    msgid = write_incoming_air_traffic_data.delay(json.dumps(asdict(so)))
-    
-        time.sleep(heartbeat)
+    logger.info("Querying OpenSkies Network.. ")
+    asyncio.run(my_feed_manager.run(until_idle=True))
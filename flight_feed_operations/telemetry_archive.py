@@ -0,0 +1,314 @@
+"""
+An archive of the observations in columnar (Arrow IPC) files.
+
+The observation stream is trimmed after a short time, the archiver (python manage.py run_telemetry_archiver) reads every observation through its own consumer group and writes them in batches to files partitioned by hour and region:
+
+    <TELEMETRY_ARCHIVE_DIR>/hour=<YYYYMMDDHH>/region=<lat cell>_<lng cell>/<first stream id>-<id>.arrow
+
+The files are not compressed so that the reader can memory-map them: only the columns and the files of the requested hours and regions are read, never whole partitions into memory.
+"""
+
+import logging
+import math
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from os import environ as env
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from dotenv import find_dotenv, load_dotenv
+
+from .flight_stream_helper import ObservationConsumer
+from .observation_shards import NO_POSITION_CELL
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+TELEMETRY_ARCHIVE_DIR = "telemetry_archive"
+TELEMETRY_ARCHIVE_REGION_DEGREES = 1.0
+TELEMETRY_ARCHIVE_CONSUMER_GROUP = "cg-archive"
+# The archiver writes a batch once it has this many observations or this many seconds after the first one was read
+TELEMETRY_ARCHIVE_BATCH_SIZE = 10000
+TELEMETRY_ARCHIVE_FLUSH_INTERVAL_SECS = 10
+
+HOUR_PARTITION_FORMAT = "%Y%m%d%H"
+ARCHIVE_SCHEMA = pa.schema(
+    [
+        ("stream_id", pa.string()),
+        ("timestamp_ms", pa.int64()),
+        ("icao_address", pa.string()),
+        ("traffic_source", pa.int64()),
+        ("source_type", pa.int64()),
+        ("lat_dd", pa.float64()),
+        ("lon_dd", pa.float64()),
+        ("altitude_mm", pa.float64()),
+        ("metadata", pa.string()),
+    ]
+)
+
+
+def get_archive_dir() -> str:
+    return env.get("TELEMETRY_ARCHIVE_DIR", TELEMETRY_ARCHIVE_DIR)
+
+
+def get_archive_region_degrees() -> float:
+    return float(
+        env.get("TELEMETRY_ARCHIVE_REGION_DEGREES", TELEMETRY_ARCHIVE_REGION_DEGREES)
+    )
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_ms(moment: datetime) -> int:
+    return int(moment.timestamp() * 1000)
+
+
+def get_partition(
+    timestamp_ms: int,
+    lat_dd: Optional[float],
+    lon_dd: Optional[float],
+    region_degrees: float,
+) -> Tuple[str, str]:
+    """The hour (UTC) and the region of an observation"""
+    hour = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime(
+        HOUR_PARTITION_FORMAT
+    )
+    if lat_dd is None or lon_dd is None:
+        return hour, NO_POSITION_CELL
+    return hour, "%d_%d" % (
+        math.floor(lat_dd / region_degrees),
+        math.floor(lon_dd / region_degrees),
+    )
+
+
+def region_in_view_port(
+    region: str, view_port: List[float], region_degrees: float
+) -> bool:
+    """Check if a region intersects a view port (lat1, lng1, lat2, lng2)"""
+    if region == NO_POSITION_CELL:
+        return False
+    lat_cell, lng_cell = region.split("_")
+    region_lat_min = int(lat_cell) * region_degrees
+    region_lng_min = int(lng_cell) * region_degrees
+    return (
+        region_lat_min <= max(view_port[0], view_port[2])
+        and region_lat_min + region_degrees >= min(view_port[0], view_port[2])
+        and region_lng_min <= max(view_port[1], view_port[3])
+        and region_lng_min + region_degrees >= min(view_port[1], view_port[3])
+    )
+
+
+class TelemetryArchiveWriter:
+    """Writes observations read from the stream (see parse_stream_entries) to the archive, one file per partition and batch"""
+
+    def __init__(
+        self,
+        archive_dir: Optional[str] = None,
+        region_degrees: Optional[float] = None,
+    ):
+        self.archive_dir = archive_dir or get_archive_dir()
+        self.region_degrees = region_degrees or get_archive_region_degrees()
+
+    def write_observations(self, observations: List[dict]) -> List[str]:
+        """Write a batch of observations, returns the paths of the files written"""
+        partitions: Dict[Tuple[str, str], Dict[str, list]] = {}
+        for observation in observations:
+            msg_data = observation["msg_data"]
+            timestamp_ms = int(observation["id"].split("-")[0])
+            lat_dd = _to_float(msg_data.get("lat_dd"))
+            lon_dd = _to_float(msg_data.get("lon_dd"))
+            columns = partitions.setdefault(
+                get_partition(timestamp_ms, lat_dd, lon_dd, self.region_degrees),
+                {name: [] for name in ARCHIVE_SCHEMA.names},
+            )
+            columns["stream_id"].append(observation["id"])
+            columns["timestamp_ms"].append(timestamp_ms)
+            columns["icao_address"].append(str(msg_data["icao_address"]))
+            columns["traffic_source"].append(_to_int(msg_data.get("traffic_source")))
+            columns["source_type"].append(_to_int(msg_data.get("source_type")))
+            columns["lat_dd"].append(lat_dd)
+            columns["lon_dd"].append(lon_dd)
+            columns["altitude_mm"].append(_to_float(msg_data.get("altitude_mm")))
+            columns["metadata"].append(msg_data.get("metadata"))
+
+        paths = []
+        for (hour, region), columns in partitions.items():
+            # Sorted by aircraft and time so that a track is a contiguous run of rows
+            table = pa.Table.from_pydict(columns, schema=ARCHIVE_SCHEMA).sort_by(
+                [("icao_address", "ascending"), ("timestamp_ms", "ascending")]
+            )
+            partition_dir = os.path.join(
+                self.archive_dir, "hour=" + hour, "region=" + region
+            )
+            os.makedirs(partition_dir, exist_ok=True)
+            path = os.path.join(
+                partition_dir,
+                "%s-%s.arrow" % (min(columns["stream_id"]), uuid.uuid4().hex[:8]),
+            )
+            # Written under a temporary name so that readers never see a partial file
+            with pa.OSFile(path + ".tmp", "wb") as sink:
+                with pa.ipc.new_file(sink, ARCHIVE_SCHEMA) as writer:
+                    writer.write_table(table)
+            os.replace(path + ".tmp", path)
+            paths.append(path)
+        return paths
+
+
+class TelemetryArchiveReader:
+    """Reads tracks and windows of observations from the memory-mapped archive files, as pandas DataFrames sorted by time"""
+
+    def __init__(
+        self,
+        archive_dir: Optional[str] = None,
+        region_degrees: Optional[float] = None,
+    ):
+        self.archive_dir = archive_dir or get_archive_dir()
+        self.region_degrees = region_degrees or get_archive_region_degrees()
+
+    def get_files(
+        self, start: datetime, end: datetime, view_port: Optional[List[float]] = None
+    ) -> List[str]:
+        """The archive files of the hours between start and end, only of the regions that intersect the view port if one is given"""
+        paths = []
+        hour = start.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        while hour <= end:
+            hour_dir = os.path.join(
+                self.archive_dir, "hour=" + hour.strftime(HOUR_PARTITION_FORMAT)
+            )
+            hour += timedelta(hours=1)
+            if not os.path.isdir(hour_dir):
+                continue
+            for region_dir in sorted(os.listdir(hour_dir)):
+                region = region_dir.split("=", 1)[1]
+                if view_port is not None and not region_in_view_port(
+                    region, view_port, self.region_degrees
+                ):
+                    continue
+                region_path = os.path.join(hour_dir, region_dir)
+                paths.extend(
+                    os.path.join(region_path, file_name)
+                    for file_name in sorted(os.listdir(region_path))
+                    if file_name.endswith(".arrow")
+                )
+        return paths
+
+    def _read(self, paths: List[str], row_filter) -> pd.DataFrame:
+        tables = []
+        for path in paths:
+            with pa.memory_map(path, "r") as source:
+                table = pa.ipc.open_file(source).read_all()
+                # The filter copies the matching rows out of the mapped file
+                tables.append(table.filter(row_filter(table)))
+        if not tables:
+            return ARCHIVE_SCHEMA.empty_table().to_pandas()
+        return (
+            pa.concat_tables(tables)
+            .sort_by([("timestamp_ms", "ascending"), ("stream_id", "ascending")])
+            .to_pandas()
+        )
+
+    def get_flight_track(
+        self, icao_address: str, start: datetime, end: datetime
+    ) -> pd.DataFrame:
+        """The observations of one aircraft between start and end"""
+        start_ms = _to_ms(start)
+        end_ms = _to_ms(end)
+
+        def row_filter(table):
+            return pc.and_(
+                pc.equal(table["icao_address"], icao_address),
+                pc.and_(
+                    pc.greater_equal(table["timestamp_ms"], start_ms),
+                    pc.less_equal(table["timestamp_ms"], end_ms),
+                ),
+            )
+
+        return self._read(self.get_files(start, end), row_filter)
+
+    def get_observations(
+        self, start: datetime, end: datetime, view_port: Optional[List[float]] = None
+    ) -> pd.DataFrame:
+        """The observations between start and end, only inside the view port (lat1, lng1, lat2, lng2) if one is given"""
+        start_ms = _to_ms(start)
+        end_ms = _to_ms(end)
+
+        def row_filter(table):
+            in_window = pc.and_(
+                pc.greater_equal(table["timestamp_ms"], start_ms),
+                pc.less_equal(table["timestamp_ms"], end_ms),
+            )
+            if view_port is None:
+                return in_window
+            in_view_port = pc.and_(
+                pc.and_(
+                    pc.greater_equal(table["lat_dd"], min(view_port[0], view_port[2])),
+                    pc.less_equal(table["lat_dd"], max(view_port[0], view_port[2])),
+                ),
+                pc.and_(
+                    pc.greater_equal(table["lon_dd"], min(view_port[1], view_port[3])),
+                    pc.less_equal(table["lon_dd"], max(view_port[1], view_port[3])),
+                ),
+            )
+            return pc.and_(in_window, in_view_port)
+
+        return self._read(self.get_files(start, end, view_port), row_filter)
+
+
+class TelemetryArchiver:
+    """
+    Reads the observations from the stream(s) with a consumer group and writes them to the archive in batches. Observations are acknowledged once they are written, observations read by an archiver that stopped before writing them are claimed after OBSERVATION_CONSUMER_CLAIM_IDLE_MS. Observations trimmed from the stream before they were read are not archived.
+    """
+
+    def __init__(
+        self,
+        group: str = TELEMETRY_ARCHIVE_CONSUMER_GROUP,
+        batch_size: int = TELEMETRY_ARCHIVE_BATCH_SIZE,
+        flush_interval_secs: float = TELEMETRY_ARCHIVE_FLUSH_INTERVAL_SECS,
+        writer: Optional[TelemetryArchiveWriter] = None,
+    ):
+        self.consumer = ObservationConsumer(group=group)
+        self.batch_size = batch_size
+        self.flush_interval_secs = flush_interval_secs
+        self.writer = writer or TelemetryArchiveWriter()
+
+    def archive_batch(self, block_ms: int = 1000) -> int:
+        """Read and archive one batch, returns the number of observations archived"""
+        observations = self.consumer.claim_stale(count=self.batch_size)
+        flush_at = time.monotonic() + self.flush_interval_secs
+        while len(observations) < self.batch_size:
+            observations.extend(
+                self.consumer.read(
+                    count=self.batch_size - len(observations), block=block_ms
+                )
+            )
+            if time.monotonic() >= flush_at:
+                break
+        if not observations:
+            return 0
+        paths = self.writer.write_observations(observations)
+        self.consumer.ack(observations)
+        logger.debug(
+            "Archived %s observations in %s files" % (len(observations), len(paths))
+        )
+        return len(observations)
+
+    def run(self):
+        while True:
+            self.archive_batch()
@@ -0,0 +1,450 @@
+"""
+A single pass validator and decoder of telemetry requests (set_telemetry).
+
+The fields of TelemetryRequestSerializer are compiled once into a tree of slotted field decoders that validate the parsed JSON with the same rules and error messages as the serializer and build the RIDFlightDetails and RIDAircraftState objects directly, without the serializer's intermediate data or JSON round-trips.
+"""
+
+import datetime
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.validators import ProhibitNullCharactersValidator
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.fields import empty
+from rest_framework.settings import api_settings
+from rest_framework.utils import humanize_datetime
+from rest_framework.utils.json import strict_constant
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+
+from rid_operations.data_definitions import (
+    UASID,
+    HorizontalAccuracy,
+    LatLngPoint,
+    OperatorLocation,
+    RIDAircraftPosition,
+    RIDAircraftState,
+    RIDAuthData,
+    RIDFlightDetails,
+    RIDHeight,
+    RIDOperationalStatus,
+    SignedUnSignedTelemetryObservations,
+    SpeedAccuracy,
+    Time,
+    UAClassificationEU,
+    VerticalAccuracy,
+)
+
+from . import serializers as telemetry_serializers
+
+# The error of Serializer.errors when the payload is null
+NO_DATA_MESSAGE = "No data provided"
+# The validators that a CharField always has and their messages
+CHAR_FIELD_VALIDATORS = (
+    ProhibitNullCharactersValidator,
+    ProhibitSurrogateCharactersValidator,
+)
+NULL_CHARACTERS_MESSAGE = "Null characters are not allowed."
+SURROGATE_CHARACTERS_MESSAGE = "Surrogate characters are not allowed: U+{code_point:X}."
+SURROGATE_CHARACTERS = re.compile("[\ud800-\udfff]")
+
+
+class TelemetryValidationError(Exception):
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class _SkipField:
+    """Marks a missing optional field without a default, it is left out of the decoded values"""
+
+
+SKIP = _SkipField()
+
+
+class FieldDecoder(ABC):
+    """Validates and converts the value of a serializer field, the same as Field.run_validation, with the error messages of the field"""
+
+    __slots__ = ("required", "default", "error_messages")
+
+    def __init__(self, field: serializers.Field):
+        self.required = field.required
+        self.default = SKIP if field.default is empty else field.default
+        self.error_messages = field.error_messages
+
+    def fail(self, key: str, **kwargs):
+        raise TelemetryValidationError([str(self.error_messages[key]).format(**kwargs)])
+
+    def decode(self, data):
+        if data is SKIP:
+            if self.required:
+                self.fail("required")
+            return self.default
+        if data is None:
+            self.fail("null")
+        return self.to_internal_value(data)
+
+    @abstractmethod
+    def to_internal_value(self, data):
+        """Convert a value that is not missing or null, raises a TelemetryValidationError with the errors of the serializer"""
+
+
+class FloatDecoder(FieldDecoder):
+    __slots__ = ()
+
+    def to_internal_value(self, data):
+        if (
+            isinstance(data, str)
+            and len(data) > serializers.FloatField.MAX_STRING_LENGTH
+        ):
+            self.fail("max_string_length")
+        try:
+            return float(data)
+        except (TypeError, ValueError):
+            self.fail("invalid")
+
+
+class IntegerDecoder(FieldDecoder):
+    __slots__ = ()
+    re_decimal = re.compile(r"\.0*\s*$")
+
+    def to_internal_value(self, data):
+        if (
+            isinstance(data, str)
+            and len(data) > serializers.IntegerField.MAX_STRING_LENGTH
+        ):
+            self.fail("max_string_length")
+        try:
+            return int(self.re_decimal.sub("", str(data)))
+        except (TypeError, ValueError):
+            self.fail("invalid")
+
+
+class CharDecoder(FieldDecoder):
+    __slots__ = ()
+
+    def decode(self, data):
+        if data is not SKIP and (data == "" or str(data).strip() == ""):
+            self.fail("blank")
+        return super().decode(data)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not isinstance(data, (str, int, float)):
+            self.fail("invalid")
+        value = str(data).strip()
+        errors = []
+        if "\x00" in value:
+            errors.append(NULL_CHARACTERS_MESSAGE)
+        surrogate = SURROGATE_CHARACTERS.search(value)
+        if surrogate is not None:
+            errors.append(
+                SURROGATE_CHARACTERS_MESSAGE.format(code_point=ord(surrogate.group()))
+            )
+        if errors:
+            raise TelemetryValidationError(errors)
+        return value
+
+
+class BooleanDecoder(FieldDecoder):
+    __slots__ = ()
+
+    def to_internal_value(self, data):
+        try:
+            if data in serializers.BooleanField.TRUE_VALUES:
+                return True
+            elif data in serializers.BooleanField.FALSE_VALUES:
+                return False
+        except TypeError:
+            # The input is an unhashable type
+            pass
+        self.fail("invalid")
+
+
+class ChoiceDecoder(FieldDecoder):
+    __slots__ = ("choices",)
+
+    def __init__(self, field: serializers.ChoiceField):
+        super().__init__(field)
+        self.choices = dict(field.choice_strings_to_values)
+
+    def to_internal_value(self, data):
+        try:
+            return self.choices[str(data)]
+        except KeyError:
+            self.fail("invalid_choice", input=data)
+
+
+class DateTimeDecoder(FieldDecoder):
+    __slots__ = ("input_formats",)
+
+    def __init__(self, field: serializers.DateTimeField):
+        super().__init__(field)
+        self.input_formats = getattr(
+            field, "input_formats", api_settings.DATETIME_INPUT_FORMATS
+        )
+
+    def to_internal_value(self, data):
+        try:
+            parsed = parse_datetime(data)
+        except (TypeError, ValueError):
+            parsed = None
+        if parsed is None:
+            self.fail(
+                "invalid",
+                format=humanize_datetime.datetime_formats(self.input_formats),
+            )
+        if not settings.USE_TZ:
+            return (
+                timezone.make_naive(parsed, datetime.timezone.utc)
+                if timezone.is_aware(parsed)
+                else parsed
+            )
+        current_timezone = timezone.get_current_timezone()
+        try:
+            if timezone.is_aware(parsed):
+                return parsed.astimezone(current_timezone)
+            return timezone.make_aware(parsed, current_timezone)
+        except OverflowError:
+            self.fail("overflow")
+
+
+class ObjectDecoder(FieldDecoder):
+    """Decodes a JSON object field by field and builds the decoded object from the values, the same as a nested serializer"""
+
+    __slots__ = ("fields", "build")
+
+    def __init__(
+        self,
+        field: serializers.Serializer,
+        fields: Dict[str, FieldDecoder],
+        build: Optional[Callable[[dict], object]] = None,
+    ):
+        super().__init__(field)
+        self.fields = fields
+        self.build = build
+
+    def to_internal_value(self, data):
+        if not isinstance(data, dict):
+            raise TelemetryValidationError(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        str(self.error_messages["invalid"]).format(
+                            datatype=type(data).__name__
+                        )
+                    ]
+                }
+            )
+        values = {}
+        errors = {}
+        for field_name, field in self.fields.items():
+            try:
+                value = field.decode(data.get(field_name, SKIP))
+            except TelemetryValidationError as e:
+                errors[field_name] = e.detail
+            else:
+                if value is not SKIP:
+                    values[field_name] = value
+        if errors:
+            raise TelemetryValidationError(errors)
+        return self.build(values) if self.build is not None else values
+
+
+class ListDecoder(FieldDecoder):
+    __slots__ = ("child",)
+
+    def __init__(self, field: serializers.ListSerializer, child: FieldDecoder):
+        super().__init__(field)
+        self.child = child
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise TelemetryValidationError(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        str(self.error_messages["not_a_list"]).format(
+                            input_type=type(data).__name__
+                        )
+                    ]
+                }
+            )
+        values = []
+        errors = []
+        for item in data:
+            try:
+                values.append(self.child.decode(item))
+            except TelemetryValidationError as e:
+                errors.append(e.detail)
+            else:
+                errors.append({})
+        if any(errors):
+            raise TelemetryValidationError(errors)
+        return values
+
+
+def _build_current_state(values: dict) -> RIDAircraftState:
+    position = values["position"]
+    return RIDAircraftState(
+        timestamp=values["timestamp"],
+        operational_status=RIDOperationalStatus(values["operational_status"]),
+        position=RIDAircraftPosition(
+            pressure_altitude=position["pressure_altitude"],
+            lat=position["lat"],
+            lng=position["lng"],
+            accuracy_h=HorizontalAccuracy(value=position["accuracy_h"]),
+            accuracy_v=VerticalAccuracy(value=position["accuracy_v"]),
+            extrapolated=position["extrapolated"],
+            height=values["height"],
+        ),
+        track=values["track"],
+        speed=values["speed"],
+        timestamp_accuracy=values["timestamp_accuracy"],
+        # The speed accuracy of submitted telemetry is not used
+        speed_accuracy=SpeedAccuracy("SA3mps"),
+        vertical_speed=values["vertical_speed"],
+    )
+
+
+def _build_flight_details(values: dict) -> RIDFlightDetails:
+    rid_details = values["rid_details"]
+    return RIDFlightDetails(
+        id=rid_details["id"],
+        eu_classification=values["eu_classification"],
+        uas_id=values["uas_id"],
+        operator_location=values["operator_location"],
+        operator_id=rid_details["operator_id"],
+        operation_description=rid_details["operation_description"],
+        auth_data=values["auth_data"],
+    )
+
+
+# The objects that the nested serializers are decoded to, a nested serializer that is not listed is decoded to a dict
+OBJECT_BUILDERS: Dict[type, Callable[[dict], object]] = {
+    # The timestamp is kept as a string
+    telemetry_serializers.TimestampSerializer: lambda values: Time(
+        value=values["value"].isoformat(), format=values["format"]
+    ),
+    telemetry_serializers.HeightSerializer: lambda values: RIDHeight(
+        reference=values["reference"], distance=values["distance"]
+    ),
+    telemetry_serializers.CurrentStateSerializer: _build_current_state,
+    telemetry_serializers.EuClassificationSerializer: lambda values: UAClassificationEU(
+        category=values["category"], class_=values["class_"]
+    ),
+    telemetry_serializers.UasIdSerializer: lambda values: UASID(
+        serial_number=values["serial_number"],
+        registration_id=values["registration_id"],
+        utm_id=values["utm_id"],
+    ),
+    telemetry_serializers.OperatorPositionSerializer: lambda values: LatLngPoint(
+        lat=values["lat"], lng=values["lng"]
+    ),
+    telemetry_serializers.OperatorLocationSerializer: lambda values: OperatorLocation(
+        position=values["position"]
+    ),
+    telemetry_serializers.AuthDataSerializer: lambda values: RIDAuthData(
+        format=values["format"], data=values["data"]
+    ),
+    telemetry_serializers.FlightDetailsSerializer: _build_flight_details,
+    telemetry_serializers.ObservationSerializer: lambda values: SignedUnSignedTelemetryObservations(
+        current_states=values["current_states"],
+        flight_details=values["flight_details"],
+    ),
+}
+
+# The field types that are decoded, checked in order so that a subclass comes before its base class
+FIELD_DECODERS: List[Tuple[type, type]] = [
+    (serializers.ChoiceField, ChoiceDecoder),
+    (serializers.DateTimeField, DateTimeDecoder),
+    (serializers.BooleanField, BooleanDecoder),
+    (serializers.IntegerField, IntegerDecoder),
+    (serializers.FloatField, FloatDecoder),
+    (serializers.CharField, CharDecoder),
+]
+
+
+def compile_decoder(field: serializers.Field) -> FieldDecoder:
+    """
+    Compile a serializer field to its decoder. A field with options that the decoders do not implement (null or blank values, lengths, bounds, extra validators, a source) raises an ImproperlyConfigured, so that a change of the serializer cannot go unnoticed
+    """
+    unsupported = []
+    if getattr(field, "allow_null", False) or getattr(field, "allow_blank", False):
+        unsupported.append("null or blank values")
+    if getattr(field, "allow_empty", True) is False or any(
+        getattr(field, option, None) is not None
+        for option in ["max_length", "min_length", "max_value", "min_value"]
+    ):
+        unsupported.append("lengths or bounds")
+    if field.source != field.field_name or (
+        field.default is not empty and callable(field.default)
+    ):
+        unsupported.append("a source or a callable default")
+    if isinstance(field, (serializers.ListSerializer, serializers.Serializer)):
+        decoder_class = type(field)
+    else:
+        decoder_class = next(
+            (
+                decoder_class
+                for field_class, decoder_class in FIELD_DECODERS
+                if isinstance(field, field_class)
+            ),
+            None,
+        )
+    if decoder_class is None:
+        unsupported.append("the field type")
+    # The null and surrogate characters validators of a CharField are run by CharDecoder
+    if any(
+        not isinstance(validator, CHAR_FIELD_VALIDATORS)
+        for validator in field.validators
+    ):
+        unsupported.append("validators")
+    if unsupported:
+        raise ImproperlyConfigured(
+            "The telemetry decoder does not support %s of %s"
+            % (", ".join(unsupported), field.field_name)
+        )
+
+    if isinstance(field, serializers.ListSerializer):
+        return ListDecoder(field, child=compile_decoder(field.child))
+    if isinstance(field, serializers.Serializer):
+        return ObjectDecoder(
+            field,
+            fields={
+                field_name: compile_decoder(nested_field)
+                for field_name, nested_field in field.fields.items()
+            },
+            build=OBJECT_BUILDERS.get(type(field)),
+        )
+    return decoder_class(field)
+
+
+TELEMETRY_REQUEST_DECODER = compile_decoder(
+    telemetry_serializers.TelemetryRequestSerializer()
+)
+
+
+def decode_telemetry_request(
+    body: bytes,
+) -> Tuple[Optional[List[SignedUnSignedTelemetryObservations]], Optional[dict]]:
+    """
+    Parse and validate the body of a telemetry request, returns the observations or the validation errors (the same as TelemetryRequestSerializer.errors). A body that is not valid JSON raises a ParseError, the same as the JSONParser
+    """
+    try:
+        json_payload = json.loads(
+            body.decode(settings.DEFAULT_CHARSET), parse_constant=strict_constant
+        )
+    except ValueError as e:
+        raise ParseError("JSON parse error - %s" % str(e))
+
+    if json_payload is None:
+        return None, {api_settings.NON_FIELD_ERRORS_KEY: [NO_DATA_MESSAGE]}
+    try:
+        telemetry_request = TELEMETRY_REQUEST_DECODER.decode(json_payload)
+    except TelemetryValidationError as e:
+        return None, e.detail
+    return telemetry_request["observations"], None
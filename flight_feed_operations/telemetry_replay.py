@@ -0,0 +1,307 @@
+"""
+Replays recorded telemetry through the ingest path on a virtual clock, at the recorded speed or faster (e.g. 10x or 100x), to soak test the display and conformance monitoring with hours of traffic in minutes.
+
+The virtual clock starts at the first recorded observation and runs `speed` times faster than the wall clock. Every tick the observations that are due are written the way set_telemetry and set_air_traffic write them: RID telemetry with the stream_rid_telemetry_data task (that also updates the telemetry timestamp of the operation) and all other observations with the write_incoming_air_traffic_data_bulk task. The timestamps in the telemetry are replaced with the time they are written so that the replayed flights are live for the endpoints that read them.
+
+The recordings are read from the telemetry archive (see telemetry_archive), a list of air traffic observations (importers/air_traffic_samples) or a RID test injection (importers/rid_samples/flight_1_rid_test_v19.json).
+"""
+
+import copy
+import json
+import logging
+import time
+from dataclasses import asdict
+from datetime import datetime
+from typing import List, Optional
+
+import arrow
+
+from rid_operations.tasks import stream_rid_telemetry_data
+
+from .data_definitions import ReplayObservation, ReplayStats, SingleRIDObservation
+from .rid_telemetry_helper import partition_telemetry_observations_by_aircraft
+from .tasks import write_incoming_air_traffic_data_bulk
+from .telemetry_archive import TelemetryArchiveReader
+
+logger = logging.getLogger("django")
+
+# Observations that are due are written together every tick (of the wall clock)
+REPLAY_TICK_SECS = 0.1
+# The traffic source of the observations of a RID test injection, as in stream_rid_test_data
+RID_TEST_INJECTION_TRAFFIC_SOURCE = 3
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class VirtualClock:
+    """A clock of the recorded time that runs speed times faster than the wall clock once it is started"""
+
+    def __init__(self, speed: float = 1, monotonic=time.monotonic, sleep=time.sleep):
+        self.speed = speed
+        self._monotonic = monotonic
+        self._sleep = sleep
+        self._start_ms = 0
+        self._wall_start = self._monotonic()
+
+    def start(self, start_ms: int):
+        self._start_ms = start_ms
+        self._wall_start = self._monotonic()
+
+    def now_ms(self) -> float:
+        return (
+            self._start_ms + (self._monotonic() - self._wall_start) * self.speed * 1000
+        )
+
+    def get_wall_secs(self, duration_ms: float) -> float:
+        """The wall clock seconds of a duration of recorded time"""
+        return duration_ms / self.speed / 1000
+
+    def sleep_until(self, moment_ms: float):
+        delay = self.get_wall_secs(moment_ms - self.now_ms())
+        if delay > 0:
+            self._sleep(delay)
+
+
+def restamp_metadata(metadata, timestamp: str):
+    """A copy of the metadata of an observation with the timestamp of the RID telemetry (of set_telemetry or of a RID test injection) replaced"""
+    if not isinstance(metadata, dict):
+        return metadata
+    metadata = copy.deepcopy(metadata)
+    for state_key in ("current_state", "telemetry"):
+        state = metadata.get(state_key)
+        if not isinstance(state, dict) or "timestamp" not in state:
+            continue
+        if isinstance(state["timestamp"], dict):
+            state["timestamp"]["value"] = timestamp
+        else:
+            state["timestamp"] = timestamp
+    return metadata
+
+
+def is_rid_telemetry(metadata) -> bool:
+    return (
+        isinstance(metadata, dict)
+        and "current_state" in metadata
+        and "flight_details" in metadata
+    )
+
+
+def load_archive_observations(
+    start: datetime,
+    end: datetime,
+    view_port: Optional[List[float]] = None,
+    reader: Optional[TelemetryArchiveReader] = None,
+) -> List[ReplayObservation]:
+    """The archived observations between start and end, only inside the view port (lat1, lng1, lat2, lng2) if one is given"""
+    reader = reader or TelemetryArchiveReader()
+    observations = reader.get_observations(start, end, view_port=view_port)
+    replay_observations = []
+    for row in observations.itertuples(index=False):
+        replay_observations.append(
+            ReplayObservation(
+                timestamp_ms=int(row.timestamp_ms),
+                observation={
+                    "lat_dd": row.lat_dd,
+                    "lon_dd": row.lon_dd,
+                    "altitude_mm": row.altitude_mm,
+                    "traffic_source": _to_int(row.traffic_source),
+                    "source_type": _to_int(row.source_type),
+                    "icao_address": row.icao_address,
+                    "metadata": json.loads(row.metadata) if row.metadata else {},
+                },
+            )
+        )
+    return replay_observations
+
+
+def load_air_traffic_observations(observations: List[dict]) -> List[ReplayObservation]:
+    """Air traffic observations (as posted to set_air_traffic) with their timestamp in milliseconds"""
+    return [
+        ReplayObservation(
+            timestamp_ms=int(observation["timestamp"]),
+            observation={
+                "lat_dd": observation["lat_dd"],
+                "lon_dd": observation["lon_dd"],
+                "altitude_mm": observation["altitude_mm"],
+                "traffic_source": observation["traffic_source"],
+                "source_type": observation["source_type"],
+                "icao_address": observation["icao_address"],
+                "metadata": observation.get("metadata", {}),
+            },
+        )
+        for observation in observations
+    ]
+
+
+def load_rid_test_injection(requested_flights: List[dict]) -> List[ReplayObservation]:
+    """The telemetry of the flights of a RID test injection, with the details that are closest in time as in stream_rid_test_data"""
+    replay_observations = []
+    for requested_flight in requested_flights:
+        details_responses = requested_flight["details_responses"]
+        for telemetry in requested_flight["telemetry"]:
+            timestamp = arrow.get(telemetry["timestamp"])
+            details_response = min(
+                details_responses,
+                key=lambda d: abs(arrow.get(d["effective_after"]) - timestamp),
+            )
+            position = telemetry["position"]
+            observation = SingleRIDObservation(
+                lat_dd=position["lat"],
+                lon_dd=position["lng"],
+                altitude_mm=position["alt"],
+                traffic_source=RID_TEST_INJECTION_TRAFFIC_SOURCE,
+                source_type=0,
+                icao_address=details_response["details"]["id"],
+                metadata={
+                    "telemetry": telemetry,
+                    "details_response": details_response,
+                },
+            )
+            replay_observations.append(
+                ReplayObservation(
+                    timestamp_ms=int(timestamp.float_timestamp * 1000),
+                    observation=asdict(observation),
+                )
+            )
+    return replay_observations
+
+
+def load_replay_file(path: str) -> List[ReplayObservation]:
+    """Read a list of air traffic observations or a RID test injection (with requested_flights)"""
+    with open(path, "r") as replay_file:
+        recording = json.load(replay_file)
+    if isinstance(recording, dict) and "requested_flights" in recording:
+        return load_rid_test_injection(recording["requested_flights"])
+    if isinstance(recording, dict) and "observations" in recording:
+        recording = recording["observations"]
+    return load_air_traffic_observations(recording)
+
+
+def repeat_observations(
+    observations: List[ReplayObservation], times: int, gap_ms: int = 1000
+) -> List[ReplayObservation]:
+    """The observations followed by times - 1 copies, each copy starts gap_ms after the previous one ended"""
+    if not observations or times <= 1:
+        return list(observations)
+    first_ms = min(o.timestamp_ms for o in observations)
+    last_ms = max(o.timestamp_ms for o in observations)
+    period_ms = last_ms - first_ms + gap_ms
+    return [
+        ReplayObservation(
+            timestamp_ms=o.timestamp_ms + repetition * period_ms,
+            observation=o.observation,
+        )
+        for repetition in range(times)
+        for o in observations
+    ]
+
+
+class TelemetryReplayer:
+    """Writes recorded observations on a virtual clock, through the task queue like the ingest endpoints or in this process"""
+
+    def __init__(
+        self,
+        observations: List[ReplayObservation],
+        speed: float = 1,
+        tick_secs: float = REPLAY_TICK_SECS,
+        use_task_queue: bool = True,
+        clock: Optional[VirtualClock] = None,
+    ):
+        self.observations = sorted(observations, key=lambda o: o.timestamp_ms)
+        self.tick_secs = tick_secs
+        self.use_task_queue = use_task_queue
+        self.clock = clock or VirtualClock(speed=speed)
+
+    def _submit(self, task, *args, **kwargs):
+        if self.use_task_queue:
+            task.delay(*args, **kwargs)
+        else:
+            task(*args, **kwargs)
+
+    def write_batch(self, batch: List[ReplayObservation]):
+        written_at = arrow.utcnow().isoformat()
+        telemetry_observations = []
+        air_traffic_observations = []
+        for replay_observation in batch:
+            observation = dict(replay_observation.observation)
+            metadata = restamp_metadata(observation["metadata"], written_at)
+            if is_rid_telemetry(metadata):
+                telemetry_observations.append(
+                    {
+                        "current_states": [metadata["current_state"]],
+                        "flight_details": metadata["flight_details"],
+                    }
+                )
+            else:
+                observation["metadata"] = json.dumps(metadata)
+                air_traffic_observations.append(observation)
+
+        partitions = partition_telemetry_observations_by_aircraft(
+            telemetry_observations=telemetry_observations
+        )
+        for aircraft_observations in partitions.values():
+            self._submit(
+                stream_rid_telemetry_data,
+                rid_telemetry_observations=json.dumps(
+                    aircraft_observations, separators=(",", ":")
+                ),
+            )
+        if air_traffic_observations:
+            self._submit(
+                write_incoming_air_traffic_data_bulk,
+                json.dumps(air_traffic_observations),
+            )
+
+    def replay(self) -> ReplayStats:
+        observations = self.observations
+        if not observations:
+            return ReplayStats(
+                observations=0,
+                batches=0,
+                recorded_duration_secs=0,
+                replay_duration_secs=0,
+                max_lag_secs=0,
+            )
+        wall_start = time.monotonic()
+        self.clock.start(observations[0].timestamp_ms)
+        tick_ms = self.tick_secs * self.clock.speed * 1000
+        index = 0
+        batches = 0
+        max_lag_secs = 0.0
+        while index < len(observations):
+            self.clock.sleep_until(observations[index].timestamp_ms)
+            # Not earlier than the observation that was slept for, whatever the rounding of the clock
+            now_ms = max(self.clock.now_ms(), observations[index].timestamp_ms)
+            end = index
+            while end < len(observations) and observations[end].timestamp_ms <= now_ms:
+                end += 1
+            # The first observation of a batch is the latest (in wall clock time) compared to when it was due
+            max_lag_secs = max(
+                max_lag_secs,
+                self.clock.get_wall_secs(now_ms - observations[index].timestamp_ms),
+            )
+            self.write_batch(observations[index:end])
+            batches += 1
+            index = end
+            if index < len(observations):
+                self.clock.sleep_until(now_ms + tick_ms)
+
+        stats = ReplayStats(
+            observations=len(observations),
+            batches=batches,
+            recorded_duration_secs=(
+                observations[-1].timestamp_ms - observations[0].timestamp_ms
+            )
+            / 1000,
+            replay_duration_secs=time.monotonic() - wall_start,
+            max_lag_secs=max_lag_secs,
+        )
+        logger.info(
+            "Replayed %s observations in %s batches" % (stats.observations, batches)
+        )
+        return stats
@@ -0,0 +1,550 @@
+import json
+import os
+from unittest import mock
+
+from django.test import TestCase
+from walrus.streams import id_to_datetime
+
+from . import flight_stream_helper
+from .data_definitions import ObservationStreamRetentionPolicy
+from .flight_stream_helper import (
+    AIRCRAFT_RECENT_POSITIONS_KEY,
+    AIRCRAFT_RECENT_STREAM_IDS_KEY,
+    AIRCRAFT_RETENTION_FLOOR_KEY,
+    LATEST_OBSERVATIONS_KEY,
+    LIVE_AIRCRAFT_LAST_SEEN_KEY,
+    LIVE_AIRCRAFT_POSITIONS_KEY,
+    ObservationConsumer,
+    ObservationReadOperations,
+    ObservationWriteOperations,
+    StreamHelperOps,
+    get_active_shard_keys,
+)
+from .observation_shards import (
+    AIRCRAFT_SHARDS_KEY,
+    OBSERVATION_SHARDS_KEY,
+    get_shard_keys,
+)
+from .observation_encoding import (
+    OBSERVATION_ENCODING_COMPACT,
+    OBSERVATION_ENCODING_JSON,
+    decode_observation,
+    decode_stream_entry,
+    encode_observation,
+)
+
+
+def make_observation(icao_address: str, lat_dd: float):
+    return {
+        "lat_dd": lat_dd,
+        "lon_dd": 7.47,
+        "altitude_mm": 120000,
+        "traffic_source": 9,
+        "source_type": 0,
+        "icao_address": icao_address,
+        "metadata": json.dumps({"aircraft_type": "Helicopter"}),
+    }
+
+
+class ObservationWriteOperationsTests(TestCase):
+    def setUp(self):
+        self.observation_writer = ObservationWriteOperations()
+        self.stream_ops = StreamHelperOps()
+        self.stream_ops.db.delete(
+            LATEST_OBSERVATIONS_KEY,
+            LIVE_AIRCRAFT_POSITIONS_KEY,
+            LIVE_AIRCRAFT_LAST_SEEN_KEY,
+            AIRCRAFT_RECENT_STREAM_IDS_KEY.format(stream_key="all_observations"),
+            AIRCRAFT_RETENTION_FLOOR_KEY.format(stream_key="all_observations"),
+            AIRCRAFT_RECENT_POSITIONS_KEY,
+        )
+
+    def test_write_empty_batch(self):
+        self.assertEqual(self.observation_writer.write_observations([]), [])
+
+    def test_write_observations_in_order(self):
+        observations = [
+            make_observation(icao_address="drone-" + str(i), lat_dd=46.97 + i)
+            for i in range(10)
+        ]
+        message_ids = self.observation_writer.write_observations(observations)
+        self.assertEqual(len(message_ids), 10)
+
+        messages = self.stream_ops.db.xrange(
+            "all_observations", message_ids[0], message_ids[-1]
+        )
+        self.assertEqual(
+            [decode_stream_entry(fields)["icao_address"] for _, fields in messages],
+            ["drone-" + str(i) for i in range(10)],
+        )
+
+    def test_latest_observation_per_aircraft(self):
+        observations = [
+            make_observation(icao_address="drone-a", lat_dd=46.1),
+            make_observation(icao_address="drone-b", lat_dd=46.2),
+            make_observation(icao_address="drone-a", lat_dd=46.3),
+        ]
+        message_ids = self.observation_writer.write_observations(observations)
+
+        latest_observations = ObservationReadOperations().get_latest_observations()
+        latest_by_address = {o["address"]: o for o in latest_observations}
+        self.assertEqual(set(latest_by_address.keys()), {"drone-a", "drone-b"})
+        self.assertEqual(latest_by_address["drone-a"]["msg_data"]["lat_dd"], "46.3")
+        self.assertEqual(
+            latest_by_address["drone-a"]["metadata"], {"aircraft_type": "Helicopter"}
+        )
+        self.assertEqual(
+            latest_observations[0]["timestamp"],
+            id_to_datetime(message_ids[-1].encode("utf-8"))[0],
+        )
+
+    def test_get_observations_from_consumer_group(self):
+        cg = self.stream_ops.db.time_series("cg-test", self.stream_ops.stream_keys)
+        cg.create()
+        cg.set_id("$")
+        self.addCleanup(cg.destroy)
+        self.observation_writer.write_observations(
+            [
+                make_observation(icao_address="drone-a", lat_dd=46.1),
+                make_observation(icao_address="drone-b", lat_dd=46.2),
+            ]
+        )
+
+        observations = ObservationReadOperations().get_observations(cg)
+        self.assertEqual([o["address"] for o in observations], ["drone-a", "drone-b"])
+        self.assertEqual(observations[0]["metadata"], {"aircraft_type": "Helicopter"})
+
+    def test_observations_snapshot_is_not_consumed(self):
+        self.observation_writer.write_observations(
+            [
+                make_observation(icao_address="drone-a", lat_dd=46.1),
+                make_observation(icao_address="drone-b", lat_dd=46.2),
+            ]
+        )
+
+        # Every reader sees the same most recent observations
+        for _ in range(2):
+            snapshot = ObservationReadOperations().get_observations_snapshot(count=2)
+            self.assertEqual([o["address"] for o in snapshot], ["drone-b", "drone-a"])
+            self.assertEqual(snapshot[0]["metadata"], {"aircraft_type": "Helicopter"})
+
+    def test_latest_observations_in_view_port(self):
+        observations = [
+            make_observation(icao_address="drone-inside", lat_dd=46.95),
+            make_observation(icao_address="drone-outside", lat_dd=47.5),
+            make_observation(icao_address="drone-invalid", lat_dd=89.5),
+        ]
+        self.observation_writer.write_observations(observations)
+
+        in_view_port = ObservationReadOperations().get_latest_observations_in_view_port(
+            view_port=[46.9, 7.4, 47.0, 7.5]
+        )
+        self.assertEqual([o["address"] for o in in_view_port], ["drone-inside"])
+        # Observations outside the range of the geo index are still kept as the latest observation
+        self.assertEqual(len(ObservationReadOperations().get_latest_observations()), 3)
+
+    def test_positions_in_view_port(self):
+        self.observation_writer.write_observations(
+            [
+                make_observation(icao_address="drone-inside", lat_dd=46.95),
+                make_observation(icao_address="drone-outside", lat_dd=47.5),
+            ]
+        )
+        (
+            aircraft_ids,
+            lats,
+            lngs,
+        ) = ObservationReadOperations().get_positions_in_view_port(
+            view_port=[46.9, 7.4, 47.0, 7.5]
+        )
+        self.assertEqual(aircraft_ids, ["drone-inside"])
+        self.assertAlmostEqual(lats[0], 46.95, places=5)
+        self.assertAlmostEqual(lngs[0], 7.47, places=5)
+
+    def test_recent_positions_are_kept_per_aircraft(self):
+        with mock.patch.dict(
+            os.environ, {"OBSERVATION_RECENT_POSITIONS_PER_AIRCRAFT": "3"}
+        ):
+            observation_writer = ObservationWriteOperations()
+        observation_writer.write_observations(
+            [make_observation("drone-a", 46.91 + i * 0.01) for i in range(4)]
+        )
+        observation_writer.write_observation(make_observation("drone-a", 46.95))
+
+        in_view_port = ObservationReadOperations().get_latest_observations_in_view_port(
+            view_port=[46.9, 7.4, 47.0, 7.5], include_recent_positions=True
+        )
+        self.assertEqual(len(in_view_port), 1)
+        recent_positions = in_view_port[0]["recent_positions"]
+        # Only the most recent positions are kept, oldest first
+        self.assertEqual([p["lat"] for p in recent_positions], [46.93, 46.94, 46.95])
+        self.assertEqual(recent_positions[-1]["lng"], 7.47)
+        self.assertEqual(recent_positions[-1]["alt"], 120000)
+        self.assertNotIn(
+            "recent_positions",
+            ObservationReadOperations().get_latest_observations_in_view_port(
+                view_port=[46.9, 7.4, 47.0, 7.5]
+            )[0],
+        )
+
+
+class ObservationConsumerTests(TestCase):
+    def setUp(self):
+        self.observation_writer = ObservationWriteOperations()
+        self.consumer_a = ObservationConsumer(group="cg-test", consumer="consumer-a")
+        self.consumer_b = ObservationConsumer(group="cg-test", consumer="consumer-b")
+        self.addCleanup(
+            self.consumer_a.db.xgroup_destroy, "all_observations", "cg-test"
+        )
+
+    def test_observations_are_delivered_once_per_group(self):
+        self.observation_writer.write_observations(
+            [
+                make_observation(icao_address="drone-" + str(i), lat_dd=46.1)
+                for i in range(4)
+            ]
+        )
+
+        observations_a = self.consumer_a.read(count=3)
+        observations_b = self.consumer_b.read(count=3)
+        self.assertEqual(
+            [o["address"] for o in observations_a + observations_b],
+            ["drone-0", "drone-1", "drone-2", "drone-3"],
+        )
+        self.assertEqual(self.consumer_a.read(), [])
+        self.assertEqual(
+            self.consumer_a.get_pending_counts(), {"consumer-a": 3, "consumer-b": 1}
+        )
+
+        self.assertEqual(self.consumer_a.ack(observations_a), 3)
+        self.assertEqual(self.consumer_a.get_pending_counts(), {"consumer-b": 1})
+
+    def test_stale_observations_are_claimed(self):
+        self.observation_writer.write_observation(
+            make_observation(icao_address="drone-a", lat_dd=46.1)
+        )
+        self.assertEqual(len(self.consumer_a.read()), 1)
+
+        # Not idle for long enough yet
+        self.assertEqual(self.consumer_b.claim_stale(min_idle_ms=60000), [])
+        claimed = self.consumer_b.claim_stale(min_idle_ms=0)
+        self.assertEqual([o["address"] for o in claimed], ["drone-a"])
+        self.assertEqual(self.consumer_b.get_pending_counts(), {"consumer-b": 1})
+        self.consumer_b.ack(claimed)
+        self.assertEqual(self.consumer_b.get_pending_counts(), {})
+
+    def test_claimed_entries_that_are_not_observations_are_acknowledged(self):
+        self.consumer_a.db.xadd("all_observations", {"placeholder": 1})
+        # Delivered to a consumer that stopped before it acknowledged the entry
+        self.consumer_a.db.xreadgroup(
+            "cg-test", "consumer-a", {"all_observations": ">"}, count=1
+        )
+        self.assertEqual(self.consumer_b.get_pending_counts(), {"consumer-a": 1})
+
+        self.assertEqual(self.consumer_b.claim_stale(min_idle_ms=0), [])
+        self.assertEqual(self.consumer_b.get_pending_counts(), {})
+
+
+class ObservationStreamRetentionTests(TestCase):
+    def setUp(self):
+        self.stream_ops = StreamHelperOps()
+        self.stream_key = "test_observations"
+        test_keys = [
+            self.stream_key,
+            AIRCRAFT_RECENT_STREAM_IDS_KEY.format(stream_key=self.stream_key),
+            AIRCRAFT_RETENTION_FLOOR_KEY.format(stream_key=self.stream_key),
+        ]
+        self.stream_ops.db.delete(*test_keys)
+        self.addCleanup(self.stream_ops.db.delete, *test_keys)
+        self.observation_writer = ObservationWriteOperations(stream_key=self.stream_key)
+        # Nothing is kept because of its age, only the recent positions of every aircraft
+        self.observation_writer.retention_policy = ObservationStreamRetentionPolicy(
+            retention_secs=0, max_length=100000, min_positions_per_aircraft=3
+        )
+
+    def _write_positions(self, icao_address: str, position_count: int) -> list:
+        message_ids = []
+        for batch_start in range(0, position_count, 100):
+            message_ids += self.observation_writer.write_observations(
+                [
+                    make_observation(icao_address=icao_address, lat_dd=46.97)
+                    for _ in range(min(100, position_count - batch_start))
+                ]
+            )
+        return message_ids
+
+    def test_stream_is_trimmed_by_time(self):
+        self._write_positions(icao_address="drone-a", position_count=1000)
+        # Trimming is approximate, whole nodes of the stream are removed
+        self.assertLess(self.stream_ops.db.xlen(self.stream_key), 300)
+
+    def test_recent_positions_of_every_aircraft_are_kept(self):
+        slow_message_ids = self._write_positions(
+            icao_address="drone-slow", position_count=5
+        )
+        self._write_positions(icao_address="drone-fast", position_count=1000)
+
+        kept_ids = [
+            message_id.decode("utf-8")
+            for message_id, _ in self.stream_ops.db.xrange(self.stream_key, count=10)
+        ]
+        for message_id in slow_message_ids[-3:]:
+            self.assertIn(message_id, kept_ids)
+
+    def test_recent_positions_of_stale_aircraft_are_not_kept(self):
+        stale_message_ids = self._write_positions(
+            icao_address="drone-stale", position_count=5
+        )
+        # Last seen longer ago than the max age, but not evicted yet
+        self.stream_ops.db.zadd(LIVE_AIRCRAFT_LAST_SEEN_KEY, {"drone-stale": 0})
+        self.addCleanup(
+            self.stream_ops.db.zrem, LIVE_AIRCRAFT_LAST_SEEN_KEY, "drone-stale"
+        )
+        with mock.patch.object(
+            flight_stream_helper, "STALE_AIRCRAFT_EVICTION_BATCH_SIZE", 0
+        ):
+            self._write_positions(icao_address="drone-fast", position_count=1000)
+
+        self.assertIsNotNone(
+            self.stream_ops.db.zscore(
+                AIRCRAFT_RETENTION_FLOOR_KEY.format(stream_key=self.stream_key),
+                "drone-stale",
+            )
+        )
+        kept_ids = [
+            message_id.decode("utf-8")
+            for message_id, _ in self.stream_ops.db.xrange(self.stream_key)
+        ]
+        for message_id in stale_message_ids:
+            self.assertNotIn(message_id, kept_ids)
+
+
+class CompactObservationEncodingTests(ObservationWriteOperationsTests):
+    """Runs the same tests with observations written in the compact encoding"""
+
+    def setUp(self):
+        super().setUp()
+        self.observation_writer.encoding = OBSERVATION_ENCODING_COMPACT
+
+    def test_encode_decode_compact(self):
+        observation = make_observation(icao_address="drone-a", lat_dd=46.3)
+        encoding, encoded_observation = encode_observation(
+            observation=observation, encoding=OBSERVATION_ENCODING_COMPACT
+        )
+        self.assertEqual(encoding, OBSERVATION_ENCODING_COMPACT)
+        self.assertLess(
+            len(encoded_observation),
+            len(encode_observation(observation, OBSERVATION_ENCODING_JSON)[1]),
+        )
+        decoded_observation = decode_observation(encoding, encoded_observation)
+        self.assertEqual(decoded_observation["icao_address"], "drone-a")
+        self.assertEqual(float(decoded_observation["lat_dd"]), 46.3)
+        self.assertEqual(decoded_observation["traffic_source"], "9")
+        self.assertEqual(decoded_observation["metadata"], observation["metadata"])
+
+    def test_compact_observation_decodes_the_same_as_json(self):
+        for altitude_mm, lat_dd in [
+            (120000, 46.3),
+            (120000.0, 46),
+            ("120000", "46.3"),
+            ("120000.50", -7.0),
+            (True, 46.3),
+        ]:
+            with self.subTest(altitude_mm=altitude_mm, lat_dd=lat_dd):
+                observation = make_observation(icao_address="drone-a", lat_dd=lat_dd)
+                observation["altitude_mm"] = altitude_mm
+                self.assertEqual(
+                    decode_observation(
+                        *encode_observation(observation, OBSERVATION_ENCODING_COMPACT)
+                    ),
+                    decode_observation(
+                        *encode_observation(observation, OBSERVATION_ENCODING_JSON)
+                    ),
+                )
+        self.assertEqual(
+            decode_observation(
+                *encode_observation(
+                    make_observation(icao_address="drone-a", lat_dd=46.3),
+                    OBSERVATION_ENCODING_COMPACT,
+                )
+            )["altitude_mm"],
+            "120000",
+        )
+
+    def test_non_numeric_observation_is_written_as_json(self):
+        observation = make_observation(icao_address="drone-a", lat_dd=46.3)
+        observation["altitude_mm"] = "No Data"
+        encoding, encoded_observation = encode_observation(
+            observation=observation, encoding=OBSERVATION_ENCODING_COMPACT
+        )
+        self.assertEqual(encoding, OBSERVATION_ENCODING_JSON)
+        self.assertEqual(
+            decode_observation(encoding, encoded_observation)["altitude_mm"],
+            "No Data",
+        )
+
+    def test_read_observations_written_with_either_encoding(self):
+        self.observation_writer.encoding = OBSERVATION_ENCODING_JSON
+        self.observation_writer.write_observation(
+            make_observation(icao_address="drone-json", lat_dd=46.95)
+        )
+        self.observation_writer.encoding = OBSERVATION_ENCODING_COMPACT
+        self.observation_writer.write_observation(
+            make_observation(icao_address="drone-compact", lat_dd=46.96)
+        )
+
+        latest_observations = ObservationReadOperations().get_latest_observations()
+        self.assertEqual(
+            {o["address"] for o in latest_observations},
+            {"drone-json", "drone-compact"},
+        )
+
+
+class ShardedObservationStreamTests(TestCase):
+    def setUp(self):
+        sharding_enabled = mock.patch.dict(
+            os.environ, {"OBSERVATION_STREAM_SHARDING": "1"}
+        )
+        sharding_enabled.start()
+        self.addCleanup(sharding_enabled.stop)
+        self.stream_ops = StreamHelperOps()
+        shard_keys = self.stream_ops.db.keys("{observations:*")
+        self.stream_ops.db.delete(
+            OBSERVATION_SHARDS_KEY, AIRCRAFT_SHARDS_KEY, *shard_keys
+        )
+        self.observation_writer = ObservationWriteOperations()
+
+    def _observation(
+        self, icao_address: str, lat_dd: float, lon_dd: float, traffic_source: int = 9
+    ):
+        observation = make_observation(icao_address=icao_address, lat_dd=lat_dd)
+        observation["lon_dd"] = lon_dd
+        observation["traffic_source"] = traffic_source
+        return observation
+
+    def test_observations_are_written_to_their_shard(self):
+        message_ids = self.observation_writer.write_observations(
+            [
+                self._observation("drone-a", 46.95, 7.45),
+                self._observation("aircraft-b", 46.95, 7.45, traffic_source=2),
+                self._observation("drone-c", 10.5, 10.5),
+            ]
+        )
+        self.assertEqual(len(message_ids), 3)
+        for shard_id, message_id in [
+            ("9:46:7", message_ids[0]),
+            ("2:46:7", message_ids[1]),
+            ("9:10:10", message_ids[2]),
+        ]:
+            stream_key = get_shard_keys(shard_id).stream
+            self.assertTrue(stream_key.startswith("{observations:%s}" % shard_id))
+            entries = self.stream_ops.db.xrange(stream_key, message_id, message_id)
+            self.assertEqual(len(entries), 1)
+
+    def test_view_port_reads_only_the_shards_it_touches(self):
+        self.observation_writer.write_observations(
+            [
+                self._observation("drone-a", 46.95, 7.45),
+                self._observation("drone-c", 10.5, 10.5),
+            ]
+        )
+        view_port = [46.9, 7.4, 47.0, 7.5]
+        self.assertEqual(
+            [
+                keys.stream
+                for keys in get_active_shard_keys(self.stream_ops.db, view_port)
+            ],
+            [get_shard_keys("9:46:7").stream],
+        )
+        in_view_port = ObservationReadOperations().get_latest_observations_in_view_port(
+            view_port=view_port
+        )
+        self.assertEqual([o["address"] for o in in_view_port], ["drone-a"])
+        self.assertEqual(len(ObservationReadOperations().get_latest_observations()), 2)
+
+    def test_aircraft_moving_to_another_shard(self):
+        self.observation_writer.write_observation(
+            self._observation("drone-a", 46.99, 7.45)
+        )
+        self.observation_writer.write_observation(
+            self._observation("drone-a", 47.01, 7.45)
+        )
+
+        latest_observations = ObservationReadOperations().get_latest_observations()
+        self.assertEqual(len(latest_observations), 1)
+        self.assertEqual(latest_observations[0]["msg_data"]["lat_dd"], "47.01")
+        # The aircraft is no longer in the shard of its previous position
+        self.assertEqual(
+            ObservationReadOperations().get_latest_observations_in_view_port(
+                view_port=[46.9, 7.4, 46.995, 7.5]
+            ),
+            [],
+        )
+
+    def test_recent_positions_move_with_the_aircraft(self):
+        self.observation_writer.write_observations(
+            [
+                self._observation("drone-a", 46.98, 7.45),
+                self._observation("drone-a", 46.99, 7.45),
+            ]
+        )
+        self.observation_writer.write_observation(
+            self._observation("drone-a", 47.01, 7.45)
+        )
+
+        in_view_port = ObservationReadOperations().get_latest_observations_in_view_port(
+            view_port=[46.9, 7.4, 47.1, 7.5], include_recent_positions=True
+        )
+        self.assertEqual(len(in_view_port), 1)
+        self.assertEqual(
+            [p["lat"] for p in in_view_port[0]["recent_positions"]],
+            [46.98, 46.99, 47.01],
+        )
+
+    def test_get_observations_from_all_shards(self):
+        self.observation_writer.write_observations(
+            [
+                self._observation("drone-a", 46.95, 7.45),
+                self._observation("drone-c", 10.5, 10.5),
+            ]
+        )
+        cg = StreamHelperOps().get_pull_cg()
+        observations = ObservationReadOperations().get_observations(cg)
+        self.assertEqual(
+            sorted(o["address"] for o in observations), ["drone-a", "drone-c"]
+        )
+        snapshot = ObservationReadOperations().get_observations_snapshot()
+        self.assertEqual(sorted(o["address"] for o in snapshot), ["drone-a", "drone-c"])
+
+    def test_consumer_reads_new_shards(self):
+        consumer = ObservationConsumer(group="cg-test", consumer="consumer-a")
+        self.assertEqual(consumer.read(), [])
+        self.observation_writer.write_observations(
+            [
+                self._observation("drone-a", 46.95, 7.45),
+                self._observation("drone-c", 10.5, 10.5),
+            ]
+        )
+        observations = consumer.read()
+        self.assertEqual(
+            sorted(o["address"] for o in observations), ["drone-a", "drone-c"]
+        )
+        self.assertEqual(consumer.ack(observations), 2)
+        self.assertEqual(consumer.get_pending_counts(), {})
+
+    def test_consumer_groups_are_created_without_placeholder_entries(self):
+        self.observation_writer.write_observation(
+            self._observation("drone-a", 46.95, 7.45)
+        )
+        stream_key = get_shard_keys("9:46:7").stream
+        stream_ops = StreamHelperOps()
+        stream_ops.create_pull_cg()
+        stream_ops.create_read_cg()
+
+        self.assertEqual(self.stream_ops.db.xlen(stream_key), 1)
+        self.assertEqual(
+            sorted(
+                group["name"] for group in self.stream_ops.db.xinfo_groups(stream_key)
+            ),
+            [b"cg-pull", b"cg-read"],
+        )
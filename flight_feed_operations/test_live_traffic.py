@@ -0,0 +1,165 @@
+import asyncio
+import json
+
+import jwt
+from django.test import TestCase
+
+from .flight_stream_helper import ObservationWriteOperations
+from .live_traffic import (
+    LIVE_AIR_TRAFFIC_PATH,
+    LiveTrafficApplication,
+    LiveTrafficHub,
+    LiveTrafficSubscription,
+    get_live_aircraft,
+)
+
+
+def make_observation(icao_address: str, lat_dd: float):
+    return {
+        "lat_dd": str(lat_dd),
+        "lon_dd": "7.45",
+        "altitude_mm": "120000",
+        "traffic_source": "9",
+        "source_type": "0",
+        "icao_address": icao_address,
+        "metadata": json.dumps({"aircraft_type": "Helicopter"}),
+    }
+
+
+class LiveTrafficSubscriptionTests(TestCase):
+    def _aircraft(self, icao_address: str, lat_dd: float):
+        return get_live_aircraft(
+            observation=make_observation(icao_address, lat_dd),
+            metadata={"aircraft_type": "Helicopter"},
+            timestamp_ms=0,
+        )
+
+    def test_deltas_of_a_view_port(self):
+        subscription = LiveTrafficSubscription(view_port=[46.9, 7.4, 47.0, 7.5])
+        subscription.push(
+            updated={
+                "drone-a": self._aircraft("drone-a", 46.95),
+                "drone-b": self._aircraft("drone-b", 47.5),
+            },
+            removed=[],
+        )
+        self.assertTrue(subscription.changed.is_set())
+        delta = subscription.pop_delta()
+        self.assertEqual(
+            [o["icao_address"] for o in delta["observations"]], ["drone-a"]
+        )
+        self.assertEqual(
+            delta["observations"][0]["metadata"], {"aircraft_type": "Helicopter"}
+        )
+        self.assertEqual(delta["removed"], [])
+        self.assertFalse(subscription.changed.is_set())
+
+        # An aircraft outside the view port that moves is not sent
+        subscription.push(
+            updated={"drone-b": self._aircraft("drone-b", 47.6)}, removed=[]
+        )
+        self.assertFalse(subscription.changed.is_set())
+
+        # Leaving the view port and no longer reporting are both removals
+        subscription.push(
+            updated={"drone-a": self._aircraft("drone-a", 47.5)}, removed=[]
+        )
+        self.assertEqual(
+            subscription.pop_delta(), {"observations": [], "removed": ["drone-a"]}
+        )
+        subscription.push(
+            updated={"drone-c": self._aircraft("drone-c", 46.95)}, removed=[]
+        )
+        subscription.push(updated={}, removed=["drone-c"])
+        self.assertEqual(
+            subscription.pop_delta(), {"observations": [], "removed": ["drone-c"]}
+        )
+
+
+class LiveTrafficHubTests(TestCase):
+    def test_subscriber_receives_new_observations(self):
+        async def subscribe_and_write():
+            hub = LiveTrafficHub()
+            subscription = await hub.subscribe(view_port=[46.9, 7.4, 47.0, 7.5])
+            subscription.pop_delta()
+            try:
+                ObservationWriteOperations().write_observations(
+                    [
+                        make_observation("live-drone-inside", 46.95),
+                        make_observation("live-drone-outside", 47.5),
+                    ]
+                )
+                await asyncio.wait_for(subscription.changed.wait(), timeout=5)
+                return subscription.pop_delta()
+            finally:
+                hub.reader_task.cancel()
+
+        delta = asyncio.run(subscribe_and_write())
+        self.assertEqual(
+            [o["icao_address"] for o in delta["observations"]], ["live-drone-inside"]
+        )
+
+
+class LiveTrafficApplicationTests(TestCase):
+    def _request(self, view: str, token: str = None):
+        headers = []
+        if token:
+            headers.append((b"authorization", ("Bearer " + token).encode("utf-8")))
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": LIVE_AIR_TRAFFIC_PATH,
+            "query_string": ("view=" + view).encode("utf-8"),
+            "headers": headers,
+        }
+        messages = []
+
+        async def receive():
+            # The client disconnects after it has received the headers and the first event
+            while len(messages) < 2:
+                await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+
+        async def django_application(scope, receive, send):
+            raise AssertionError("The request should not reach Django")
+
+        asyncio.run(
+            asyncio.wait_for(
+                LiveTrafficApplication(django_application)(scope, receive, send),
+                timeout=5,
+            )
+        )
+        return messages
+
+    def test_credentials_are_required(self):
+        messages = self._request(view="46.9,7.4,47.0,7.5")
+        self.assertEqual(messages[0]["status"], 401)
+
+    def test_invalid_view_port(self):
+        token = jwt.encode(
+            {"iss": "dummy", "scope": "blender.read"}, "secret", algorithm="HS256"
+        )
+        messages = self._request(view="46.9,7.4", token=token)
+        self.assertEqual(messages[0]["status"], 400)
+
+    def test_events_are_streamed(self):
+        ObservationWriteOperations().write_observation(
+            make_observation("live-drone-stream", 46.95)
+        )
+        token = jwt.encode(
+            {"iss": "dummy", "scope": "blender.read"}, "secret", algorithm="HS256"
+        )
+        messages = self._request(view="46.9,7.4,47.0,7.5", token=token)
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), messages[0]["headers"])
+        self.assertTrue(messages[1]["body"].startswith(b"event: delta\ndata: "))
+        self.assertIn(b"live-drone-stream", messages[1]["body"])
+
+
+class LiveAirTrafficWSGITests(TestCase):
+    def test_wsgi_request_is_not_implemented(self):
+        response = self.client.get(LIVE_AIR_TRAFFIC_PATH, {"view": "46.9,7.4,47.0,7.5"})
+        self.assertEqual(response.status_code, 501)
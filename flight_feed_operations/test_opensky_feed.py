@@ -0,0 +1,178 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from . import opensky_feed
+from .flight_stream_helper import ObservationReadOperations
+from .opensky_feed import (
+    OPENSKY_FEED_POLLER_KEY,
+    OPENSKY_FEED_VIEW_PORTS_KEY,
+    OpenSkyFeedManager,
+    get_covering_view_port,
+    get_opensky_observations,
+)
+
+
+def make_state(icao24: str, lat: float, velocity=250.5):
+    # An OpenSky state vector: icao24, callsign, origin_country, time_position, last_contact, long, lat, baro_altitude, on_ground, velocity, ...
+    return [
+        icao24,
+        "SWR1",
+        "Switzerland",
+        1,
+        1,
+        7.45,
+        lat,
+        10000.0,
+        False,
+        velocity,
+        90.0,
+        0.0,
+        None,
+        10100.0,
+        "1000",
+        False,
+        0,
+    ]
+
+
+class OpenSkyObservationsTests(TestCase):
+    def test_states_to_observations(self):
+        observations, _ = get_opensky_observations(
+            [make_state("4b1800", 46.9), make_state("4b1801", 47.1, velocity=None)]
+        )
+        self.assertEqual(
+            observations[0],
+            {
+                "lat_dd": 46.9,
+                "lon_dd": 7.45,
+                "altitude_mm": 10000.0,
+                "traffic_source": 2,
+                "source_type": 1,
+                "icao_address": "4b1800",
+                "metadata": json.dumps({"velocity": 250.5}),
+            },
+        )
+        self.assertEqual(
+            json.loads(observations[1]["metadata"]), {"velocity": "No Data"}
+        )
+
+    def test_unchanged_states_are_dropped(self):
+        observations, previous_flight_df = get_opensky_observations(
+            [make_state("4b1800", 46.9), make_state("4b1801", 47.1, velocity=None)]
+        )
+        self.assertEqual(len(observations), 2)
+
+        observations, previous_flight_df = get_opensky_observations(
+            [
+                make_state("4b1800", 46.9),
+                make_state("4b1801", 47.1, velocity=None),
+                make_state("4b1802", 47.2),
+            ],
+            previous_flight_df,
+        )
+        self.assertEqual([o["icao_address"] for o in observations], ["4b1802"])
+
+        observations, _ = get_opensky_observations(
+            [make_state("4b1800", 46.95), make_state("4b1801", 47.1, velocity=None)],
+            previous_flight_df,
+        )
+        self.assertEqual([o["icao_address"] for o in observations], ["4b1800"])
+
+    def test_unchanged_states_are_written_again_before_they_age_out(self):
+        states = [make_state("4b1800", 46.9), make_state("4b1801", 47.1)]
+        _, previous_flight_df = get_opensky_observations(states, now=1000.0)
+
+        observations, previous_flight_df = get_opensky_observations(
+            [make_state("4b1800", 46.9), make_state("4b1801", 47.15)],
+            previous_flight_df,
+            now=1020.0,
+            rewrite_after_secs=30,
+        )
+        self.assertEqual([o["icao_address"] for o in observations], ["4b1801"])
+
+        observations, _ = get_opensky_observations(
+            [make_state("4b1800", 46.9), make_state("4b1801", 47.15)],
+            previous_flight_df,
+            now=1030.0,
+            rewrite_after_secs=30,
+        )
+        self.assertEqual([o["icao_address"] for o in observations], ["4b1800"])
+
+    def test_states_outside_the_view_ports_are_dropped(self):
+        observations, _ = get_opensky_observations(
+            [make_state("4b1800", 46.9), make_state("4b1801", 47.5)],
+            view_ports=[[46.8, 7.4, 47.0, 7.5], [48.0, 7.4, 48.1, 7.5]],
+        )
+        self.assertEqual([o["icao_address"] for o in observations], ["4b1800"])
+
+
+class OpenSkyFeedManagerTests(TestCase):
+    def setUp(self):
+        self.feed_manager = OpenSkyFeedManager()
+        self.feed_manager.heartbeat = 0
+        self.feed_manager.r.delete(OPENSKY_FEED_VIEW_PORTS_KEY, OPENSKY_FEED_POLLER_KEY)
+
+    def test_covering_view_port(self):
+        self.assertEqual(
+            get_covering_view_port([[47.0, 7.5, 46.8, 7.4], [48.1, 7.45, 48.0, 7.6]]),
+            [46.8, 7.4, 48.1, 7.6],
+        )
+
+    def test_requesting_a_view_port_again_extends_it(self):
+        self.assertFalse(self.feed_manager.request_feed([46.8, 7.4, 47.0, 7.5]))
+        self.feed_manager.request_feed([46.8, 7.4, 47.0, 7.5])
+        self.feed_manager.request_feed([48.0, 7.4, 48.1, 7.5])
+        self.assertEqual(
+            self.feed_manager.get_active_view_ports(),
+            [[46.8, 7.4, 47.0, 7.5], [48.0, 7.4, 48.1, 7.5]],
+        )
+
+        self.feed_manager.r.zadd(
+            OPENSKY_FEED_VIEW_PORTS_KEY, {json.dumps([49.0, 7.4, 49.1, 7.5]): 0}
+        )
+        self.assertEqual(len(self.feed_manager.get_active_view_ports()), 2)
+
+    def test_one_query_for_all_view_ports(self):
+        self.feed_manager.request_feed([46.8, 7.4, 47.0, 7.5])
+        self.feed_manager.request_feed([48.0, 7.4, 48.1, 7.5])
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {
+            "states": [make_state("opensky-a", 46.9), make_state("opensky-b", 47.5)]
+        }
+        session = mock.Mock()
+
+        def get(*args, **kwargs):
+            # The view ports expire after the first poll
+            self.feed_manager.r.delete(OPENSKY_FEED_VIEW_PORTS_KEY)
+            return response
+
+        session.get.side_effect = get
+        with mock.patch.object(
+            opensky_feed, "get_opensky_session", return_value=session
+        ):
+            asyncio.run(self.feed_manager.run(until_idle=True))
+
+        session.get.assert_called_once()
+        self.assertEqual(
+            session.get.call_args.kwargs["params"],
+            {"lamin": 46.8, "lomin": 7.4, "lamax": 48.1, "lomax": 7.5},
+        )
+        addresses = {
+            o["address"] for o in ObservationReadOperations().get_latest_observations()
+        }
+        self.assertIn("opensky-a", addresses)
+        self.assertNotIn("opensky-b", addresses)
+        # The poller has stopped
+        self.assertFalse(self.feed_manager.r.exists(OPENSKY_FEED_POLLER_KEY))
+
+    def test_a_single_poller_runs(self):
+        self.assertTrue(OpenSkyFeedManager().acquire_poller())
+        self.feed_manager.request_feed([46.8, 7.4, 47.0, 7.5])
+        with mock.patch.object(
+            opensky_feed, "get_opensky_session"
+        ) as get_opensky_session:
+            asyncio.run(self.feed_manager.run(until_idle=True))
+        get_opensky_session.return_value.get.assert_not_called()
@@ -0,0 +1,38 @@
+from django.test import TestCase
+
+from .rid_telemetry_helper import partition_telemetry_observations_by_aircraft
+
+
+class TelemetryPartitionTests(TestCase):
+    def _observation(self, operation_id: str, serial_number: str, timestamp: str):
+        return {
+            "flight_details": {
+                "id": operation_id,
+                "uas_id": {"serial_number": serial_number},
+            },
+            "current_states": [{"timestamp": {"value": timestamp}}],
+        }
+
+    def test_partition_preserves_count_and_order(self):
+        observations = [
+            self._observation("op-1", "aircraft-a", "2023-01-01T00:00:01Z"),
+            self._observation("op-2", "aircraft-b", "2023-01-01T00:00:01Z"),
+            self._observation("op-1", "aircraft-a", "2023-01-01T00:00:02Z"),
+            self._observation("op-3", "", "2023-01-01T00:00:01Z"),
+            self._observation("op-1", "aircraft-a", "2023-01-01T00:00:03Z"),
+        ]
+        partitions = partition_telemetry_observations_by_aircraft(observations)
+
+        self.assertEqual(list(partitions.keys()), ["aircraft-a", "aircraft-b", "op-3"])
+        self.assertEqual(sum(len(p) for p in partitions.values()), len(observations))
+        self.assertEqual(
+            [
+                o["current_states"][0]["timestamp"]["value"]
+                for o in partitions["aircraft-a"]
+            ],
+            [
+                "2023-01-01T00:00:01Z",
+                "2023-01-01T00:00:02Z",
+                "2023-01-01T00:00:03Z",
+            ],
+        )
@@ -0,0 +1,131 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from django.test import TestCase
+
+from .flight_stream_helper import ObservationWriteOperations
+from .telemetry_archive import (
+    TelemetryArchiveReader,
+    TelemetryArchiver,
+    TelemetryArchiveWriter,
+)
+
+START = datetime(2023, 4, 12, 23, 50, tzinfo=timezone.utc)
+
+
+def make_stream_observation(icao_address: str, lat_dd: float, minutes: int):
+    timestamp_ms = int((START + timedelta(minutes=minutes)).timestamp() * 1000)
+    return {
+        "id": "%d-0" % timestamp_ms,
+        "msg_data": {
+            "lat_dd": str(lat_dd),
+            "lon_dd": "7.47",
+            "altitude_mm": "120000",
+            "traffic_source": "9",
+            "source_type": "0",
+            "icao_address": icao_address,
+            "metadata": json.dumps({"aircraft_type": "Helicopter"}),
+        },
+    }
+
+
+class TelemetryArchiveTests(TestCase):
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = archive_dir.name
+
+    def _write_archive(self):
+        writer = TelemetryArchiveWriter(archive_dir=self.archive_dir)
+        return writer.write_observations(
+            [
+                make_stream_observation("drone-a", 46.95, 0),
+                make_stream_observation("drone-b", 10.5, 0),
+                make_stream_observation("drone-a", 46.96, 5),
+                # The next hour
+                make_stream_observation("drone-a", 47.05, 15),
+            ]
+        )
+
+    def test_files_are_partitioned_by_hour_and_region(self):
+        paths = self._write_archive()
+        partitions = sorted(
+            os.path.relpath(os.path.dirname(path), self.archive_dir) for path in paths
+        )
+        self.assertEqual(
+            partitions,
+            [
+                os.path.join("hour=2023041223", "region=10_7"),
+                os.path.join("hour=2023041223", "region=46_7"),
+                os.path.join("hour=2023041300", "region=47_7"),
+            ],
+        )
+
+    def test_flight_track(self):
+        self._write_archive()
+        reader = TelemetryArchiveReader(archive_dir=self.archive_dir)
+        track = reader.get_flight_track(
+            "drone-a", start=START, end=START + timedelta(hours=1)
+        )
+        self.assertEqual(track["lat_dd"].tolist(), [46.95, 46.96, 47.05])
+        self.assertEqual(track["traffic_source"].tolist(), [9, 9, 9])
+
+        track = reader.get_flight_track(
+            "drone-a",
+            start=START + timedelta(minutes=1),
+            end=START + timedelta(minutes=10),
+        )
+        self.assertEqual(track["lat_dd"].tolist(), [46.96])
+
+    def test_time_and_area_window(self):
+        self._write_archive()
+        reader = TelemetryArchiveReader(archive_dir=self.archive_dir)
+        window = reader.get_observations(
+            start=START,
+            end=START + timedelta(hours=1),
+            view_port=[46.9, 7.4, 46.99, 7.5],
+        )
+        self.assertEqual(window["icao_address"].tolist(), ["drone-a", "drone-a"])
+        # Only the files of the regions in the view port are opened
+        self.assertEqual(
+            len(
+                reader.get_files(
+                    START, START + timedelta(hours=1), view_port=[46.9, 7.4, 46.99, 7.5]
+                )
+            ),
+            1,
+        )
+        self.assertEqual(
+            len(reader.get_observations(start=START, end=START + timedelta(hours=1))),
+            4,
+        )
+        self.assertTrue(
+            reader.get_observations(
+                start=START - timedelta(days=1), end=START - timedelta(hours=23)
+            ).empty
+        )
+
+    def test_archiver_writes_the_stream(self):
+        archiver = TelemetryArchiver(
+            group="cg-archive-test",
+            flush_interval_secs=0,
+            writer=TelemetryArchiveWriter(archive_dir=self.archive_dir),
+        )
+        for stream_key in archiver.consumer.stream_keys:
+            self.addCleanup(
+                archiver.consumer.db.xgroup_destroy, stream_key, "cg-archive-test"
+            )
+        written_at = datetime.now(timezone.utc)
+        ObservationWriteOperations().write_observation(
+            make_stream_observation("drone-archived", 46.95, 0)["msg_data"]
+        )
+        self.assertEqual(archiver.archive_batch(block_ms=100), 1)
+        self.assertEqual(archiver.consumer.get_pending_counts(), {})
+        track = TelemetryArchiveReader(archive_dir=self.archive_dir).get_flight_track(
+            "drone-archived",
+            start=written_at - timedelta(seconds=5),
+            end=written_at + timedelta(seconds=5),
+        )
+        self.assertEqual(track["lat_dd"].tolist(), [46.95])
@@ -0,0 +1,240 @@
+import copy
+import json
+from dataclasses import asdict
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+
+from encoders import DateTimeEncoder
+from flight_feed_operations.serializers import TelemetryRequestSerializer
+from flight_feed_operations.telemetry_decoder import (
+    TelemetryValidationError,
+    compile_decoder,
+    decode_telemetry_request,
+)
+
+from .rid_telemetry_helper import (
+    NestedDict,
+    current_state_json_to_object,
+    flight_detail_json_to_object,
+)
+
+
+def make_telemetry_payload():
+    return {
+        "observations": [
+            {
+                "current_states": [
+                    {
+                        "timestamp": {
+                            "value": "1985-04-12T23:20:50.52Z",
+                            "format": "RFC3339",
+                        },
+                        "timestamp_accuracy": 0,
+                        "operational_status": "Undeclared",
+                        "position": {
+                            "lat": 34.12,
+                            "lng": -118.456,
+                            "alt": 1321.2,
+                            "accuracy_h": "HAUnknown",
+                            "accuracy_v": "VAUnknown",
+                            "extrapolated": True,
+                            "pressure_altitude": 0,
+                        },
+                        "track": 0,
+                        "speed": 1.9,
+                        "speed_accuracy": "SAUnknown",
+                        "vertical_speed": 0.2,
+                        "height": {"distance": 0, "reference": "TakeoffLocation"},
+                        "group_count": 1,
+                        "group_time_start": "2019-08-24T14:15:22Z",
+                    }
+                ],
+                "flight_details": {
+                    "rid_details": {
+                        "id": "a3423b-213401-0023",
+                        "operator_id": "N.OP123456",
+                        "operation_description": "Survey",
+                    },
+                    "eu_classification": {
+                        "category": "EUCategoryUndefined",
+                        "class": "EUClassUndefined",
+                    },
+                    "uas_id": {
+                        "serial_number": "INTCJ123-4567-890",
+                        "registration_id": "N.123456",
+                        "utm_id": "ae1fa066-6d68-4018-8274-af867966978e",
+                    },
+                    "operator_location": {
+                        "position": {"lng": -118.456, "lat": 34.12},
+                        "altitude": 19.5,
+                        "altitude_type": "Takeoff",
+                    },
+                    "auth_data": {"format": "string", "data": 34},
+                    "serial_number": "INTCJ123-4567-890",
+                    "registration_number": "FA12345897",
+                },
+            }
+        ]
+    }
+
+
+def decode_with_serializer(json_payload):
+    """The telemetry request as it was decoded with TelemetryRequestSerializer"""
+    serializer = TelemetryRequestSerializer(data=json_payload)
+    if not serializer.is_valid():
+        return None, json.loads(json.dumps(serializer.errors))
+    observations = []
+    for observation in serializer.validated_data["observations"]:
+        flight_details = flight_detail_json_to_object(
+            json.loads(json.dumps(observation["flight_details"]))
+        )
+        current_states = [
+            current_state_json_to_object(state)
+            for state in json.loads(
+                json.dumps(observation["current_states"], cls=DateTimeEncoder)
+            )
+        ]
+        observations.append(
+            {"current_states": current_states, "flight_details": flight_details}
+        )
+    return observations, None
+
+
+class TelemetryDecoderTests(TestCase):
+    def assertDecodedAsSerializer(self, json_payload):
+        observations, errors = decode_telemetry_request(
+            json.dumps(json_payload).encode("utf-8")
+        )
+        expected_observations, expected_errors = decode_with_serializer(json_payload)
+        self.assertEqual(errors, expected_errors)
+        if expected_observations is None:
+            self.assertIsNone(observations)
+            return errors
+        self.assertEqual(
+            [asdict(o, dict_factory=NestedDict) for o in observations],
+            [
+                {
+                    "current_states": [
+                        asdict(s, dict_factory=NestedDict) for s in o["current_states"]
+                    ],
+                    "flight_details": asdict(
+                        o["flight_details"], dict_factory=NestedDict
+                    ),
+                }
+                for o in expected_observations
+            ],
+        )
+        return errors
+
+    def _mutated_payload(self, path, value):
+        payload = make_telemetry_payload()
+        target = payload
+        for key in path[:-1]:
+            target = target[key]
+        if value is KeyError:
+            del target[path[-1]]
+        else:
+            target[path[-1]] = value
+        return payload
+
+    def test_valid_payloads(self):
+        self.assertIsNone(self.assertDecodedAsSerializer(make_telemetry_payload()))
+        state = ["observations", 0, "current_states", 0]
+        for path, value in [
+            (state + ["timestamp", "value"], "2023-04-12T23:20:50+02:00"),
+            (state + ["timestamp", "value"], "2023-04-12T23:20:50"),
+            (state + ["timestamp", "format"], KeyError),
+            (state + ["position", "lat"], "46.97"),
+            (state + ["position", "extrapolated"], "yes"),
+            (state + ["position", "pressure_altitude"], KeyError),
+            (state + ["group_count"], "2.0"),
+            (state + ["height", "reference"], 1),
+            (["observations", 0, "flight_details", "auth_data"], {}),
+            (["observations", 0, "flight_details", "rid_details", "id"], " abc "),
+        ]:
+            with self.subTest(path=path, value=value):
+                self.assertIsNone(
+                    self.assertDecodedAsSerializer(self._mutated_payload(path, value))
+                )
+
+    def test_invalid_payloads(self):
+        for json_payload in [{}, [], {"observations": "x"}, {"observations": [None]}]:
+            with self.subTest(json_payload=json_payload):
+                self.assertIsNotNone(self.assertDecodedAsSerializer(json_payload))
+
+        state = ["observations", 0, "current_states", 0]
+        flight_details = ["observations", 0, "flight_details"]
+        for path, value in [
+            (state[:-1], [{}]),
+            (state[:-1], [None, "x"]),
+            (state + ["timestamp", "value"], "yesterday"),
+            (state + ["timestamp", "value"], 1985),
+            (state + ["operational_status"], ""),
+            (state + ["operational_status"], {"a": 1}),
+            (state + ["position", "lat"], "north"),
+            (state + ["position", "lat"], "1" * 1001),
+            (state + ["position", "accuracy_h"], None),
+            (state + ["position", "extrapolated"], "maybe"),
+            (state + ["position", "extrapolated"], []),
+            (state + ["speed"], KeyError),
+            (state + ["height"], {}),
+            (state + ["height"], "high"),
+            (state + ["group_count"], 1.5),
+            (flight_details + ["rid_details", "id"], ""),
+            (flight_details + ["rid_details", "id"], True),
+            (flight_details + ["rid_details", "id"], "a\x00b"),
+            (flight_details + ["uas_id", "serial_number"], ["a"]),
+            (flight_details + ["auth_data", "data"], "1.5"),
+            (flight_details + ["operator_location"], "here"),
+            (flight_details, KeyError),
+        ]:
+            with self.subTest(path=path, value=value):
+                self.assertIsNotNone(
+                    self.assertDecodedAsSerializer(self._mutated_payload(path, value))
+                )
+
+    def test_no_data(self):
+        self.assertEqual(
+            decode_telemetry_request(b"null"),
+            (None, {"non_field_errors": ["No data provided"]}),
+        )
+
+    def test_invalid_json(self):
+        for body in [b"", b"{", b'{"observations": NaN}', b"\xff"]:
+            with self.subTest(body=body):
+                with self.assertRaises(ParseError):
+                    decode_telemetry_request(body)
+
+
+class SerializerFieldsTests(TestCase):
+    def test_decoder_follows_the_serializer_fields(self):
+        class HeightSerializer(serializers.Serializer):
+            distance = serializers.FloatField()
+            reference = serializers.CharField()
+            accuracy = serializers.IntegerField(required=False, default=3)
+
+        decoder = compile_decoder(HeightSerializer())
+        self.assertEqual(
+            decoder.decode({"distance": "1.5", "reference": "W84"}),
+            {"distance": 1.5, "reference": "W84", "accuracy": 3},
+        )
+        json_payload = {"reference": "", "accuracy": "x"}
+        serializer = HeightSerializer(data=json_payload)
+        self.assertFalse(serializer.is_valid())
+        with self.assertRaises(TelemetryValidationError) as e:
+            decoder.decode(json_payload)
+        self.assertEqual(e.exception.detail, json.loads(json.dumps(serializer.errors)))
+
+    def test_unsupported_fields_are_rejected(self):
+        for field in [
+            serializers.CharField(max_length=10),
+            serializers.FloatField(allow_null=True),
+            serializers.IntegerField(min_value=0),
+            serializers.UUIDField(),
+        ]:
+            with self.subTest(field=field):
+                with self.assertRaises(ImproperlyConfigured):
+                    compile_decoder(field)
@@ -0,0 +1,188 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase
+
+from flight_feed_operations import telemetry_replay
+from flight_feed_operations.data_definitions import ReplayObservation
+from flight_feed_operations.telemetry_archive import (
+    TelemetryArchiveReader,
+    TelemetryArchiveWriter,
+)
+
+RID_TEST_INJECTION_PATH = os.path.join(
+    settings.BASE_DIR, "importers", "rid_samples", "flight_1_rid_test_v19.json"
+)
+
+
+class FakeWallClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+
+
+def make_air_traffic_observation(icao_address: str, timestamp_ms: int):
+    return ReplayObservation(
+        timestamp_ms=timestamp_ms,
+        observation={
+            "lat_dd": 46.97,
+            "lon_dd": 7.47,
+            "altitude_mm": 120000,
+            "traffic_source": 9,
+            "source_type": 0,
+            "icao_address": icao_address,
+            "metadata": {"aircraft_type": "Helicopter"},
+        },
+    )
+
+
+class TelemetryReplayTests(TestCase):
+    def setUp(self):
+        self.wall_clock = FakeWallClock()
+        patcher = mock.patch.object(
+            telemetry_replay, "write_incoming_air_traffic_data_bulk"
+        )
+        self.write_air_traffic = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(telemetry_replay, "stream_rid_telemetry_data")
+        self.write_telemetry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_replayer(self, observations, speed):
+        clock = telemetry_replay.VirtualClock(
+            speed=speed,
+            monotonic=self.wall_clock.monotonic,
+            sleep=self.wall_clock.sleep,
+        )
+        return telemetry_replay.TelemetryReplayer(
+            observations, tick_secs=0.1, use_task_queue=False, clock=clock
+        )
+
+    def test_recorded_time_is_replayed_faster(self):
+        # Ten minutes of one observation every ten seconds
+        observations = [
+            make_air_traffic_observation("drone-a", i * 10000) for i in range(60)
+        ]
+        stats = self._get_replayer(observations, speed=100).replay()
+
+        self.assertEqual(stats.observations, 60)
+        self.assertEqual(stats.batches, 60)
+        self.assertAlmostEqual(self.wall_clock.now, 5.9)
+        self.assertAlmostEqual(stats.max_lag_secs, 0)
+        self.assertEqual(self.write_air_traffic.call_count, 60)
+
+    def test_observations_due_in_a_tick_are_written_together(self):
+        # At 10x a tick is a recorded second: the first observation, then ten observations a tick
+        observations = [
+            make_air_traffic_observation("drone-%s" % (i % 3), i * 100)
+            for i in range(100)
+        ]
+        stats = self._get_replayer(observations, speed=10).replay()
+
+        self.assertEqual(stats.batches, 11)
+        written = [
+            json.loads(call.args[0]) for call in self.write_air_traffic.call_args_list
+        ]
+        self.assertEqual(sum(len(batch) for batch in written), 100)
+        self.assertEqual(
+            json.loads(written[0][0]["metadata"]), {"aircraft_type": "Helicopter"}
+        )
+
+    def test_rid_test_injection_is_restamped(self):
+        observations = telemetry_replay.load_replay_file(RID_TEST_INJECTION_PATH)
+        self.assertEqual(len(observations), 83)
+        before = datetime.now(timezone.utc)
+        self._get_replayer(observations, speed=100).replay()
+
+        batch = json.loads(self.write_air_traffic.call_args_list[-1].args[0])
+        metadata = json.loads(batch[0]["metadata"])
+        self.assertEqual(
+            metadata["details_response"]["details"]["id"],
+            "d50598bc-638a-4f52-bf3f-dd85595fb52e",
+        )
+        self.assertGreaterEqual(
+            datetime.fromisoformat(metadata["telemetry"]["timestamp"]), before
+        )
+        # The recording is not changed by the replay
+        self.assertEqual(
+            observations[0].observation["metadata"]["telemetry"]["timestamp"],
+            "2023-04-27T18:29:03.300752Z",
+        )
+
+    def test_archived_rid_telemetry_is_written_as_telemetry(self):
+        start = datetime(2023, 4, 12, 23, 50, tzinfo=timezone.utc)
+        start_ms = int(start.timestamp() * 1000)
+        current_state = {
+            "timestamp": {"value": "2023-04-12T23:50:00Z", "format": "RFC3339"},
+            "position": {"lat": 46.97, "lng": 7.47, "alt": 620.0},
+        }
+        flight_details = {
+            "id": "a3423b-213401-0023",
+            "uas_id": {"serial_number": "INTCJ123-4567-890"},
+        }
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        TelemetryArchiveWriter(archive_dir=archive_dir.name).write_observations(
+            [
+                {
+                    "id": "%d-0" % (start_ms + i * 1000),
+                    "msg_data": {
+                        "lat_dd": "46.97",
+                        "lon_dd": "7.47",
+                        "altitude_mm": "620.0",
+                        "traffic_source": "11",
+                        "source_type": "0",
+                        "icao_address": "INTCJ123-4567-890",
+                        "metadata": json.dumps(
+                            {
+                                "current_state": current_state,
+                                "flight_details": flight_details,
+                            }
+                        ),
+                    },
+                }
+                for i in range(3)
+            ]
+        )
+        observations = telemetry_replay.load_archive_observations(
+            start=start,
+            end=start + timedelta(minutes=1),
+            reader=TelemetryArchiveReader(archive_dir=archive_dir.name),
+        )
+        self.assertEqual(
+            [o.timestamp_ms for o in observations],
+            [start_ms, start_ms + 1000, start_ms + 2000],
+        )
+        self._get_replayer(observations, speed=10).replay()
+
+        self.assertFalse(self.write_air_traffic.called)
+        self.assertEqual(self.write_telemetry.call_count, 3)
+        telemetry_observations = json.loads(
+            self.write_telemetry.call_args.kwargs["rid_telemetry_observations"]
+        )
+        self.assertEqual(telemetry_observations[0]["flight_details"], flight_details)
+        self.assertNotEqual(
+            telemetry_observations[0]["current_states"][0]["timestamp"]["value"],
+            "2023-04-12T23:50:00Z",
+        )
+
+    def test_repeated_recordings_follow_each_other(self):
+        observations = [
+            make_air_traffic_observation("drone-a", 0),
+            make_air_traffic_observation("drone-a", 5000),
+        ]
+        repeated = telemetry_replay.repeat_observations(observations, 3)
+        self.assertEqual(
+            [o.timestamp_ms for o in repeated], [0, 5000, 6000, 11000, 12000, 17000]
+        )
@@ -7,6 +7,7 @@ urlpatterns = [
     path('start_opensky_feed', flight_feed_views.start_opensky_feed),
     path('set_telemetry', flight_feed_views.set_telemetry,name="set_telemetry"),
     path('set_signed_telemetry', flight_feed_views.set_signed_telemetry),    
+    path('live_air_traffic', flight_feed_views.live_air_traffic),
     path('public_keys/', flight_feed_views.SignedTelmetryPublicKeyList.as_view()),
     path('public_keys/<uuid:pk>/', flight_feed_views.SignedTelmetryPublicKeyDetail.as_view()),
     
@@ -1,7 +1,7 @@
 # Create your views here.
-import io
 import json
 import logging
+import os
 from dataclasses import asdict
 
 from typing import List
@@ -10,7 +10,9 @@ from django.http import JsonResponse
 from django.views.generic import TemplateView
 from rest_framework.decorators import api_view
 
+from auth_helper.common import get_redis_pool_stats
 from auth_helper.utils import requires_scopes
+from common.http_client import http_client
 from rid_operations import view_port_ops
 from rid_operations.data_definitions import (
     RIDAircraftState,
@@ -24,7 +26,8 @@ from .data_definitions import (
     FlightObservationsProcessingResponse,
     SingleAirtrafficObservation,
 )
-from .tasks import start_openskies_stream, write_incoming_air_traffic_data
+from .opensky_feed import OpenSkyFeedManager
+from .tasks import start_openskies_stream, write_incoming_air_traffic_data_bulk
 
 
 from os import environ as env
@@ -34,23 +37,16 @@ from django.utils.decorators import method_decorator
 from dotenv import find_dotenv, load_dotenv
 from jwcrypto import jwk
 from rest_framework import generics, status
-from rest_framework.parsers import JSONParser
-
-from encoders import DateTimeEncoder
 
 from .models import SignedTelmetryPublicKey
 from security.signing import MessageVerifier, ResponseSigner
 from .rid_telemetry_helper import (
     BlenderTelemetryValidator,
     NestedDict,
-    current_state_json_to_object,
-    flight_detail_json_to_object,
-)
-from .serializers import (
-    SignedTelmetryPublicKeySerializer,
-    TelemetryRequest,
-    TelemetryRequestSerializer,
+    partition_telemetry_observations_by_aircraft,
 )
+from .serializers import SignedTelmetryPublicKeySerializer
+from .telemetry_decoder import decode_telemetry_request
 logger = logging.getLogger("django")
 
 ENV_FILE = find_dotenv()
@@ -97,6 +93,23 @@ def ping_with_auth(request):
     return JsonResponse({"message":"pong with auth"}, status=200)
 
 
+@api_view(["GET"])
+@requires_scopes(["blender.read"])
+def redis_pool_stats(request):
+    """The Redis connection pools of the process that served the request, every web worker has its own pools"""
+    pool_stats = [asdict(stats) for stats in get_redis_pool_stats()]
+    return JsonResponse({"pid": os.getpid(), "pools": pool_stats}, status=200)
+
+
+@api_view(["GET"])
+@requires_scopes(["blender.read"])
+def dss_http_stats(request):
+    """The latency of the DSS and USS endpoints called by the process that served the request and the state of the circuit breaker of every host"""
+    endpoint_stats = [asdict(stats) for stats in http_client.get_endpoint_stats()]
+    circuit_states = [asdict(state) for state in http_client.get_circuit_states()]
+    return JsonResponse({"pid": os.getpid(), "endpoints": endpoint_stats, "circuits": circuit_states}, status=200)
+
+
 @api_view(["POST"])
 @requires_scopes(["blender.write"])
 def set_air_traffic(request):
@@ -121,6 +134,8 @@ def set_air_traffic(request):
         m = asdict(msg)
         return JsonResponse(m, status=m["status"])
 
+    # Validate all the observations first and then submit them as a single batch
+    all_observations: List[dict] = []
     for observation in observations:
         try:
             lat_dd = observation["lat_dd"]
@@ -150,10 +165,12 @@ def set_air_traffic(request):
             icao_address=icao_address,
             metadata=json.dumps(metadata),
         )
+        all_observations.append(asdict(so))
 
-        msgid = write_incoming_air_traffic_data.delay(
-            json.dumps(asdict(so))
-        )  # Send a job to the task queue
+    if all_observations:
+        write_incoming_air_traffic_data_bulk.delay(
+            json.dumps(all_observations)
+        )  # Send one job to the task queue for the whole request
 
     op = FlightObservationsProcessingResponse(message="OK", status=200)
     return JsonResponse(asdict(op), status=op.status)
@@ -195,38 +212,15 @@ def get_air_traffic(request):
     vertex_list.pop()
 
     if view_port_valid:
-        stream_ops = flight_stream_helper.StreamHelperOps()
-        pull_cg = stream_ops.get_pull_cg()
-        all_streams_messages = pull_cg.read()
+        obs_helper = flight_stream_helper.ObservationReadOperations()
+        distinct_messages = obs_helper.get_latest_observations_in_view_port(
+            view_port=view_port
+        )
 
-        unique_flights = []
-        # Keep only the latest message
-        try:
-            for message in all_streams_messages:
-                unique_flights.append(
-                    {
-                        "timestamp": message.timestamp,
-                        "seq": message.sequence,
-                        "msg_data": message.data,
-                        "address": message.data["icao_address"],
-                    }
-                )
-            # sort by date
-            unique_flights.sort(key=lambda item: item["timestamp"], reverse=True)
-            # Keep only the latest message
-            distinct_messages = {
-                i["address"]: i for i in reversed(unique_flights)
-            }.values()
-
-        except KeyError as ke:
-            logger.error(
-                "Error in sorting distinct messages, ICAO name not defined %s" % ke
-            )
-            distinct_messages = []
         all_traffic_observations: List[SingleAirtrafficObservation] = []
         for observation in distinct_messages:
             observation_data = observation["msg_data"]
-            observation_metadata = json.loads(observation_data["metadata"])
+            observation_metadata = observation["metadata"]
             so = SingleAirtrafficObservation(
                 lat_dd=observation_data["lat_dd"],
                 lon_dd=observation_data["lon_dd"],
@@ -252,10 +246,37 @@ def get_air_traffic(request):
         )
 
 
+@requires_scopes(["blender.read"])
+def authorize_live_air_traffic(request):
+    """Authorizes a subscription to live air traffic and validates its view port, the events are streamed by the ASGI application (see flight_feed_operations.live_traffic)"""
+    try:
+        view = request.GET["view"]
+        view_port = [float(i) for i in view.split(",")]
+    except Exception as ke:
+        incorrect_parameters = {
+            "message": "A view bbox is necessary with four values: minx, miny, maxx and maxy"
+        }
+        return JsonResponse(incorrect_parameters, status=400)
+
+    if not view_port_ops.check_view_port(view_port_coords=view_port):
+        view_port_error = {"message": "A incorrect view port bbox was provided"}
+        return JsonResponse(view_port_error, status=400)
+
+    return JsonResponse({"view_port": view_port}, status=200)
+
+
+def live_air_traffic(request):
+    """Live air traffic is streamed only by the ASGI application, this view answers the requests that reach it through a WSGI server"""
+    not_implemented = {
+        "message": "Live air traffic is served by the ASGI application (flight_blender.asgi:application), it is not available on a WSGI server"
+    }
+    return JsonResponse(not_implemented, status=501)
+
+
 @api_view(["GET"])
 @requires_scopes(["blender.read"])
 def start_opensky_feed(request):
-    # This method takes in a view port as a lat1,lon1,lat2,lon2 co-ordinate system and for 60 seconds starts the stream of data from the OpenSky Network.
+    # This method takes in a view port as a lat1,lon1,lat2,lon2 co-ordinate system and for 60 seconds adds it to the stream of data from the OpenSky Network.
 
     try:
         view = request.query_params["view"]
@@ -274,7 +295,10 @@ def start_opensky_feed(request):
     view_port_valid = view_port_ops.check_view_port(view_port_coords=view_port)
 
     if view_port_valid:
-        start_openskies_stream.delay(view_port=json.dumps(view_port))
+        # The view port is added to the running feed, a poller is only started if none is running
+        my_feed_manager = OpenSkyFeedManager()
+        if not my_feed_manager.request_feed(view_port=view_port):
+            start_openskies_stream.delay(view_port=json.dumps(view_port))
 
         return JsonResponse(
             {"message": "Openskies Newtork stream started"},
@@ -389,9 +413,9 @@ def set_signed_telemetry(request):
                 asdict(single_observation_set, dict_factory=NestedDict)
             )
 
-            stream_rid_telemetry_data.delay(
-                rid_telemetry_observations=json.dumps(unsigned_telemetry_observations)
-            )
+        _submit_telemetry_observations(
+            telemetry_observations=unsigned_telemetry_observations
+        )
         submission_success = {"message": "Telemetry data successfully submitted"}
         content_digest = response_signer.generate_content_digest(submission_success)
         signed_data = response_signer.sign_json_via_django(submission_success)
@@ -405,40 +429,19 @@ def set_signed_telemetry(request):
         return response
 
 
-def _parse_telemetry_request(json_payload):
+def _submit_telemetry_observations(telemetry_observations: List[dict]):
     """
-    Validate the JSON payload to make sure all required fields are provided and the flight times are in proper order
+    Submit the telemetry observations of a request to the task queue, one job is sent per aircraft with all the observations of that aircraft
     """
-    error = None
-    telemetry_request = None
-    serializer = TelemetryRequestSerializer(data=json_payload)
-    if not serializer.is_valid():
-        error = serializer.errors
-        return telemetry_request, error
-
-    validated_data = serializer.validated_data
-    telemetry_request = serializer.create(validated_data)
-    return telemetry_request, error
-
-
-def _get_flight_details_from_observation(observation: TelemetryRequest):
-    flight_details = observation["flight_details"]
-    flight_details_json_str = json.dumps(flight_details)
-    flight_details_json = json.loads(flight_details_json_str)
-
-    parsed_flight_details = flight_detail_json_to_object(flight_details_json)
-    return parsed_flight_details
-
-
-def _get_current_states_from_observation(observation: TelemetryRequest):
-    states = observation["current_states"]
-    states_json_str = json.dumps(states, cls=DateTimeEncoder)
-    states_json = json.loads(states_json_str)
-    current_states: List[RIDAircraftState] = []
-    for state_json in states_json:
-        current_state = current_state_json_to_object(state_json)
-        current_states.append(current_state)
-    return current_states
+    partitions = partition_telemetry_observations_by_aircraft(
+        telemetry_observations=telemetry_observations
+    )
+    for aircraft_observations in partitions.values():
+        stream_rid_telemetry_data.delay(
+            rid_telemetry_observations=json.dumps(
+                aircraft_observations, separators=(",", ":")
+            )
+        )
 
 
 @api_view(["PUT"])
@@ -448,11 +451,8 @@ def set_telemetry(request: HttpRequest):
     A RIDOperatorDetails object is posted here
     This endpoints receives data from GCS and / or flights and processes remote ID data.
     """
-    # TODO: Use dacite to parse incoming json into a dataclass
-    stream = io.BytesIO(request.body)
-    json_payload = JSONParser().parse(stream)
-
-    parsed_telemetry_request, parse_error = _parse_telemetry_request(json_payload)
+    # The request body is validated and decoded to the observations in a single pass
+    observations, parse_error = decode_telemetry_request(request.body)
     if parse_error:
         return HttpResponse(
             json.dumps(parse_error),
@@ -460,27 +460,13 @@ def set_telemetry(request: HttpRequest):
             content_type="application/json",
         )
 
-    unsigned_telemetry_observations: List[SignedUnSignedTelemetryObservations] = []
-    observations = parsed_telemetry_request.observations
-    for observation in observations:
-        flight_details = _get_flight_details_from_observation(observation)
-        current_states: List[RIDAircraftState] = _get_current_states_from_observation(
-            observation
-        )
-
-        single_observation_set = SignedUnSignedTelemetryObservations(
-            current_states=current_states, flight_details=flight_details
-        )
-
-        unsigned_telemetry_observations.append(
-            asdict(single_observation_set, dict_factory=NestedDict)
-        )
-        unsigned_telemetry_observations_str = json.dumps(
-            unsigned_telemetry_observations
-        )
-        stream_rid_telemetry_data.delay(
-            rid_telemetry_observations=unsigned_telemetry_observations_str
-        )
+    unsigned_telemetry_observations = [
+        asdict(single_observation_set, dict_factory=NestedDict)
+        for single_observation_set in observations
+    ]
+    _submit_telemetry_observations(
+        telemetry_observations=unsigned_telemetry_observations
+    )
     submission_success = {"message": "Telemetry data successfully submitted"}
     return JsonResponse(
         submission_success,
@@ -0,0 +1,92 @@
+import math
+from typing import List
+
+import numpy as np
+
+from .rid_utils import ClusterCorner, ClusterDetails
+
+EARTH_RADIUS_M = 6371008.8
+KM_PER_DEGREE = 111.32
+# Above this view port diagonal only clusters are shown (NetDetailsMaxDisplayAreaDiagonal in ASTM F3411)
+DETAILS_MAX_DISPLAY_AREA_DIAGONAL_KM = 2
+# The width and the height of a cluster are at least this share of the view port diagonal (NetMinClusterSize in ASTM F3411)
+MIN_CLUSTER_SIZE_PERCENT = 15
+
+
+def get_view_port_diagonal_km(view_port: List[float]) -> float:
+    """The (approximate) length of the diagonal of a view port (lat1, lng1, lat2, lng2) in km"""
+    lat_min = min(view_port[0], view_port[2])
+    lat_max = max(view_port[0], view_port[2])
+    height_km = (lat_max - lat_min) * KM_PER_DEGREE
+    width_km = (
+        abs(view_port[3] - view_port[1])
+        * KM_PER_DEGREE
+        * math.cos(math.radians((lat_min + lat_max) / 2))
+    )
+    return math.hypot(height_km, width_km)
+
+
+def show_clusters_only(view_port: List[float]) -> bool:
+    return get_view_port_diagonal_km(view_port) > DETAILS_MAX_DISPLAY_AREA_DIAGONAL_KM
+
+
+def get_clusters(
+    view_port: List[float], lats: List[float], lngs: List[float]
+) -> List[ClusterDetails]:
+    """
+    Cluster the aircraft positions in a view port (lat1, lng1, lat2, lng2) on a grid of cells that are at least MIN_CLUSTER_SIZE_PERCENT of the view port diagonal wide and high. Every cell with aircraft is a cluster with the corners of the cell, so the number of clusters does not depend on the number of aircraft and the position of a single aircraft is not given away
+    """
+    lat_min = min(view_port[0], view_port[2])
+    lat_max = max(view_port[0], view_port[2])
+    lng_min = min(view_port[1], view_port[3])
+    lng_max = max(view_port[1], view_port[3])
+    if not len(lats):
+        return []
+
+    diagonal_km = get_view_port_diagonal_km(view_port)
+    min_cluster_size_km = diagonal_km * MIN_CLUSTER_SIZE_PERCENT / 100
+    height_km = (lat_max - lat_min) * KM_PER_DEGREE
+    width_km = (
+        (lng_max - lng_min)
+        * KM_PER_DEGREE
+        * math.cos(math.radians((lat_min + lat_max) / 2))
+    )
+    lat_cells = max(1, int(height_km // min_cluster_size_km)) if diagonal_km else 1
+    lng_cells = max(1, int(width_km // min_cluster_size_km)) if diagonal_km else 1
+    lat_edges = np.linspace(lat_min, lat_max, lat_cells + 1)
+    lng_edges = np.linspace(lng_min, lng_max, lng_cells + 1)
+    counts, _, _ = np.histogram2d(
+        np.asarray(lats, dtype=float),
+        np.asarray(lngs, dtype=float),
+        bins=[lat_edges, lng_edges],
+    )
+
+    lat_indices, lng_indices = np.nonzero(counts)
+    south = lat_edges[lat_indices]
+    north = lat_edges[lat_indices + 1]
+    west = lng_edges[lng_indices]
+    east = lng_edges[lng_indices + 1]
+    # The area of a cell on the sphere
+    areas_sqm = (
+        EARTH_RADIUS_M**2
+        * (np.sin(np.radians(north)) - np.sin(np.radians(south)))
+        * np.radians(east - west)
+    )
+    return [
+        ClusterDetails(
+            corners=[
+                ClusterCorner(lat=float(s), lng=float(w)),
+                ClusterCorner(lat=float(n), lng=float(e)),
+            ],
+            area_sqm=float(area_sqm),
+            number_of_flights=int(count),
+        )
+        for s, w, n, e, area_sqm, count in zip(
+            south,
+            west,
+            north,
+            east,
+            areas_sqm,
+            counts[lat_indices, lng_indices],
+        )
+    ]
@@ -9,7 +9,8 @@ import uuid
 from auth_helper import dss_auth_helper
 import json
 from auth_helper.common import get_redis
-import requests
+from flight_feed_operations import flight_stream_helper
+from common.http_client import http_client
 import hashlib
 import tldextract
 from os import environ as env
@@ -72,7 +73,7 @@ class RemoteIDOperations():
             p = ISACreationRequest(extents= flight_extents, flights_url= flights_url)
             p_dict = asdict(p)
             try:
-                dss_r = requests.put(dss_isa_create_url, json= json.loads(json.dumps(p_dict)), headers=headers)
+                dss_r = http_client.put(dss_isa_create_url, json= json.loads(json.dumps(p_dict)), headers=headers)
             except Exception as re:
                 logger.error("Error in posting to subscription URL %s " % re)
                 return isa_creation_response
@@ -127,7 +128,7 @@ class RemoteIDOperations():
                     auth_credentials = my_authorization_helper.get_cached_credentials(audience = uss_audience, token_type='rid')            
                     headers = {'content-type': 'application/json', 'Authorization': 'Bearer ' + auth_credentials['access_token']}                        
                     try: 
-                        notification_request = requests.post(url, headers=headers, json =json.loads(json.dumps(payload)))                            
+                        notification_request = http_client.post(url, headers=headers, json =json.loads(json.dumps(payload)))                            
                     except Exception as re:
                         logger.error("Error in sending subscriber notification to %s :  %s " % (url, re))
                     
@@ -197,7 +198,7 @@ class RemoteIDOperations():
             payload = {"extents": volume_object, "callbacks":{"identification_service_area_url":callback_url}}
 
             try:
-                dss_r = requests.put(dss_subscription_url, json= payload, headers=headers)
+                dss_r = http_client.put(dss_subscription_url, json= payload, headers=headers)
             except Exception as re:
                 logger.error("Error in posting to subscription URL %s " % re)
                 return subscription_response
@@ -251,7 +252,7 @@ class RemoteIDOperations():
 
         pass
 
-    def query_uss_for_rid(self, flights_dict, all_observations, subscription_id:str):
+    def query_uss_for_rid(self, flights_dict, subscription_id:str):
         
         authority_credentials = dss_auth_helper.AuthorityCredentialsGetter()        
         all_flights_urls_string = flights_dict['all_flights_url']        
@@ -270,12 +271,13 @@ class RemoteIDOperations():
             
             auth_credentials = authority_credentials.get_cached_credentials(audience = audience, token_type='rid')            
             headers = {'content-type': 'application/json', 'Authorization': 'Bearer ' + auth_credentials['access_token']}                        
-            flights_request = requests.get(cur_flight_url, headers=headers)
+            flights_request = http_client.get(cur_flight_url, headers=headers)
             
             if flights_request.status_code == 200:
                 # https://redocly.github.io/redoc/?url=https://raw.githubusercontent.com/uastech/standards/astm_rid_1.0/remoteid/canonical.yaml#tag/p2p_rid/paths/~1v1~1uss~1flights/get
                 flights_response = flights_request.json()                
                 all_flights = flights_response['flights']
+                all_flight_observations = []
                 for flight in all_flights:
                     flight_id = flight['id']                    
                     try: 
@@ -295,10 +297,11 @@ class RemoteIDOperations():
                             # check if lat / lng / alt existis
                             single_observation = {"icao_address" : flight_id,"traffic_source" :1, "source_type" : 1, "lat_dd" : position['lat'], "lon_dd" : position['lng'], "altitude_mm" : position['alt'],'metadata':json.dumps(flight_metadata)}
                             # write incoming data directly
-                            all_observations.add(single_observation)                               
-                            all_observations.trim(1000)                             
+                            all_flight_observations.append(single_observation)
                         else: 
                             logger.error("Error in received flights data: %{url}s ".format(**flight)) 
+                my_observation_writer = flight_stream_helper.ObservationWriteOperations()
+                my_observation_writer.write_observations(all_flight_observations)
                     
             else:
                 logs_dict = {'url':cur_flight_url, 'status_code':flights_request.status_code}
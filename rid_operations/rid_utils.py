@@ -21,8 +21,13 @@ class RIDFlight(NamedTuple):
     most_recent_position: Position
     recent_paths: List[RIDPositions]
 
+class ClusterCorner(NamedTuple):
+    lat:float
+    lng:float
+
 class ClusterDetails(NamedTuple):
-    corners:List[Position]
+    ''' A rectangle with the number of flights in it, given by two opposite corners '''
+    corners:List[ClusterCorner]
     area_sqm: float
     number_of_flights: float
 
@@ -247,12 +252,6 @@ class FullRequestedFlightDetails:
   id: uuid
   telemetry_length: int
 
-
-@dataclass
-class RIDRecentAircraftPosition:
-  time:str
-  position:Position
-
 # @dataclass
 # class RIDOperatorDetails():
 #   operator_id: Optional[str]
@@ -68,10 +68,6 @@ def run_ussp_polling_for_rid():
 def poll_uss_for_flights_async():
     myDSSSubscriber = dss_rid_helper.RemoteIDOperations()
 
-    stream_ops = flight_stream_helper.StreamHelperOps()
-    pull_cg = stream_ops.get_pull_cg()
-    all_observations = pull_cg.all_observations
-
     # TODO: Get existing flight details from subscription
     r = get_redis()
     flights_dict = {}
@@ -84,7 +80,7 @@ def poll_uss_for_flights_async():
                 logger.debug('Flights Dict %s' % flights_dict)    
                 if bool(flights_dict):
                     subscription_id = key.split(':')[1]                    
-                    myDSSSubscriber.query_uss_for_rid(flights_dict, all_observations,subscription_id)
+                    myDSSSubscriber.query_uss_for_rid(flights_dict, subscription_id)
 
 
 @app.task(name='stream_rid_data')
@@ -135,15 +131,19 @@ def stream_rid_data_v22(rid_telemetry_observations):
 def stream_rid_telemetry_data(rid_telemetry_observations):
     my_database_writer = BlenderDatabaseWriter()
     telemetry_observations = json.loads(rid_telemetry_observations)
+    all_observations = []
+    updated_operation_ids = set()
 
     for observation in telemetry_observations:
         flight_details = observation["flight_details"]
         current_states = observation["current_states"]
         operation_id = flight_details["id"]
-        # Update telemetry received timestamp
-        my_database_writer.update_telemetry_timestamp(
-            flight_declaration_id=operation_id
-        )
+        # Update telemetry received timestamp, once per operation in this batch
+        if operation_id not in updated_operation_ids:
+            my_database_writer.update_telemetry_timestamp(
+                flight_declaration_id=operation_id
+            )
+            updated_operation_ids.add(operation_id)
 
         for current_state in current_states:
             observation_and_metadata = SignedUnsignedTelemetryObservation(
@@ -167,11 +167,12 @@ def stream_rid_telemetry_data(rid_telemetry_observations):
                 icao_address=icao_address,
                 metadata=json.dumps(asdict(observation_and_metadata)),
             )
-            msgid = write_incoming_air_traffic_data.delay(
-                json.dumps(asdict(so))
-            )  # Send a job to the task queue
-            logger.debug("Submitted observation..")
-            logger.debug("...")
+            all_observations.append(asdict(so))
+
+    # Write all the observations of this batch in a single pipeline
+    my_observation_writer = flight_stream_helper.ObservationWriteOperations()
+    my_observation_writer.write_observations(all_observations)
+    logger.debug("Submitted %s observations.." % len(all_observations))
 
 
 @app.task(name='stream_rid_test_data')
@@ -0,0 +1,48 @@
+from django.test import TestCase
+
+from rid_operations.cluster_ops import (
+    MIN_CLUSTER_SIZE_PERCENT,
+    get_clusters,
+    get_view_port_diagonal_km,
+    show_clusters_only,
+)
+
+
+class ClusterTests(TestCase):
+    def test_small_view_ports_show_flights(self):
+        self.assertFalse(show_clusters_only([46.95, 7.45, 46.96, 7.46]))
+        self.assertTrue(show_clusters_only([46.9, 7.4, 47.0, 7.5]))
+
+    def test_clusters_are_bounded_by_the_view_port(self):
+        view_port = [46.9, 7.4, 47.0, 7.5]
+        lats = [46.9 + (i % 100) * 0.001 for i in range(10000)]
+        lngs = [7.4 + (i // 100) * 0.001 for i in range(10000)]
+        clusters = get_clusters(view_port=view_port, lats=lats, lngs=lngs)
+
+        self.assertEqual(sum(c.number_of_flights for c in clusters), 10000)
+        # The number of clusters does not depend on the number of aircraft
+        max_cells = (100 // MIN_CLUSTER_SIZE_PERCENT) ** 2
+        self.assertLessEqual(len(clusters), max_cells)
+        min_size_km = (
+            get_view_port_diagonal_km(view_port) * MIN_CLUSTER_SIZE_PERCENT / 100
+        )
+        for cluster in clusters:
+            south_west, north_east = cluster.corners
+            self.assertGreaterEqual(
+                get_view_port_diagonal_km(
+                    [south_west.lat, south_west.lng, north_east.lat, south_west.lng]
+                ),
+                min_size_km,
+            )
+            self.assertGreater(cluster.area_sqm, 0)
+
+    def test_single_aircraft_cluster(self):
+        clusters = get_clusters(
+            view_port=[46.9, 7.4, 47.0, 7.5], lats=[46.951], lngs=[7.452]
+        )
+        self.assertEqual(len(clusters), 1)
+        south_west, north_east = clusters[0].corners
+        self.assertTrue(south_west.lat <= 46.951 <= north_east.lat)
+        self.assertTrue(south_west.lng <= 7.452 <= north_east.lng)
+        self.assertEqual(clusters[0].number_of_flights, 1)
+        self.assertEqual(get_clusters([46.9, 7.4, 47.0, 7.5], [], []), [])
@@ -3,6 +3,7 @@ from auth_helper.utils import requires_scopes
 import json
 from dataclasses import asdict, is_dataclass
 from . import view_port_ops
+from . import cluster_ops
 from rest_framework.decorators import api_view
 from django.http import JsonResponse
 from . import dss_rid_helper
@@ -156,12 +157,11 @@ def get_rid_data(request, subscription_id):
     if bool(flights_dict):
         # TODO for Pull operations Flights Dict is not being used at all
         all_flights_rid_data = []
-        stream_ops = flight_stream_helper.StreamHelperOps()
-        push_cg = stream_ops.push_cg()
+        # A snapshot: every request sees the current observations, they are not consumed
         obs_helper = flight_stream_helper.ObservationReadOperations()
-        all_flights_rid_data = obs_helper.get_observations(push_cg)
+        all_flights_rid_data = obs_helper.get_observations_snapshot()
 
-        return HttpResponse(json.dumps(all_flights_rid_data), status=200, content_type='application/json')
+        return HttpResponse(json.dumps(all_flights_rid_data, default=str), status=200, content_type='application/json')
     else:
         return HttpResponse(json.dumps({}), status=404, content_type='application/json')
 
@@ -260,25 +260,16 @@ def get_display_data(request):
             logger.debug(subscription_response)
 
         # TODO: Get existing flight details from subscription
-        stream_ops = flight_stream_helper.StreamHelperOps()
-        pull_cg = stream_ops.get_pull_cg()
-        all_streams_messages = pull_cg.read()
-        
-        unique_flights = []
-        # Keep only the latest message
-        try:
-            for message in all_streams_messages:     
-                if message.data != '':
-                    unique_flights.append({'timestamp': message.timestamp,'seq': message.sequence, 'msg_data':message.data, 'address':message.data['icao_address']})            
-            # sort by date
-            unique_flights.sort(key=lambda item:item['timestamp'], reverse=True)
-            # Keep only the latest message
-            distinct_messages = {i['address']:i for i in reversed(unique_flights)}.values()
-            
-        except KeyError as ke: 
-
-            logger.error("Error in sorting distinct messages, ICAO name not defined %s" % ke)                     
+        obs_helper = flight_stream_helper.ObservationReadOperations()
+        clusters = []
+        if cluster_ops.show_clusters_only(view_port):
+            # Large view ports only show clusters, they are made from the positions in the geo index without reading the observations
+            _, lats, lngs = obs_helper.get_positions_in_view_port(view_port=view_port)
+            clusters = cluster_ops.get_clusters(view_port=view_port, lats=lats, lngs=lngs)
             distinct_messages = []
+        else:
+            # The recent positions of every aircraft are kept on ingest and read with the latest observations
+            distinct_messages = obs_helper.get_latest_observations_in_view_port(view_port=view_port, include_recent_positions=True)
         rid_flights = []
         
         for all_observations_messages in distinct_messages:                   
@@ -289,19 +280,23 @@ def get_display_data(request):
             except KeyError as ke:
                 logger.error("Error in data in the stream %s" % ke)                
             else:
-                try:                
-                    observation_metadata = observation_data['metadata']
-                    observation_metadata_dict = json.loads(observation_metadata)
-                    recent_positions = observation_metadata_dict['recent_positions']
-
-                    for recent_position in recent_positions:    
-                        all_recent_positions.append(Position(lat=recent_position['position']['lat'], lng= recent_position['position']['lng'], alt = recent_position['position']['alt']))
-
+                for recent_position in all_observations_messages['recent_positions']:
+                    all_recent_positions.append(Position(lat=recent_position['lat'], lng=recent_position['lng'], alt=recent_position['alt']))
+                if not all_recent_positions:
+                    # Fall back to the recent positions sent by the USS, if any
+                    try:                
+                        observation_metadata = observation_data['metadata']
+                        observation_metadata_dict = json.loads(observation_metadata)
+                        recent_positions = observation_metadata_dict['recent_positions']
+
+                        for recent_position in recent_positions:    
+                            all_recent_positions.append(Position(lat=recent_position['position']['lat'], lng= recent_position['position']['lng'], alt = recent_position['position']['alt']))
+                        
+                    except KeyError as ke:
+                        logger.error("Error in metadata data in the stream %s" % ke)
+                if all_recent_positions:
                     recent_paths.append(RIDPositions(positions = all_recent_positions))
                     
-                except KeyError as ke:
-                    logger.error("Error in metadata data in the stream %s" % ke)
-                    
             
             most_recent_position = Position(lat=observation_data['lat_dd'], lng=observation_data['lon_dd'] ,alt= observation_data['altitude_mm'])
 
@@ -309,7 +304,7 @@ def get_display_data(request):
 
             rid_flights.append(current_flight)
         
-        rid_display_data = RIDDisplayDataResponse(flights=rid_flights, clusters = [])        
+        rid_display_data = RIDDisplayDataResponse(flights=rid_flights, clusters = clusters)        
         rid_flights_dict = my_rid_output_helper.make_json_compatible(rid_display_data)
         
         return JsonResponse({"flights":rid_flights_dict['flights'], "clusters": rid_flights_dict['clusters']},  status=200, content_type='application/json')
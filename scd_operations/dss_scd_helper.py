@@ -1,7 +1,7 @@
 import uuid
 from auth_helper.common import get_redis
 import json
-import requests
+from common.http_client import http_client
 import logging
 from dataclasses import asdict
 from typing import List
@@ -156,7 +156,7 @@ class SCDOperations():
         headers = {"Content-Type": "application/json", 'Authorization': 'Bearer ' + auth_token['access_token']}
         delete_payload = DeleteOperationalIntentConstuctor(entity_id= operational_intent_id, ovn = ovn)
 
-        dss_r = requests.delete(dss_opint_delete_url, json =json.loads(json.dumps(asdict(delete_payload))), headers=headers)
+        dss_r = http_client.delete(dss_opint_delete_url, json =json.loads(json.dumps(asdict(delete_payload))), headers=headers)
         
         dss_response = dss_r.json()
         dss_r_status_code = dss_r.status_code
@@ -197,7 +197,7 @@ class SCDOperations():
             area_of_interest = QueryOperationalIntentPayload(area_of_interest=volume)            
             logging.info("Querying DSS for operational intents in the area..")
             try:            
-                operational_intent_ref_response = requests.post(query_op_int_url, json =json.loads(json.dumps(asdict(area_of_interest))) , headers=headers)
+                operational_intent_ref_response = http_client.post(query_op_int_url, json =json.loads(json.dumps(asdict(area_of_interest))) , headers=headers, retry=True)
             except Exception as re:
                 logger.error("Error in getting operational intent for the volume %s " % re)            
             else:
@@ -215,7 +215,7 @@ class SCDOperations():
                 dss_op_int_details_url = self.dss_base_url + 'dss/v1/operational_intent_references/' + operational_intent_reference_detail['id']
                 # get new auth token for USS 
                 try:
-                    op_int_uss_details = requests.get(dss_op_int_details_url, headers=headers)
+                    op_int_uss_details = http_client.get(dss_op_int_details_url, headers=headers)
                 except Exception as e: 
                     logger.error("Error in getting operational intent details %s" % e)
                 else:
@@ -247,7 +247,7 @@ class SCDOperations():
                 uss_operational_intent_url = current_uss_operational_intent_detail.uss_base_url + '/uss/v1/operational_intents/'+ current_uss_operational_intent_detail.id
                 
                 try:
-                    uss_operational_intent_request = requests.get(uss_operational_intent_url, headers=uss_headers)
+                    uss_operational_intent_request = http_client.get(uss_operational_intent_url, headers=uss_headers)
                 except Exception as e:                     
                     logger.error("Error in getting operational intent id {uss_op_int_id} details from uss".format(uss_op_int_id= current_uss_operational_intent_detail.id))
                     logger.error("Error details %s " % e)
@@ -368,7 +368,7 @@ class SCDOperations():
         dss_response = {}
         if deconflicted:
             try:
-                dss_r = requests.put(new_operational_intent_ref_creation_url, json = opint_creation_payload , headers=headers)
+                dss_r = http_client.put(new_operational_intent_ref_creation_url, json = opint_creation_payload , headers=headers)
             except Exception as re:
                 logger.error("Error in putting operational intent in the DSS %s " % re)            
                 d_r = OperationalIntentSubmissionStatus(status = "failure", status_code = 500, message = re, dss_response={}, operational_intent_id = new_entity_id)
@@ -419,7 +419,7 @@ class SCDOperations():
 
 
 
-        uss_r = requests.post(
+        uss_r = http_client.post(
             notification_url,
             json=json.loads(json.dumps(asdict(notification_payload))),
             headers=headers,
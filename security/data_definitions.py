@@ -0,0 +1,24 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class PreparedSignature:
+    """A signature of a message that is ready to be checked: the key id, the signature base (the covered components of the message) and the signature"""
+
+    key_id: str
+    signature_base: bytes
+    signature: bytes
+
+
+@dataclass
+class VerificationPoolMetrics:
+    """The signatures being checked by the pool, how many were checked in the pool and inline (also because the pool was saturated or failed), the batches sent to the workers and the latency of recent checks in milliseconds"""
+
+    queue_depth: int
+    pool_verifications: int
+    inline_verifications: int
+    saturated_fallbacks: int
+    pool_error_fallbacks: int
+    batches: int
+    latency_p50_ms: float
+    latency_p99_ms: float
@@ -0,0 +1,188 @@
+"""
+A per-process cache of the parsed public keys (PublicKey rows) that signed messages are verified against, indexed by key id.
+
+The keys are loaded once and refreshed by a background thread: every PUBLIC_KEY_CACHE_REFRESH_SECS, and within PUBLIC_KEY_CACHE_VERSION_CHECK_SECS of a PublicKey being saved or deleted in any process (the change bumps a version in Redis). An unknown key id refreshes the keys at most once every PUBLIC_KEY_CACHE_MISS_REFRESH_SECS.
+"""
+
+import json
+import logging
+import threading
+import time
+from os import environ as env
+from typing import Dict, Optional
+
+import jwt
+import requests
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from dotenv import find_dotenv, load_dotenv
+
+from auth_helper.common import get_redis
+from non_repudiation.models import PublicKey
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+PUBLIC_KEY_CACHE_REFRESH_SECS = 300
+PUBLIC_KEY_CACHE_VERSION_CHECK_SECS = 5
+PUBLIC_KEY_CACHE_MISS_REFRESH_SECS = 5
+PUBLIC_KEYS_VERSION_KEY = "public_keys_version"
+# The JWK of a PublicKey is kept in Redis so that the URL is not requested by every process
+PUBLIC_KEY_JWK_KEY = "{public_key_id}-jwks"
+PUBLIC_KEY_JWK_EXPIRY_SECS = 60000
+
+
+def get_public_key_cache_refresh_interval() -> int:
+    return int(env.get("PUBLIC_KEY_CACHE_REFRESH_SECS", PUBLIC_KEY_CACHE_REFRESH_SECS))
+
+
+def find_jwk(jwks_data: dict, key_id: str) -> Optional[dict]:
+    """The JWK with the key id in a JWKS or a single JWK"""
+    if "keys" in jwks_data:
+        return next(
+            (item for item in jwks_data["keys"] if item.get("kid") == key_id), None
+        )
+    if jwks_data.get("kid") == key_id:
+        return jwks_data
+    return None
+
+
+class PublicKeyCache:
+    """The JWK and the parsed (RSA) public key of the active PublicKey rows by key id"""
+
+    def __init__(
+        self,
+        refresh_interval_secs: Optional[int] = None,
+        version_check_secs: float = PUBLIC_KEY_CACHE_VERSION_CHECK_SECS,
+        miss_refresh_secs: float = PUBLIC_KEY_CACHE_MISS_REFRESH_SECS,
+    ):
+        self.refresh_interval_secs = (
+            refresh_interval_secs or get_public_key_cache_refresh_interval()
+        )
+        self.version_check_secs = version_check_secs
+        self.miss_refresh_secs = miss_refresh_secs
+        # key id: (JWK, parsed public key)
+        self._keys: Optional[Dict[str, tuple]] = None
+        self._version = None
+        self._refreshed_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._refresher: Optional[threading.Thread] = None
+
+    def _fetch_jwks(self, public_keys) -> Dict[str, Optional[dict]]:
+        r = get_redis()
+        redis_keys = [
+            PUBLIC_KEY_JWK_KEY.format(public_key_id=public_key.id)
+            for public_key in public_keys
+        ]
+        stored_jwks = r.mget(redis_keys) if redis_keys else []
+        jwks = {}
+        session = requests.Session()
+        for public_key, redis_key, stored_jwk in zip(
+            public_keys, redis_keys, stored_jwks
+        ):
+            if stored_jwk is not None:
+                jwks[public_key.key_id] = json.loads(stored_jwk)
+                continue
+            try:
+                response = session.get(public_key.url, timeout=10)
+                jwk = find_jwk(response.json(), public_key.key_id)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(
+                    "Could not get the public key %s from %s: %s"
+                    % (public_key.key_id, public_key.url, e)
+                )
+                continue
+            r.set(redis_key, json.dumps(jwk), ex=PUBLIC_KEY_JWK_EXPIRY_SECS)
+            jwks[public_key.key_id] = jwk
+        return jwks
+
+    def refresh(self):
+        """Load and parse the active public keys"""
+        with self._refresh_lock:
+            version = get_redis().get(PUBLIC_KEYS_VERSION_KEY)
+            public_keys = list(PublicKey.objects.filter(is_active=1))
+            keys = {}
+            for key_id, jwk in self._fetch_jwks(public_keys).items():
+                if not jwk:
+                    continue
+                try:
+                    keys[key_id] = (
+                        jwk,
+                        jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk)),
+                    )
+                except (jwt.exceptions.InvalidKeyError, ValueError, KeyError) as e:
+                    logger.error("Could not parse the public key %s: %s" % (key_id, e))
+            self._keys = keys
+            self._version = version
+            self._refreshed_at = time.monotonic()
+
+    def invalidate(self):
+        self._keys = None
+
+    def _is_stale(self) -> bool:
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval_secs:
+            return True
+        return get_redis().get(PUBLIC_KEYS_VERSION_KEY) != self._version
+
+    def _refresh_periodically(self):
+        while True:
+            time.sleep(self.version_check_secs)
+            try:
+                if self._keys is not None and self._is_stale():
+                    self.refresh()
+            except Exception as e:
+                logger.error("Could not refresh the public keys: %s" % e)
+
+    def _start_refresher(self):
+        if self._refresher is None:
+            self._refresher = threading.Thread(
+                target=self._refresh_periodically, daemon=True
+            )
+            self._refresher.start()
+
+    def _get_keys(self) -> Dict[str, tuple]:
+        keys = self._keys
+        if keys is None:
+            self.refresh()
+            keys = self._keys
+            self._start_refresher()
+        return keys
+
+    def _get_entry(self, key_id: str) -> Optional[tuple]:
+        entry = self._get_keys().get(key_id)
+        if (
+            entry is None
+            and time.monotonic() - self._refreshed_at >= self.miss_refresh_secs
+        ):
+            # The key may have been added in another process since the last refresh
+            self.refresh()
+            entry = self._get_keys().get(key_id)
+        return entry
+
+    def get_public_key(self, key_id: str):
+        """The parsed public key of the key id, None if there is no active key with this id"""
+        entry = self._get_entry(key_id)
+        return entry[1] if entry else None
+
+    def get_jwk(self, key_id: str) -> Optional[dict]:
+        """The JWK of the key id, None if there is no active key with this id"""
+        entry = self._get_entry(key_id)
+        return entry[0] if entry else None
+
+    def get_jwks(self) -> Dict[str, dict]:
+        """The JWKs of the active public keys by key id"""
+        return {key_id: entry[0] for key_id, entry in self._get_keys().items()}
+
+
+public_key_cache = PublicKeyCache()
+
+
+@receiver(post_save, sender=PublicKey)
+@receiver(post_delete, sender=PublicKey)
+def invalidate_public_keys(sender, instance, **kwargs):
+    r = get_redis()
+    r.delete(PUBLIC_KEY_JWK_KEY.format(public_key_id=instance.id))
+    # Other processes refresh their keys once they see the new version
+    r.incr(PUBLIC_KEYS_VERSION_KEY)
+    public_key_cache.invalidate()
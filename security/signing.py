@@ -1,7 +1,9 @@
 import hashlib
 import json
 import logging
+from datetime import timedelta
 from os import environ as env
+from typing import List, Optional
 
 import http_sfv
 import jwt
@@ -15,13 +17,19 @@ from http_message_signatures import (
     HTTPMessageSigner,
     HTTPMessageVerifier,
     HTTPSignatureKeyResolver,
+    InvalidSignature,
     algorithms,
 )
 from jwcrypto import jwk, jws
 from jwcrypto.common import json_encode
 
-from auth_helper.common import get_redis
-from non_repudiation.models import PublicKey
+from .data_definitions import PreparedSignature
+from .public_key_cache import PublicKeyCache, public_key_cache
+from .verification_pool import (
+    SignatureVerificationPool,
+    check_signatures_inline,
+    get_verification_pool,
+)
 
 load_dotenv(find_dotenv())
 
@@ -47,61 +55,113 @@ class BlenderHTTPSignatureKeyResolver(HTTPSignatureKeyResolver):
         return private_key
 
 
+class CachedPublicKeyResolver(HTTPSignatureKeyResolver):
+    """Resolves the key id in the Signature-Input header to the cached public key"""
+
+    def __init__(self, key_cache: PublicKeyCache):
+        self.key_cache = key_cache
+
+    def resolve_public_key(self, key_id: str):
+        public_key = self.key_cache.get_public_key(key_id)
+        if public_key is None:
+            raise InvalidSignature("No active public key with the id %s" % key_id)
+        return public_key
+
+    def resolve_private_key(self, key_id: str):
+        """The resolver is only used to verify signatures, it has no private keys"""
+        raise InvalidSignature("CachedPublicKeyResolver only resolves public keys")
+
+
+class SignaturePreparingVerifier(HTTPMessageVerifier):
+    """Runs the checks of HTTPMessageVerifier.verify on a message but leaves the signature itself to be checked, in a batch or in the verification pool"""
+
+    # prepare repeats the steps of HTTPMessageVerifier.verify of http-message-signatures 0.4.4 and calls its private
+    # _parse_dict_header and _build_signature_base, which the library has no public API for. Compare it with verify
+    # (and run security/test_verification_pool.py) whenever the version pinned in requirements.txt changes.
+
+    def prepare(
+        self, message, max_age: timedelta = timedelta(days=1)
+    ) -> PreparedSignature:
+        sig_inputs = self._parse_dict_header("Signature-Input", message.headers)
+        if len(sig_inputs) != 1:
+            raise InvalidSignature("Multiple signatures are not supported")
+        signature = self._parse_dict_header("Signature", message.headers)
+        label, sig_input = next(iter(sig_inputs.items()))
+        self.validate_created_and_expires(sig_input, max_age=max_age)
+        if label not in signature:
+            raise InvalidSignature(
+                "Signature-Input contains a label not listed in Signature"
+            )
+        if "alg" in sig_input.params:
+            if sig_input.params["alg"] != self.signature_algorithm.algorithm_id:
+                raise InvalidSignature(
+                    "Unexpected algorithm specified in the signature"
+                )
+        key_id = sig_input.params["keyid"]
+        # Messages signed with an unknown key are rejected before they are queued
+        self.key_resolver.resolve_public_key(key_id)
+        for param in sig_input.params:
+            if param not in self.signature_metadata_parameters:
+                raise InvalidSignature(
+                    'Unexpected signature metadata parameter "%s"' % param
+                )
+        try:
+            signature_base, _, _ = self._build_signature_base(
+                message,
+                covered_component_ids=list(sig_input),
+                signature_params=sig_input.params,
+            )
+        except Exception as e:
+            raise InvalidSignature(e) from e
+        return PreparedSignature(
+            key_id=key_id,
+            signature_base=signature_base.encode(),
+            signature=signature[label].value,
+        )
+
+
 class MessageVerifier:
-    def get_public_keys(self):
-        r = get_redis()
-        public_keys = {}
-        s = requests.Session()
-        all_public_keys = PublicKey.objects.filter(is_active=1)
-        for current_public_key in all_public_keys:
-            redis_jwks_key = str(current_public_key.id) + "-jwks"
-            current_kid = current_public_key.key_id
-            if r.exists(redis_jwks_key):
-                k = r.get(redis_jwks_key)
-                key = json.loads(k)
-            else:
-                response = s.get(current_public_key.url)
-                jwks_data = response.json()
-                if "keys" in jwks_data:
-                    jwk = next(
-                        (
-                            item
-                            for item in jwks_data["keys"]
-                            if item["kid"] == current_kid
-                        ),
-                        None,
-                    )
-                else:
-                    if "kid" in jwks_data.keys():
-                        jwk = jwks_data if current_kid == jwks_data["kid"] else None
-                    else:
-                        jwk = None
-                key = jwk if jwk else {"000"}
-
-                r.set(redis_jwks_key, json.dumps(key))
-                r.expire(redis_jwks_key, 60000)
-            public_keys[current_kid] = key
-        return public_keys
+    def __init__(
+        self,
+        key_cache: PublicKeyCache = public_key_cache,
+        verification_pool: Optional[SignatureVerificationPool] = None,
+    ):
+        self.key_cache = key_cache
+        # The pool is only used if SIGNATURE_VERIFICATION_WORKERS is set
+        self.verification_pool = verification_pool or get_verification_pool(
+            key_cache=key_cache
+        )
 
-    def verify_message(self, request: HttpRequest) -> bool:
-        stored_public_keys = self.get_public_keys()
-        if bool(not stored_public_keys):
-            return False
+    def get_public_keys(self):
+        return self.key_cache.get_jwks()
 
+    def _prepare_signature(self, request: HttpRequest) -> Optional[PreparedSignature]:
         r = requests.Request(
             request.method,
             request.build_absolute_uri(),
             json=request.data,
             headers=request.headers,
         )
+        # The message is verified with the key named in the Signature-Input header only
+        verifier = SignaturePreparingVerifier(
+            signature_algorithm=algorithms.RSA_PSS_SHA512,
+            key_resolver=CachedPublicKeyResolver(key_cache=self.key_cache),
+        )
+        try:
+            return verifier.prepare(r)
+        except (InvalidSignature, KeyError) as e:
+            logger.info("Could not verify the signed message: %s" % e)
+            return None
+
+    def verify_messages(self, messages: List[HttpRequest]) -> List[bool]:
+        """Verify a batch of signed messages, the results are in the order of the messages"""
+        signatures = [self._prepare_signature(message) for message in messages]
+        if self.verification_pool is not None:
+            return self.verification_pool.verify(signatures)
+        return check_signatures_inline(signatures, key_cache=self.key_cache)
 
-        for _, json_web_token in stored_public_keys.items():
-            verifier = HTTPMessageVerifier(
-                signature_algorithm=algorithms.RSA_PSS_SHA512,
-                key_resolver=BlenderHTTPSignatureKeyResolver(jwk=json_web_token),
-            )
-            verifier.verify(r)
-        return True
+    def verify_message(self, request: HttpRequest) -> bool:
+        return self.verify_messages([request])[0]
 
 
 class ResponseSigner:
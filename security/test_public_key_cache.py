@@ -0,0 +1,110 @@
+import hashlib
+import json
+from unittest import mock
+
+import http_sfv
+import requests
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.test import TestCase
+from http_message_signatures import HTTPMessageSigner, InvalidSignature, algorithms
+
+import security.helper as helper
+from non_repudiation.models import PublicKey
+from security import public_key_cache
+from security.signing import CachedPublicKeyResolver, MessageVerifier
+from security.test_signing import _TestHTTPSignatureKeyResolver
+
+
+class _TestKeyIdResolver(_TestHTTPSignatureKeyResolver):
+    # Signs with the test key whatever the key id
+    def resolve_private_key(self, key_id: str):
+        return super().resolve_private_key("001")
+
+
+def make_signed_request(key_id: str):
+    payload = {"type_of_operation": 1, "originating_party": "TII"}
+    request = requests.Request(
+        "PUT",
+        "http://localhost:8000/flight_stream/set_signed_telemetry",
+        json=payload,
+    ).prepare()
+    data = json.dumps(payload, separators=(",", ":"))
+    request.headers["Content-Digest"] = str(
+        http_sfv.Dictionary({"sha-512": hashlib.sha512(data.encode()).digest()})
+    )
+    HTTPMessageSigner(
+        signature_algorithm=algorithms.RSA_PSS_SHA512,
+        key_resolver=_TestKeyIdResolver(),
+    ).sign(
+        request,
+        key_id=key_id,
+        covered_component_ids=(
+            "@method",
+            "@authority",
+            "@target-uri",
+            "content-digest",
+        ),
+        label="sig1",
+    )
+    return helper.http_request_to_django_request(request)
+
+
+class PublicKeyCacheTests(TestCase):
+    def setUp(self):
+        self.r = public_key_cache.get_redis()
+        self.public_key = PublicKey.objects.create(
+            key_id="001", url="http://localhost:8000/test.jwks"
+        )
+        self.addCleanup(self._delete_stored_jwk)
+        jwk = json.loads(
+            helper.get_jwk_from_public_pem_key(path="security/test_keys/001.pem")
+        )
+        self.r.set(self._get_stored_jwk_key(), json.dumps(dict(jwk, kid="001")))
+        self.key_cache = public_key_cache.PublicKeyCache()
+        # The background refresh is not started in the tests
+        patcher = mock.patch.object(self.key_cache, "_start_refresher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_stored_jwk_key(self):
+        return public_key_cache.PUBLIC_KEY_JWK_KEY.format(
+            public_key_id=self.public_key.id
+        )
+
+    def _delete_stored_jwk(self):
+        self.r.delete(self._get_stored_jwk_key())
+
+    def test_message_is_verified_with_the_key_in_the_signature_input(self):
+        verifier = MessageVerifier(key_cache=self.key_cache)
+        self.assertTrue(verifier.verify_message(make_signed_request("001")))
+        self.assertIsInstance(self.key_cache.get_public_key("001"), rsa.RSAPublicKey)
+        self.assertEqual(list(verifier.get_public_keys()), ["001"])
+
+    def test_keys_are_parsed_once(self):
+        verifier = MessageVerifier(key_cache=self.key_cache)
+        with mock.patch.object(
+            self.key_cache, "refresh", wraps=self.key_cache.refresh
+        ) as refresh:
+            for _ in range(3):
+                self.assertTrue(verifier.verify_message(make_signed_request("001")))
+        self.assertEqual(refresh.call_count, 1)
+
+    def test_unknown_key_is_not_verified(self):
+        verifier = MessageVerifier(key_cache=self.key_cache)
+        self.assertFalse(verifier.verify_message(make_signed_request("002")))
+
+    def test_deactivated_key_is_not_verified(self):
+        verifier = MessageVerifier(key_cache=self.key_cache)
+        self.assertIsNotNone(self.key_cache.get_public_key("001"))
+        self.assertFalse(self.key_cache._is_stale())
+
+        self.public_key.is_active = False
+        self.public_key.save()
+        # The saving process is invalidated, the others see a new version
+        self.assertTrue(self.key_cache._is_stale())
+        self.key_cache.refresh()
+        self.assertFalse(verifier.verify_message(make_signed_request("001")))
+
+    def test_resolver_has_no_private_keys(self):
+        with self.assertRaises(InvalidSignature):
+            CachedPublicKeyResolver(self.key_cache).resolve_private_key("001")
@@ -24,6 +24,7 @@ from http_message_signatures import (
     structures,
 )
 from jwcrypto import jwk, jws
+from jwt.algorithms import RSAAlgorithm
 
 import security.helper as helper
 from security.signing import MessageVerifier, ResponseSigner
@@ -168,15 +169,15 @@ class MessageVerifierTests(TestCase):
         assert self.request.headers.get("Signature-Input")
         assert self.request.headers.get("Signature")
 
-    @patch("security.signing.MessageVerifier.get_public_keys")
-    def test_verify_signed_message(self, mock_get_public_keys):
+    @patch("security.signing.PublicKeyCache.get_public_key")
+    def test_verify_signed_message(self, mock_get_public_key):
         """
         Test whether the signed request can be verified using the jwk of the public key
         """
         jwk = helper.get_jwk_from_public_pem_key(
             path=f"/app/security/test_keys/{self.key_id}.pem"
         )
-        mock_get_public_keys.return_value = {self.key_id: jwk}
+        mock_get_public_key.return_value = RSAAlgorithm.from_jwk(jwk)
 
         django_request = helper.http_request_to_django_request(self.request)
 
@@ -0,0 +1,122 @@
+import json
+import threading
+from unittest import mock
+
+from django.test import TestCase
+
+import security.helper as helper
+from non_repudiation.models import PublicKey
+from security import public_key_cache
+from security.signing import MessageVerifier
+from security.test_public_key_cache import make_signed_request
+from security.verification_pool import SignatureVerificationPool
+
+
+class SignatureVerificationPoolTests(TestCase):
+    def setUp(self):
+        self.r = public_key_cache.get_redis()
+        self.public_key = PublicKey.objects.create(
+            key_id="001", url="http://localhost:8000/test.jwks"
+        )
+        stored_jwk_key = public_key_cache.PUBLIC_KEY_JWK_KEY.format(
+            public_key_id=self.public_key.id
+        )
+        self.addCleanup(self.r.delete, stored_jwk_key)
+        jwk = json.loads(
+            helper.get_jwk_from_public_pem_key(path="security/test_keys/001.pem")
+        )
+        self.r.set(stored_jwk_key, json.dumps(dict(jwk, kid="001")))
+        self.key_cache = public_key_cache.PublicKeyCache()
+        patcher = mock.patch.object(self.key_cache, "_start_refresher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_verifier(self, max_queue_depth=None, workers=2):
+        pool = SignatureVerificationPool(
+            key_cache=self.key_cache, workers=workers, max_queue_depth=max_queue_depth
+        )
+        self.addCleanup(pool.shutdown)
+        return MessageVerifier(key_cache=self.key_cache, verification_pool=pool)
+
+    def _get_messages(self):
+        tampered = make_signed_request("001")
+        # The method is covered by the signature
+        tampered.method = "POST"
+        return [
+            make_signed_request("001"),
+            make_signed_request("002"),
+            tampered,
+            make_signed_request("001"),
+        ]
+
+    def test_results_are_in_the_order_of_the_batch(self):
+        verifier = self._get_verifier()
+        self.assertEqual(
+            verifier.verify_messages(self._get_messages()), [True, False, False, True]
+        )
+
+        metrics = verifier.verification_pool.get_metrics()
+        self.assertEqual(metrics.queue_depth, 0)
+        self.assertEqual(metrics.pool_verifications, 4)
+        self.assertEqual(metrics.saturated_fallbacks, 0)
+        self.assertGreater(metrics.latency_p99_ms, 0)
+
+    def test_concurrent_requests_are_batched(self):
+        verifier = self._get_verifier(workers=1)
+        verifier.verification_pool.metrics_log_secs = 0
+        # The key is loaded before the threads, which do not share the test database connection
+        self.key_cache.get_public_key("001")
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    verifier.verify_message(make_signed_request("001"))
+                )
+            )
+            for _ in range(8)
+        ]
+        with self.assertLogs("django", level="INFO") as logs:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, [True] * 8)
+        metrics = verifier.verification_pool.get_metrics()
+        self.assertEqual(metrics.pool_verifications, 8)
+        # The requests that arrive while the worker is busy share the next batch
+        self.assertLess(metrics.batches, 8)
+        self.assertIn("Signature verification pool metrics", logs.output[-1])
+
+    def test_pool_is_restarted_after_a_worker_dies(self):
+        verifier = self._get_verifier()
+        self.assertTrue(verifier.verify_message(make_signed_request("001")))
+        broken_executor = verifier.verification_pool._executor
+        for process in list(broken_executor._processes.values()):
+            process.kill()
+            process.join()
+
+        # The request of the broken pool is checked inline, the next one in a new pool
+        self.assertEqual(
+            verifier.verify_messages(self._get_messages()), [True, False, False, True]
+        )
+        self.assertTrue(verifier.verify_message(make_signed_request("001")))
+        self.assertIsNot(verifier.verification_pool._executor, broken_executor)
+
+        metrics = verifier.verification_pool.get_metrics()
+        self.assertEqual(metrics.pool_error_fallbacks, 1)
+        self.assertEqual(metrics.inline_verifications, 4)
+        self.assertEqual(metrics.pool_verifications, 2)
+
+    def test_saturated_pool_verifies_inline(self):
+        verifier = self._get_verifier(max_queue_depth=0)
+        self.assertEqual(
+            verifier.verify_messages(self._get_messages()), [True, False, False, True]
+        )
+        self.assertTrue(verifier.verify_message(make_signed_request("001")))
+
+        metrics = verifier.verification_pool.get_metrics()
+        self.assertEqual(metrics.pool_verifications, 0)
+        self.assertEqual(metrics.inline_verifications, 5)
+        self.assertEqual(metrics.saturated_fallbacks, 2)
+        self.assertIsNone(verifier.verification_pool._executor)
@@ -0,0 +1,325 @@
+"""
+An optional process pool to check the RSA-PSS-SHA512 signatures of signed messages in parallel, outside of the request workers.
+
+The pool is used by MessageVerifier when SIGNATURE_VERIFICATION_WORKERS is more than 0. The signatures of concurrent requests (the threads of a gthread worker) are collected into batches while the workers are busy, and every request gets its results in order. When more than SIGNATURE_VERIFICATION_MAX_QUEUE_DEPTH signatures are already being checked, or the pool fails (a worker died, the pool is restarted for the next batch), a request is checked inline instead. The metrics of the pool are logged every SIGNATURE_VERIFICATION_METRICS_LOG_SECS.
+"""
+
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
+from functools import partial
+from os import environ as env
+from typing import Dict, List, Optional, Tuple
+
+from cryptography.exceptions import InvalidSignature
+from dotenv import find_dotenv, load_dotenv
+from http_message_signatures import algorithms
+from jwt.algorithms import RSAAlgorithm
+
+from .data_definitions import PreparedSignature, VerificationPoolMetrics
+
+load_dotenv(find_dotenv())
+
+logger = logging.getLogger("django")
+
+SIGNATURE_VERIFICATION_WORKERS = 0
+SIGNATURE_VERIFICATION_MAX_QUEUE_DEPTH_PER_WORKER = 8
+SIGNATURE_VERIFICATION_METRICS_LOG_SECS = 60
+VERIFICATION_LATENCY_SAMPLES = 1000
+# The parsed public keys kept by a worker process
+WORKER_PUBLIC_KEY_CACHE_SIZE = 100
+
+_worker_public_keys: Dict[str, object] = {}
+
+
+def get_signature_verification_workers() -> int:
+    return int(
+        env.get("SIGNATURE_VERIFICATION_WORKERS", SIGNATURE_VERIFICATION_WORKERS)
+    )
+
+
+def get_signature_verification_max_queue_depth(workers: int) -> int:
+    return int(
+        env.get(
+            "SIGNATURE_VERIFICATION_MAX_QUEUE_DEPTH",
+            workers * SIGNATURE_VERIFICATION_MAX_QUEUE_DEPTH_PER_WORKER,
+        )
+    )
+
+
+def check_signature(public_key, signature_base: bytes, signature: bytes) -> bool:
+    try:
+        algorithms.RSA_PSS_SHA512(public_key=public_key).verify(
+            signature=signature, message=signature_base
+        )
+    except InvalidSignature:
+        return False
+    return True
+
+
+def _load_worker_public_key(jwk: str):
+    public_key = _worker_public_keys.get(jwk)
+    if public_key is None:
+        if len(_worker_public_keys) >= WORKER_PUBLIC_KEY_CACHE_SIZE:
+            _worker_public_keys.clear()
+        public_key = _worker_public_keys[jwk] = RSAAlgorithm.from_jwk(jwk)
+    return public_key
+
+
+def _check_signatures(
+    jwks: List[str], signature_bases: List[bytes], signatures: List[bytes]
+) -> List[bool]:
+    # Runs in a worker process
+    return [
+        check_signature(_load_worker_public_key(jwk), signature_base, signature)
+        for jwk, signature_base, signature in zip(jwks, signature_bases, signatures)
+    ]
+
+
+def check_signatures_inline(
+    signatures: List[Optional[PreparedSignature]], key_cache
+) -> List[bool]:
+    """Check the signatures in this process, a signature that could not be prepared (None) or with an unknown key is not valid"""
+    results = []
+    for signature in signatures:
+        public_key = key_cache.get_public_key(signature.key_id) if signature else None
+        results.append(
+            public_key is not None
+            and check_signature(
+                public_key, signature.signature_base, signature.signature
+            )
+        )
+    return results
+
+
+class SignatureVerificationPool:
+    """Checks the signatures of concurrent requests in worker processes, with the public keys of the key cache.
+
+    The signatures of all the requests that arrive while the workers are busy are sent to the next free worker as one batch, so under load the cost of a round trip to a worker is shared by many requests while a single request at a time is not delayed.
+    """
+
+    def __init__(
+        self,
+        key_cache,
+        workers: int,
+        max_queue_depth: Optional[int] = None,
+        metrics_log_secs: Optional[float] = None,
+    ):
+        self.key_cache = key_cache
+        self.workers = workers
+        self.max_queue_depth = (
+            max_queue_depth
+            if max_queue_depth is not None
+            else get_signature_verification_max_queue_depth(workers)
+        )
+        self.metrics_log_secs = (
+            metrics_log_secs
+            if metrics_log_secs is not None
+            else float(
+                env.get(
+                    "SIGNATURE_VERIFICATION_METRICS_LOG_SECS",
+                    SIGNATURE_VERIFICATION_METRICS_LOG_SECS,
+                )
+            )
+        )
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._batch_ready = threading.Condition(self._lock)
+        # The signatures waiting for a worker: (jwk, signature, future of the result)
+        self._pending: List[Tuple[str, PreparedSignature, Future]] = []
+        self._batches_in_flight = 0
+        self._dispatcher: Optional[threading.Thread] = None
+        self._queue_depth = 0
+        self._pool_verifications = 0
+        self._inline_verifications = 0
+        self._saturated_fallbacks = 0
+        self._pool_error_fallbacks = 0
+        self._batches = 0
+        self._latencies = deque(maxlen=VERIFICATION_LATENCY_SAMPLES)
+        self._metrics_logged_at = time.monotonic()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # The workers do not need (and should not inherit) the state of the Django process
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor):
+        # A worker that died (e.g. killed when out of memory) breaks the executor for good, the next batch starts a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        logger.warning("A signature verification worker died, restarting the pool")
+        executor.shutdown(wait=False)
+
+    def _start_dispatcher(self):
+        # Called with the lock held
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(
+                target=self._dispatch, name="signature-verification", daemon=True
+            )
+            self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            with self._batch_ready:
+                while not self._pending or self._batches_in_flight >= self.workers:
+                    self._batch_ready.wait()
+                batch = self._pending
+                self._pending = []
+                self._batches_in_flight += 1
+                self._batches += 1
+            executor = None
+            try:
+                executor = self._get_executor()
+                future = executor.submit(
+                    _check_signatures,
+                    [jwk for jwk, _, _ in batch],
+                    [signature.signature_base for _, signature, _ in batch],
+                    [signature.signature for _, signature, _ in batch],
+                )
+            except Exception as e:
+                self._complete_batch(batch, executor, None, error=e)
+            else:
+                future.add_done_callback(partial(self._complete_batch, batch, executor))
+
+    def _complete_batch(
+        self,
+        batch: List[Tuple[str, PreparedSignature, Future]],
+        executor: Optional[ProcessPoolExecutor],
+        future: Optional[Future],
+        error: Optional[BaseException] = None,
+    ):
+        with self._batch_ready:
+            self._batches_in_flight -= 1
+            self._batch_ready.notify()
+        if error is None:
+            error = future.exception()
+        if isinstance(error, BrokenProcessPool) and executor is not None:
+            self._discard_executor(executor)
+        if error is not None:
+            for _, _, result in batch:
+                result.set_exception(error)
+            return
+        for (_, _, result), is_valid in zip(batch, future.result()):
+            result.set_result(is_valid)
+
+    def _check_in_pool(
+        self, signatures: List[Optional[PreparedSignature]]
+    ) -> List[bool]:
+        results = [False] * len(signatures)
+        queued = []
+        for index, signature in enumerate(signatures):
+            jwk = self.key_cache.get_jwk(signature.key_id) if signature else None
+            if jwk is not None:
+                queued.append(
+                    (index, (json.dumps(jwk, sort_keys=True), signature, Future()))
+                )
+        if not queued:
+            return results
+
+        with self._batch_ready:
+            self._pending.extend(entry for _, entry in queued)
+            self._start_dispatcher()
+            self._batch_ready.notify()
+        for index, (_, _, result) in queued:
+            results[index] = result.result()
+        return results
+
+    def verify(self, signatures: List[Optional[PreparedSignature]]) -> List[bool]:
+        """Check the signatures of a request (or of a batch of messages), the results are in the order of the signatures"""
+        start = time.perf_counter()
+        with self._lock:
+            saturated = self._queue_depth + len(signatures) > self.max_queue_depth
+            if not saturated:
+                self._queue_depth += len(signatures)
+
+        pool_failed = False
+        if saturated:
+            results = check_signatures_inline(signatures, key_cache=self.key_cache)
+        else:
+            try:
+                results = self._check_in_pool(signatures)
+            except Exception as e:
+                # The request does not fail with the pool, its signatures are checked inline
+                logger.error(
+                    "Signature verification pool failed, checking inline: %s" % e
+                )
+                pool_failed = True
+                results = check_signatures_inline(signatures, key_cache=self.key_cache)
+            finally:
+                with self._lock:
+                    self._queue_depth -= len(signatures)
+
+        with self._lock:
+            if saturated or pool_failed:
+                self._inline_verifications += len(signatures)
+                if saturated:
+                    self._saturated_fallbacks += 1
+                else:
+                    self._pool_error_fallbacks += 1
+            else:
+                self._pool_verifications += len(signatures)
+            self._latencies.append((time.perf_counter() - start) * 1000)
+            log_metrics = (
+                time.monotonic() - self._metrics_logged_at >= self.metrics_log_secs
+            )
+            if log_metrics:
+                self._metrics_logged_at = time.monotonic()
+        if log_metrics:
+            logger.info(
+                "Signature verification pool metrics: %s" % asdict(self.get_metrics())
+            )
+        return results
+
+    def get_metrics(self) -> VerificationPoolMetrics:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return VerificationPoolMetrics(
+                queue_depth=self._queue_depth,
+                pool_verifications=self._pool_verifications,
+                inline_verifications=self._inline_verifications,
+                saturated_fallbacks=self._saturated_fallbacks,
+                pool_error_fallbacks=self._pool_error_fallbacks,
+                batches=self._batches,
+                latency_p50_ms=_percentile(latencies, 0.5),
+                latency_p99_ms=_percentile(latencies, 0.99),
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+_verification_pool: Optional[SignatureVerificationPool] = None
+_verification_pool_lock = threading.Lock()
+
+
+def get_verification_pool(key_cache) -> Optional[SignatureVerificationPool]:
+    """The verification pool of this process, None if SIGNATURE_VERIFICATION_WORKERS is 0"""
+    global _verification_pool
+    workers = get_signature_verification_workers()
+    if workers <= 0:
+        return None
+    with _verification_pool_lock:
+        if _verification_pool is None:
+            _verification_pool = SignatureVerificationPool(
+                key_cache=key_cache, workers=workers
+            )
+    return _verification_pool
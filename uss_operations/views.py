@@ -10,13 +10,12 @@ from django.http import JsonResponse
 from django.utils.datastructures import MultiValueDictKeyError
 from .uss_data_definitions import OperationalIntentNotFoundResponse, OperationalIntentDetails, UpdateOperationalIntent, GenericErrorResponseMessage, SummaryFlightsOnly,OperatorDetailsSuccessResponse, FlightDetailsNotFoundMessage
 from scd_operations.data_definitions import OperationalIntentDetailsUSSResponse, OperationalIntentUSSDetails, OperationalIntentReferenceDSSResponse, Time
-from rid_operations.rid_utils import RIDAuthData, RIDAircraftPosition, RIDHeight, RIDAircraftState, RIDOperatorDetails, RIDFlightResponse, LatLngPoint, RIDOperatorDetails, TelemetryFlightDetails
+from rid_operations.rid_utils import RIDAuthData, RIDAircraftPosition, RIDHeight, RIDAircraftState, RIDOperatorDetails, RIDFlightResponse, LatLngPoint, RIDOperatorDetails, TelemetryFlightDetails, RIDRecentAircraftPosition
 import arrow
 import json 
 import logging 
 from auth_helper.common import get_redis
 from flight_feed_operations import flight_stream_helper
-from shapely.geometry import Point
 from encoders import EnhancedJSONEncoder
 
 load_dotenv(find_dotenv())
@@ -100,7 +99,7 @@ def get_uss_flights(request):
     
     ''' This is the end point for the rid_qualifier to get details of a flight '''
     try: 
-        include_recent_positions = request.query_params['include_recent_positions']
+        include_recent_positions = request.query_params['include_recent_positions'] in ['true', 'True', '1']
     except MultiValueDictKeyError as mvke: 
         include_recent_positions = False
 
@@ -126,38 +125,12 @@ def get_uss_flights(request):
         
     summary_information_only = True if view_port_area > 22500 else False
 
-    stream_ops = flight_stream_helper.StreamHelperOps()
-    pull_cg = stream_ops.get_pull_cg()
-    all_streams_messages = pull_cg.read()
-    unique_flights =[]
-    distinct_messages = []
-    # Keep only the latest message
-    
-    for message in all_streams_messages:        
-        message_exist = message.data.get('icao_address', None) or None   
-        if message_exist:
-            lat = float(message.data['lat_dd'])
-            lng = float(message.data['lon_dd'])
-            point = Point(lat, lng)
-            point_in_polygon = view_box.contains(point)
-            # logging.debug(point_in_polygon)
-            if point_in_polygon:
-                unique_flights.append({'timestamp': message.timestamp,'seq': message.sequence, 'msg_data':message.data, 'address':message.data['icao_address']})
-            else:
-                logging.info("Point not in polygon %s "% view_box)
-    # sort by date
-    unique_flights.sort(key=lambda item:item['timestamp'], reverse=True)
-    
+    obs_helper = flight_stream_helper.ObservationReadOperations()
+    # The latest observations have one (most recent) message per aircraft in the view port
+    distinct_messages = obs_helper.get_latest_observations_in_view_port(view_port=view_port, include_recent_positions=include_recent_positions)
+
     now = arrow.now().isoformat()
-    if unique_flights:
-        # Keep only the latest message
-        distinct_messages = {i['address']:i for i in reversed(unique_flights)}.values()
-        
-        # except KeyError as ke: 
-        #     logger.error("Error in sorting distinct messages, key %s name not found" % ke)   
-        #     error_msg = GenericErrorResponseMessage(message="Error in retrieving flight data")
-        #     return JsonResponse(json.loads(json.dumps(asdict(error_msg))), status=500)
-            
+    if distinct_messages:
         for all_observations_messages in distinct_messages:    
             if summary_information_only:
                 summary = SummaryFlightsOnly(number_of_flights=len(distinct_messages))
@@ -186,7 +159,12 @@ def get_uss_flights(request):
 
                     operator_details = RIDOperatorDetails(id = details_response_dict['id'],operator_location = LatLngPoint(lat=details_response_dict['operator_location']['lat'], lng = details_response_dict['operator_location']['lng']), operator_id = details_response_dict['operator_id'],operation_description =details_response_dict['operation_description'], serial_number = details_response_dict['serial_number'], registration_number = details_response_dict['registration_number'], auth_data =RIDAuthData(format =details_response_dict['auth_data']['format'] , data= details_response_dict['auth_data']['data']),aircraft_type = details_response_dict['aircraft_type'] )
                     
-                    current_flight = TelemetryFlightDetails(operator_details= operator_details, id=details_response_dict['id'], aircraft_type="NotDeclared", current_state = current_state , simulated = True, recent_positions=[])
+                    # The recent positions are kept for every aircraft on ingest
+                    recent_positions = []
+                    if include_recent_positions:
+                        for recent_position in all_observations_messages['recent_positions']:
+                            recent_positions.append(RIDRecentAircraftPosition(time=recent_position['time'], position=RIDAircraftPosition(lat=recent_position['lat'], lng=recent_position['lng'], alt=recent_position['alt'], accuracy_h='HAUnknown', accuracy_v='VAUnknown', extrapolated=False, pressure_altitude=None)))
+                    current_flight = TelemetryFlightDetails(operator_details= operator_details, id=details_response_dict['id'], aircraft_type="NotDeclared", current_state = current_state , simulated = True, recent_positions=recent_positions)
 
                     rid_flights.append(current_flight)
                     # see if it matches the viewport 